@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import os
+import logging
+from timeit import default_timer as timer
+
+import metax
+from metax import Logging
+from metax import Exceptions
+from metax import Utilities
+from metax import MatrixManager
+from metax import BinaryMatrixManager
+
+def run(args):
+    if os.path.exists(args.output):
+        logging.info("%s already exists, delete it or move it if you want it generated again", args.output)
+        return
+
+    start = timer()
+    Utilities.ensure_requisite_folders(args.output)
+    definition = {
+        MatrixManager.K_MODEL: args.model_column,
+        MatrixManager.K_ID1: args.id1_column,
+        MatrixManager.K_ID2: args.id2_column,
+        MatrixManager.K_VALUE: args.value_column
+    }
+    logging.info("Converting %s", args.input)
+    BinaryMatrixManager.build_binary_matrix(args.input, args.output, definition, args.dtype)
+    end = timer()
+    logging.info("Converted matrix in %s seconds" % (str(end - start)))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="CovarianceToBinary.py %s: Convert a text covariance (GENE RSID1 RSID2 VALUE) into an indexed binary file "
+                                     "that SPrediXcan/MetaMany/SMulTiXcan can use instead of the text file." % (metax.__version__))
+    parser.add_argument("--input", help="Text matrix file, i.e. a snp covariance")
+    parser.add_argument("--output", help="Where to save the binary matrix")
+    parser.add_argument("--dtype", help="Precision of stored values", choices=["float32", "float64"], default="float64")
+    parser.add_argument("--model_column", help="Name of the column with the model (gene) key", default="GENE")
+    parser.add_argument("--id1_column", help="Name of the column with the first id", default="RSID1")
+    parser.add_argument("--id2_column", help="Name of the column with the second id", default="RSID2")
+    parser.add_argument("--value_column", help="Name of the column with the values", default="VALUE")
+    parser.add_argument("--verbosity", help="Log verbosity level. 1 is everything being logged. 10 is only high level messages, above 10 will hardly log anything", default = "10")
+    parser.add_argument("--throw", action="store_true", help="Throw exception on error", default=False)
+
+    args = parser.parse_args()
+
+    Logging.configureLogging(int(args.verbosity))
+    if args.throw:
+        run(args)
+    else:
+        try:
+            run(args)
+        except Exceptions.ReportableException as e:
+            logging.error(e.msg)
+        except Exception as e:
+            logging.info("Unexpected error: %s" % str(e))
+            exit(1)
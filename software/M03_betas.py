@@ -4,9 +4,8 @@ This module contains high level code to parse GWAS/GWAMA summary statistics file
 You can use it as stand alone tool to align it to Predictdb Models or jus tconvert the format,
 or it can be called from another script to load the data into memory
 
-TODO:
-    Implement "streaming read" where the whole file is not read at once, and output as data is read from file.
-    (mostly meant to make the unfiltered operation of this script have less memory footprint)
+With --chunk_size, the input is read and the output written a piece at a time ("streaming read"),
+so that memory footprint does not grow with the input size.
 
 """
 __author__ = 'heroico'
@@ -32,36 +31,65 @@ from metax import Exceptions
 
 def build_betas(args, model, gwas_format, name, model_snp_map):
     logging.info("Building beta for %s and %s", name, args.model_db_path if args.model_db_path else "no database")
+    snps = model.snps() if model else None
+    b = load_betas(args, gwas_format, name, model_snp_map, snps)
+    return align_betas(b, model, GWASUtilities.match_strand(args))
 
+def load_betas(args, gwas_format, name, model_snp_map, snps=None):
+    """Model-independent part of the GWAS processing: parsing, cleaning and (optional) variant mapping."""
     load_from = os.path.join(args.gwas_folder, name) if args.gwas_folder else name
 
-    snps = model.snps() if model else None
     b = GWAS.load_gwas(load_from, gwas_format, snps=snps, separator=args.separator,
-            skip_until_header=args.skip_until_header, handle_empty_columns=args.handle_empty_columns, input_pvalue_fix=args.input_pvalue_fix, keep_non_rsid=args.keep_non_rsid)
+            skip_until_header=args.skip_until_header, handle_empty_columns=args.handle_empty_columns, input_pvalue_fix=args.input_pvalue_fix, keep_non_rsid=args.keep_non_rsid,
+            cache_folder=GWASUtilities.gwas_cache_folder(args))
 
     if model_snp_map:
-        logging.info("Loading mapping")
-        PF = PredictionModel.WDBQF
-        snp_map = pandas.read_table(model_snp_map)
-        snp_map_ = snp_map.rename(columns={"a0":PF.K_NON_EFFECT_ALLELE, "a1":PF.K_EFFECT_ALLELE})[[PF.K_RSID, PF.K_EFFECT_ALLELE, PF.K_NON_EFFECT_ALLELE, "panel_variant_id", "panel_variant_a0", "panel_variant_a1", "swap"]].drop_duplicates()
-
-        logging.info("Mapping variants")
-        columns = [x for x in b.columns.values]
-        b = GWASAndModels.align_data_to_alleles(b, snp_map_, Constants.SNP, PF.K_RSID)
-        if GWAS.ZSCORE in b:
-            b = b.assign(zscore = b.zscore * b.swap)
-        if GWAS.BETA in b:
-            b = b.assign(beta = b.beta * b.swap)
-        b = b.rename(columns={GWAS.SNP:"gwas_snp", GWAS.EFFECT_ALLELE:"gwas_effect_allele", GWAS.NON_EFFECT_ALLELE:"gwas_non_effect_allele"})\
-                .drop(columns=[GWASAndModels.EA_BASE, GWASAndModels.NEA_BASE])\
-                .rename(columns={"panel_variant_id":GWAS.SNP, "panel_variant_a0":GWASAndModels.NEA, "panel_variant_a1":GWASAndModels.EA})\
-                [["gwas_snp", "gwas_effect_allele", "gwas_non_effect_allele"]+columns]
+        b = map_variants(b, load_snp_map(model_snp_map), GWASUtilities.match_strand(args))
+    return b
+
+def load_betas_chunks(args, gwas_format, name, model_snp_map, snps=None):
+    """Same as `load_betas`, but yields the results in pieces of at most `args.chunk_size` input lines"""
+    load_from = os.path.join(args.gwas_folder, name) if args.gwas_folder else name
+    snp_map = load_snp_map(model_snp_map) if model_snp_map else None
+
+    for b in GWAS.load_gwas_chunks(load_from, gwas_format, snps=snps, separator=args.separator,
+            skip_until_header=args.skip_until_header, handle_empty_columns=args.handle_empty_columns, input_pvalue_fix=args.input_pvalue_fix, keep_non_rsid=args.keep_non_rsid,
+            chunk_size=args.chunk_size):
+        if snp_map is not None:
+            b = map_variants(b, snp_map, GWASUtilities.match_strand(args))
+        yield b
+
+def load_snp_map(model_snp_map):
+    logging.info("Loading mapping")
+    PF = PredictionModel.WDBQF
+    snp_map = pandas.read_table(model_snp_map)
+    return snp_map.rename(columns={"a0":PF.K_NON_EFFECT_ALLELE, "a1":PF.K_EFFECT_ALLELE})[[PF.K_RSID, PF.K_EFFECT_ALLELE, PF.K_NON_EFFECT_ALLELE, "panel_variant_id", "panel_variant_a0", "panel_variant_a1", "swap"]].drop_duplicates()
+
+def map_variants(b, snp_map, match_strand=False):
+    logging.info("Mapping variants")
+    PF = PredictionModel.WDBQF
+    columns = [x for x in b.columns.values]
+    b = GWASAndModels.align_data_to_alleles(b, snp_map, Constants.SNP, PF.K_RSID, match_strand)
+    if GWAS.ZSCORE in b:
+        b = b.assign(zscore = b.zscore * b.swap)
+    if GWAS.BETA in b:
+        b = b.assign(beta = b.beta * b.swap)
+    b = b.rename(columns={GWAS.SNP:"gwas_snp", GWAS.EFFECT_ALLELE:"gwas_effect_allele", GWAS.NON_EFFECT_ALLELE:"gwas_non_effect_allele"})\
+            .drop(columns=[GWASAndModels.EA_BASE, GWASAndModels.NEA_BASE])\
+            .rename(columns={"panel_variant_id":GWAS.SNP, "panel_variant_a0":GWASAndModels.NEA, "panel_variant_a1":GWASAndModels.EA})\
+            [["gwas_snp", "gwas_effect_allele", "gwas_non_effect_allele"]+columns]
+    return b
 
+def align_betas(b, model, match_strand=False):
+    """
+    Model-dependent part of the GWAS processing: alignment to the model's alleles. Does not modify the input.
+    With `match_strand`, alleles on the opposite strand are matched too (see `GWASAndModels.align_data_to_alleles`).
+    """
     if model is not None:
         logging.info("Aligning GWAS to models")
         PF = PredictionModel.WDBQF
         base = model.weights[[PF.K_RSID, PF.K_EFFECT_ALLELE, PF.K_NON_EFFECT_ALLELE]].drop_duplicates()
-        b = GWASAndModels.align_data_to_alleles(b, base, Constants.SNP, PF.K_RSID)
+        b = GWASAndModels.align_data_to_alleles(b, base, Constants.SNP, PF.K_RSID, match_strand)
         b = b.drop(columns=[GWASAndModels.EA_BASE, GWASAndModels.NEA_BASE])
 
     b = b.fillna("NA")
@@ -74,18 +102,7 @@ def build_betas(args, model, gwas_format, name, model_snp_map):
 
     return b
 
-def validate(args):
-    if (args.gwas_file and args.gwas_folder) or (not args.gwas_file and  not args.gwas_folder):
-        raise Exceptions.InvalidArguments("Provide either (--gwas_file) or (--gwas_folder [--gwas_file_pattern])")
-
-def run(args):
-    start = timer()
-    validate(args)
-
-    if args.output_folder and args.output:
-        logging.info("Specify either --output_folder or --output, not both")
-        return
-
+def _gwas_names(args):
     if args.gwas_folder:
         regexp = re.compile(args.gwas_file_pattern) if args.gwas_file_pattern else  None
         names = Utilities.contentsWithRegexpFromFolder(args.gwas_folder, regexp)
@@ -96,10 +113,56 @@ def run(args):
             raise Exceptions.ReportableException(msg)
     else:
         names = [args.gwas_file]
+    return names
 
+def _gwas_format(args):
     gwas_format = GWASUtilities.gwas_format_from_args(args)
     GWAS.validate_format_basic(gwas_format)
     GWAS.validate_format_for_strict(gwas_format)
+    return gwas_format
+
+def load_gwas(args, snps=None):
+    """
+    Parses and cleans the input gwas, without aligning it to any model.
+    The result can be given to `run` (as `_gwas`) for any number of models, so that the input is read only once.
+    :param snps: if given, only these snps are kept.
+    """
+    start = timer()
+    validate(args)
+    names = _gwas_names(args)
+    gwas_format = _gwas_format(args)
+    r = pandas.concat([load_betas(args, gwas_format, name, args.snp_map_file, snps) for name in names])
+    end = timer()
+    logging.info("Successfully loaded input gwas in %s seconds"%(str(end-start)))
+    return r
+
+def validate(args):
+    if (args.gwas_file and args.gwas_folder) or (not args.gwas_file and  not args.gwas_folder):
+        raise Exceptions.InvalidArguments("Provide either (--gwas_file) or (--gwas_folder [--gwas_file_pattern])")
+
+def _streaming(args):
+    return hasattr(args, "chunk_size") and args.chunk_size
+
+def run(args, _gwas=None):
+    """
+    :param _gwas: optionally, the input gwas as loaded by `load_gwas`; it is then only aligned to the model.
+    """
+    start = timer()
+    validate(args)
+
+    if args.output_folder and args.output:
+        logging.info("Specify either --output_folder or --output, not both")
+        return
+
+    if _gwas is not None and not (args.output_folder or args.output):
+        model = PredictionModel.load_model(args.model_db_path, args.model_db_snp_key) if args.model_db_path else None
+        r = align_betas(_gwas, model, GWASUtilities.match_strand(args))
+        end = timer()
+        logging.info("Successfully aligned input gwas in %s seconds"%(str(end-start)))
+        return r
+
+    names = _gwas_names(args)
+    gwas_format = _gwas_format(args)
     model = PredictionModel.load_model(args.model_db_path, args.model_db_snp_key) if args.model_db_path else None
 
     if args.output_folder or args.output:
@@ -120,17 +183,28 @@ def run(args):
                 logging.info("%s already exists, delete it if you want it to be done again", output_path)
                 continue
 
-            b = build_betas(args, model, gwas_format, name, args.snp_map_file)
             c = "gzip" if ".gz" in output_path else None
-            logging.info("Saving %s", output_path)
-            b.to_csv(output_path, sep="\t", index=False, compression=c, mode=m)
+            if _streaming(args):
+                logging.info("Building beta for %s and %s, saving to %s as it is read", name, args.model_db_path if args.model_db_path else "no database", output_path)
+                snps = model.snps() if model else None
+                for j,b in enumerate(load_betas_chunks(args, gwas_format, name, args.snp_map_file, snps)):
+                    b = align_betas(b, model, GWASUtilities.match_strand(args))
+                    b.to_csv(output_path, sep="\t", index=False, compression=c, mode=m if j==0 else "a", header=(j==0))
+            else:
+                b = build_betas(args, model, gwas_format, name, args.snp_map_file)
+                logging.info("Saving %s", output_path)
+                b.to_csv(output_path, sep="\t", index=False, compression=c, mode=m)
         end = timer()
         logging.info("Successfully ran GWAS input processing in %s seconds" %(str(end - start)))
     else:
         r = []
         for name in names:
-            b = build_betas(args, model, gwas_format, name, args.snp_map_file)
-            r.append(b)
+            if _streaming(args):
+                snps = model.snps() if model else None
+                r.extend(align_betas(b, model, GWASUtilities.match_strand(args)) for b in load_betas_chunks(args, gwas_format, name, args.snp_map_file, snps))
+            else:
+                b = build_betas(args, model, gwas_format, name, args.snp_map_file)
+                r.append(b)
         r = pandas.concat(r)
         end = timer()
         logging.info("Successfully parsed input gwas in %s seconds"%(str(end-start)))
@@ -161,6 +235,10 @@ if __name__ == "__main__":
 
     parser.add_argument("--output", help="name of file to put results in")
 
+    parser.add_argument("--chunk_size", type=int, default=None,
+                        help="If set, read the input GWAS this many lines at a time, only in the declared columns, and write the output as it is processed."
+                        " Memory use is then bounded regardless of the input size.")
+
     GWASUtilities.add_gwas_arguments_to_parser(parser)
 
     parser.add_argument("--verbosity",
@@ -6,6 +6,7 @@ __version__ = metax.__version__
 import logging
 import os
 import sqlite3
+import multiprocessing
 import pandas as pd
 import numpy as np
 from scipy.stats import chi2
@@ -15,6 +16,7 @@ from timeit import default_timer as timer
 from metax import Logging
 from metax import Utilities
 from metax import Exceptions
+from metax import MatrixManager
 from metax.metaxcan import AssociationCalculation
 from metax.metaxcan import Utilities as MetaxcanUtilities
 
@@ -55,18 +57,10 @@ def correct_inf_phi(xcan_df, predict_db, N, h2):
     logging.info("The pvalue and zscore have been calibrated successfully")
     return xcan_df
 
-def run_metaxcan(args, context):
-    logging.info("Started metaxcan association")
-    model_snps = context.get_model_snps()
-    total_snps = len(model_snps)
-    snps_found=set()
-    reporter = Utilities.PercentReporter(logging.INFO, total_snps)
-
-    i_genes, i_snps = context.get_data_intersection()
-
+def _run_serial(args, context, genes, snps_found, reporter):
     results = []
     additional = []
-    for i,gene in enumerate(i_genes):
+    for i,gene in enumerate(genes):
         if args.MAX_R and i+1>args.MAX_R:
             logging.log("Early exit condition met")
             break
@@ -74,10 +68,86 @@ def run_metaxcan(args, context):
         r, snps = AssociationCalculation.association(gene, context, return_snps=True)
         results.append(r)
         snps_found.update(snps)
-        reporter.update(len(snps_found), "%d %% of model's snps found so far in the gwas study")
+        if reporter: reporter.update(len(snps_found), "%d %% of model's snps found so far in the gwas study")
         if args.additional_output:
             stats_ = AssociationCalculation.additional_stats(gene, context)
             additional.append(stats_)
+    return results, additional
+
+def _run_batched(args, context, genes, snps_found, reporter):
+    if args.MAX_R:
+        genes = genes[:args.MAX_R]
+    results = []
+    additional = []
+    for i in range(0, len(genes), args.association_batch_size):
+        batch = genes[i:i+args.association_batch_size]
+        logging.log(9, "Processing genes %i to %i", i, i+len(batch)-1)
+        blocks = context.provide_calculation_blocks(batch)
+        results.extend(AssociationCalculation.association_batch(blocks))
+        snps_found.update(blocks.snps)
+        if reporter: reporter.update(len(snps_found), "%d %% of model's snps found so far in the gwas study")
+        if args.additional_output:
+            additional.extend(AssociationCalculation.additional_stats_batch(blocks))
+    return results, additional
+
+# State shared with forked workers. The children inherit it (copy-on-write) instead of receiving it pickled.
+_parallel_state = None
+
+def _parallel_worker(genes):
+    args, context = _parallel_state
+    snps_found = set()
+    if args.association_batch_size:
+        results, additional = _run_batched(args, context, genes, snps_found, None)
+    else:
+        results, additional = _run_serial(args, context, genes, snps_found, None)
+    return results, additional, snps_found
+
+def _run_parallel(args, context, genes, snps_found, reporter):
+    if isinstance(context.covariance, MatrixManager.StreamedMatrixManager):
+        logging.warning("A streamed text covariance must be read in order; ignoring --parallelism")
+        return _run_serial(args, context, genes, snps_found, reporter)
+    try:
+        mp = multiprocessing.get_context("fork")
+    except ValueError:
+        logging.warning("Parallel processing needs process forking, unavailable in this platform; ignoring --parallelism")
+        return _run_serial(args, context, genes, snps_found, reporter)
+
+    if args.MAX_R:
+        genes = genes[:args.MAX_R]
+    # Contiguous chunks, merged in order, so that output matches the serial run.
+    n_chunks = min(len(genes), args.parallelism*4)
+    chunks = [list(x) for x in np.array_split(np.array(genes, dtype=object), n_chunks)] if n_chunks else []
+
+    global _parallel_state
+    _parallel_state = (args, context)
+    results = []
+    additional = []
+    try:
+        with mp.Pool(args.parallelism) as pool:
+            for r, a, s in pool.imap(_parallel_worker, chunks):
+                results.extend(r)
+                additional.extend(a)
+                snps_found.update(s)
+                reporter.update(len(snps_found), "%d %% of model's snps found so far in the gwas study")
+    finally:
+        _parallel_state = None
+    return results, additional
+
+def run_metaxcan(args, context):
+    logging.info("Started metaxcan association")
+    model_snps = context.get_model_snps()
+    total_snps = len(model_snps)
+    snps_found=set()
+    reporter = Utilities.PercentReporter(logging.INFO, total_snps)
+
+    i_genes, i_snps = context.get_data_intersection()
+
+    if args.parallelism and args.parallelism > 1:
+        results, additional = _run_parallel(args, context, i_genes, snps_found, reporter)
+    elif args.association_batch_size:
+        results, additional = _run_batched(args, context, i_genes, snps_found, reporter)
+    else:
+        results, additional = _run_serial(args, context, i_genes, snps_found, reporter)
 
     reporter.update(len(snps_found), "%d %% of model's snps used", force=True)
 
@@ -95,8 +165,7 @@ def run_metaxcan(args, context):
         logging.warning("IMPORTANT: The pvalue and zscore are uncalibrated for inflation")
 
     if args.output_file:
-        Utilities.ensure_requisite_folders(args.output_file)
-        results.to_csv(args.output_file, index=False, na_rep="NA")
+        Utilities.save_dataframe_atomically(results, args.output_file, index=False, na_rep="NA")
 
     return results
 
@@ -126,7 +195,7 @@ if __name__ == "__main__":
     parser.add_argument("--model_db_path", help="name of weight db in data folder")
     parser.add_argument("--model_db_snp_key", help="Specify a key to use as snp_id")
     parser.add_argument("--covariance", help="name of file containing covariance data")
-    parser.add_argument("--stream_covariance", help="Option to better handle large covariances, slower but less memory consuming", action="store_true")
+    parser.add_argument("--stream_covariance", help="Option to better handle large covariances, slower but less memory consuming. A binary covariance (see CovarianceToBinary.py) is memory-mapped instead, with no slowdown", action="store_true")
     parser.add_argument("--beta_folder", help="name of folder containing GWAS effect data")
     parser.add_argument("--output_file", help="name of output file")
     parser.add_argument("--verbosity", help="Log verbosity level. 1 is everything being logged. 10 is only high level messages, above 10 will hardly log anything", default = "10")
@@ -135,6 +204,8 @@ if __name__ == "__main__":
     parser.add_argument("--overwrite", help="If set, will overwrite the results file if it exists.", action="store_true", default=False)
     parser.add_argument("--additional_output", help="If set, will output additional information.", action="store_true", default=False)
     parser.add_argument("--single_snp_model", action="store_true", help="Models are comprised of a single snp per gene", default=False)
+    parser.add_argument("--association_batch_size", help="If set, compute associations vectorized over blocks of this many genes", type=int, default=None)
+    parser.add_argument("--parallelism", help="Number of worker processes to split the genes across", type=int, default=None)
     parser.add_argument("--throw", action="store_true", help="Throw exception on error", default=False)
 
     args = parser.parse_args()
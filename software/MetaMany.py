@@ -6,11 +6,22 @@ __version__ = "1.0x" + metax.__version__
 import logging
 import re
 import os
+import io
+import copy
+import gzip
+import itertools
+import sqlite3
+import multiprocessing
+import concurrent.futures
+import pandas
 from metax import Logging
 from metax import Exceptions
 from metax import Utilities
+from metax import PredictionModel
+from metax import BinaryMatrixManager
 from metax.gwas import Utilities as GWASUtilities
 
+import M03_betas
 import SPrediXcan
 
 __author__ = 'heroico, Eric Torstenson'
@@ -71,11 +82,12 @@ def get_result_prefix(args, name):
     n = os.path.splitext(args.gwas_file)[0] if "." in args.gwas_file else args.gwas_file
     return n
 
-def process(args, db_filename):
+def tissue_args(args, db_filename):
+    """Copy of the arguments, set up for running the tissue in `db_filename`"""
+    args = copy.copy(args)
     filebase = os.path.basename(db_filename).replace(".db", "")
     output_folder = os.path.abspath(args.output_directory)
 
-    logging.info("Processing %s" % (db_filename))
     args.model_db_path = os.path.abspath(db_filename)
     cov_directory = args.covariance_directory
     if cov_directory.upper() == "SAME":
@@ -96,14 +108,172 @@ def process(args, db_filename):
     suffix = ".csv"
     report_prefix = get_name_prefix(args)
     args.output_file = os.path.join(output_folder, report_prefix + "-" + file_prefix + suffix)  # output_folder       #os.path.join(output_folder, file_prefix) + ".csv"
+    return args
+
+def process(args, db_filename, gwas=None):
+    logging.info("Processing %s" % (db_filename))
+    args = tissue_args(args, db_filename)
 
     # Run!
-    SPrediXcan.run(args)
+    SPrediXcan.run(args, gwas)
+
+def pending_tissues(args):
+    """The weight dbs, among `args.weight_dbs`, whose results are still to be computed"""
+    db_filenames = []
+    for weight_db in args.weight_dbs:
+        output_file = tissue_args(args, weight_db.name).output_file
+        if not args.overwrite and os.path.exists(output_file):
+            logging.info("%s already exists, move it or delete it if you want it done again", output_file)
+            continue
+        db_filenames.append(weight_db.name)
+    return db_filenames
+
+def load_gwas(args, db_filenames):
+    """Loads the input gwas once, restricted to the snps in any of the models; each tissue only aligns it to its model."""
+    snps = set()
+    for db_filename in db_filenames:
+        snps.update(PredictionModel.load_model(db_filename, args.model_db_snp_key).snps())
+    logging.info("Loading GWAS for %d tissues", len(db_filenames))
+    return M03_betas.load_gwas(args, snps)
+
+########################################################################################################################
+# Rows parsed from each input to size it up.
+FOOTPRINT_SAMPLE_ROWS = 10000
+
+def _sample_lines(path, n):
+    """Up to the first `n` lines of a (possibly gzipped) text file, and an estimate of the number of lines in all of it"""
+    with open(path, "rb") as raw:
+        f = gzip.GzipFile(fileobj=raw) if "gz" in path else raw
+        lines = list(itertools.islice(f, n))
+        if len(lines) < n:
+            return lines, len(lines)
+        consumed = raw.tell()
+    return lines, os.path.getsize(path) * len(lines) / consumed
+
+def _row_size(d):
+    return d.memory_usage(deep=True, index=False).sum() / d.shape[0] if d.shape[0] else 0
+
+def _model_size(path, snp_key=None):
+    """Memory of a model's weights, as loaded by `PredictionModel.load_model`, from a sample of their rows"""
+    with sqlite3.connect(path) as connection:
+        n = connection.execute("SELECT count(*) FROM weights").fetchone()[0]
+        query = "SELECT {}, gene, weight, ref_allele, eff_allele FROM weights LIMIT {}".format(snp_key if snp_key else "rsid", FOOTPRINT_SAMPLE_ROWS)
+        sample = pandas.read_sql(query, connection)
+    return n * _row_size(sample)
+
+def _covariance_size(path, stream):
+    """
+    Memory held by a covariance, as the tissue job loads it (see `metax.metaxcan.Utilities.build_context`).
+    A binary covariance only keeps its index; its values are read, or mapped, as needed.
+    A text covariance is parsed whole into a dataframe, unless streamed, which only holds a gene at a time.
+    """
+    if BinaryMatrixManager.is_binary_matrix(path):
+        index = BinaryMatrixManager.read_index(path)
+        return index.codes.nbytes + sum(sys.getsizeof(x) for x in index.ids) + 8 * len(index.ids)
+
+    lines, n = _sample_lines(path, FOOTPRINT_SAMPLE_ROWS + 1)
+    sample = pandas.read_table(io.BytesIO(b"".join(lines)), sep=r"\s+")
+    if stream:
+        n = sample.iloc[:, 0].value_counts().max() if sample.shape[0] else 0
+    else:
+        n = n - 1
+    return n * _row_size(sample)
+
+def estimate_footprint(args):
+    """
+    Estimate, in bytes, of the memory a tissue job (as set up by `tissue_args`) will use,
+    sizing its inputs from a sample of their rows parsed as the job parses them.
+
+    The model's weights count twice, as the job also keeps them split by gene (see `OptimizedContext`).
+    With a 3000 gene, 105k weight model and a 1.9M row text covariance, this estimates 393MB for a job
+    whose peak resident memory grew by 409MB; 51 to 52MB against 52MB with the covariance streamed, or binary.
+    `--tissue_footprint` replaces the estimate when the inputs are laid out differently.
+    """
+    if args.tissue_footprint:
+        return int(args.tissue_footprint * 2**30)
+    size = 2 * _model_size(args.model_db_path, args.model_db_snp_key)
+    if not args.single_snp_model and os.path.exists(args.covariance):
+        size += _covariance_size(args.covariance, args.stream_covariance)
+    return int(size)
+
+# Arguments and gwas, shared with forked workers which inherit them (copy-on-write) instead of receiving them pickled.
+_shared_state = None
+
+def _process_job(db_filename):
+    args, gwas = _shared_state
+    process(args, db_filename, gwas)
+    return db_filename
+
+def schedule(jobs, budget, n):
+    """
+    Yields batches of jobs (label, footprint) to start, given those running, so that at most `n` run at once
+    and their footprints sum up to at most `budget`. A job over the budget on its own runs alone.
+    """
+    pending = list(jobs)
+    running = {}
+    while pending or running:
+        start = []
+        used = sum(running.values())
+        for job in list(pending):
+            label, footprint = job
+            if len(running) + len(start) >= n:
+                break
+            if budget is None or used + footprint <= budget or (not running and not start):
+                start.append(job)
+                pending.remove(job)
+                used += footprint
+        running.update(start)
+        finished = yield start
+        for label in finished:
+            del running[label]
+
+def run_concurrently(args, gwas, db_filenames):
+    global _shared_state
+    budget = int(args.memory_budget * 2**30) if args.memory_budget else None
+    jobs = []
+    for db_filename in db_filenames:
+        footprint = estimate_footprint(tissue_args(args, db_filename))
+        logging.log(9, "Estimated footprint for %s: %.2f GB", db_filename, footprint / 2**30)
+        jobs.append((db_filename, footprint))
+
+    _shared_state = (args, gwas)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(args.tissue_parallelism, mp_context=multiprocessing.get_context("fork")) as executor:
+            scheduler = schedule(jobs, budget, args.tissue_parallelism)
+            start = next(scheduler)
+            running = set()
+            while True:
+                running.update(executor.submit(_process_job, label) for label, footprint in start)
+                done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                finished = [x.result() for x in done]
+                for label in finished:
+                    logging.info("Finished %s", label)
+                try:
+                    start = scheduler.send(finished)
+                except StopIteration:
+                    break
+    finally:
+        _shared_state = None
+
+def validate(args):
+    if args.tissue_parallelism and args.tissue_parallelism > 1 and args.parallelism and args.parallelism > 1:
+        # each tissue would start its own association workers, unaccounted for by the memory budget
+        raise Exceptions.InvalidArguments("Use either --tissue_parallelism or --parallelism, not both")
 
 def run(args):
     for weight_db in args.weight_dbs:
         weight_db.close()
-        process(args, weight_db.name)
+    validate(args)
+    db_filenames = pending_tissues(args)
+    if not db_filenames:
+        logging.info("Every tissue is already done")
+        return
+    gwas = load_gwas(args, db_filenames)
+    if args.tissue_parallelism and args.tissue_parallelism > 1:
+        run_concurrently(args, gwas, db_filenames)
+    else:
+        for db_filename in db_filenames:
+            process(args, db_filename, gwas)
 
 if __name__ == "__main__":
     import argparse
@@ -126,6 +296,8 @@ arguments --covariance_directory and --covariance_suffix. """)
 
 #GWAS betas
     parser.add_argument("--gwas_file", help="Load a single GWAS file. (Alternative to providing a gwas_folder and gwas_file_pattern)")
+    parser.add_argument("--gwas_h2", help="GWAS heritability (h2)", type=float, default=None, required=False)
+    parser.add_argument("--gwas_N", help="GWAS sample size (N)", type=int, default=None, required=False)
 
     parser.add_argument("--gwas_folder", help="name of folder containing GWAS data. All files in the folder are assumed to belong to a single study.")
     parser.add_argument("--gwas_file_pattern", help="Pattern to recognice GWAS files in folders (in case there are extra files and you don't want them selected).")
@@ -133,7 +305,7 @@ arguments --covariance_directory and --covariance_suffix. """)
     GWASUtilities.add_gwas_arguments_to_parser(parser)
 
 # ZScore calculation
-    parser.add_argument("--stream_covariance", help="Option to better handle large covariances, slower but less memory consuming", action="store_true")
+    parser.add_argument("--stream_covariance", help="Option to better handle large covariances, slower but less memory consuming. A binary covariance (see CovarianceToBinary.py) is memory-mapped instead, with no slowdown", action="store_true")
     parser.add_argument("--single_snp_model", action="store_true", help="Models are comprised of a single snp per gene", default=False)
     parser.add_argument("--covariance_directory", help="directory where covariance files can be found (or SAME if covariance sits beside the .db file", default="SAME")
     parser.add_argument("--covariance_suffix", help="Suffix associated with the covariance files. covext-dbext (where ..dbext is the portion of the db file to be replaced by the coviarance extension. )", default=".txt.gz.._0.5.db")
@@ -145,6 +317,11 @@ arguments --covariance_directory and --covariance_suffix. """)
     parser.add_argument("--verbosity", help="Log verbosity level. 1 is everything being logged. 10 is only high level messages, above 10 will hardly log anything", default = "10")
     parser.add_argument("--throw", action="store_true", help="Throw exception on error", default=False)
     parser.add_argument("--MAX_R", help="Run only for the first R genes", type=int, default=None)
+    parser.add_argument("--association_batch_size", help="If set, compute associations vectorized over blocks of this many genes", type=int, default=None)
+    parser.add_argument("--parallelism", help="Number of worker processes to split the genes across", type=int, default=None)
+    parser.add_argument("--tissue_parallelism", help="Number of tissues to process at the same time, each in its own process. Can't be combined with --parallelism", type=int, default=None)
+    parser.add_argument("--memory_budget", help="With --tissue_parallelism, only start a tissue if the estimated memory of those running stays under this many GB", type=float, default=None)
+    parser.add_argument("--tissue_footprint", help="With --memory_budget, take this many GB as the memory of every tissue instead of estimating it from its inputs", type=float, default=None)
 
 
     if "-v" in sys.argv or "--verbose" in sys.argv:
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+import os
+import logging
+from timeit import default_timer as timer
+
+import metax
+from metax import Logging
+from metax import Exceptions
+from metax import Utilities
+from metax import PredictionModel
+from metax import ModelBundle
+
+def run(args):
+    if os.path.exists(args.output):
+        logging.info("%s already exists, delete it or move it if you want it generated again", args.output)
+        return
+
+    if (args.model_db_path and args.models_folder) or (not args.model_db_path and not args.models_folder):
+        raise Exceptions.InvalidArguments("Provide either --model_db_path or --models_folder [--models_name_filter]")
+
+    paths = args.model_db_path if args.model_db_path else sorted(PredictionModel._model_paths(args.models_folder, args.models_name_filter))
+    if not len(paths):
+        raise Exceptions.ReportableException("No model databases found")
+
+    start = timer()
+    Utilities.ensure_requisite_folders(args.output)
+    logging.info("Compiling %d model databases", len(paths))
+    ModelBundle.build_model_bundle(paths, args.output, args.model_db_snp_key)
+    end = timer()
+    logging.info("Compiled models in %s seconds" % (str(end - start)))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="ModelToBundle.py %s: Compile prediction model databases into a single memory-mappable bundle, "
+                                     "that can be used instead of a model database (--model_db_path) or a folder of them (--models_folder)." % (metax.__version__))
+    parser.add_argument("--model_db_path", help="Model database(s) to compile", nargs="+")
+    parser.add_argument("--models_folder", help="Folder with model databases to compile; alternative to --model_db_path")
+    parser.add_argument("--models_name_filter", help="Regular expression(s) selecting model databases in --models_folder", nargs="+")
+    parser.add_argument("--model_db_snp_key", help="Column in the model databases' weights table used as snp identifier. Bundles must be used with the same key.")
+    parser.add_argument("--output", help="Where to save the bundle")
+    parser.add_argument("--verbosity", help="Log verbosity level. 1 is everything being logged. 10 is only high level messages, above 10 will hardly log anything", default = "10")
+    parser.add_argument("--throw", action="store_true", help="Throw exception on error", default=False)
+
+    args = parser.parse_args()
+
+    Logging.configureLogging(int(args.verbosity))
+    if args.throw:
+        run(args)
+    else:
+        try:
+            run(args)
+        except Exceptions.ReportableException as e:
+            logging.error(e.msg)
+        except Exception as e:
+            logging.info("Unexpected error: %s" % str(e))
+            exit(1)
@@ -1,5 +1,7 @@
 #! /usr/bin/env python
+import copy
 import logging
+import multiprocessing
 import os
 from timeit import default_timer as timer
 
@@ -14,6 +16,7 @@ from metax import Logging
 from metax import Exceptions
 from metax import PredictionModel
 from metax.genotype import Genotype
+from metax.predixcan import Prediction
 from metax.misc import GWASAndModels, Genomics, KeyedDataSource
 
 GF = Genotype.GF
@@ -35,6 +38,8 @@ def dosage_generator(args, variant_mapping=None, weights=None):
         logging.info("Setting whitelist from available models")
         whitelist = set(weights.rsid)
 
+    regions = model_regions(args, whitelist) if args.model_regions else None
+
     d = None
     if args.text_genotypes:
         from metax.genotype import DosageGenotype
@@ -43,10 +48,10 @@ def dosage_generator(args, variant_mapping=None, weights=None):
     elif args.bgen_genotypes:
         from metax.genotype import BGENGenotype
         d = BGENGenotype.bgen_files_geno_lines(args.bgen_genotypes,
-            variant_mapping=variant_mapping, force_colon=args.force_colon, use_rsid=args.bgen_use_rsid, whitelist=whitelist, skip_palindromic=args.skip_palindromic)
+            variant_mapping=variant_mapping, force_colon=args.force_colon, use_rsid=args.bgen_use_rsid, whitelist=whitelist, skip_palindromic=args.skip_palindromic, regions=regions)
     elif args.vcf_genotypes:
         from metax.genotype import CYVCF2Genotype
-        d = CYVCF2Genotype.vcf_files_geno_lines(args.vcf_genotypes, mode=args.vcf_mode, variant_mapping=variant_mapping, whitelist=whitelist, skip_palindromic=args.skip_palindromic, liftover_conversion=liftover_conversion)
+        d = CYVCF2Genotype.vcf_files_geno_lines(args.vcf_genotypes, mode=args.vcf_mode, variant_mapping=variant_mapping, whitelist=whitelist, skip_palindromic=args.skip_palindromic, liftover_conversion=liftover_conversion, regions=regions)
 
     if d is None:
         raise Exceptions.InvalidArguments("unsupported genotype input")
@@ -54,6 +59,21 @@ def dosage_generator(args, variant_mapping=None, weights=None):
         d = Genotype.force_mapped_metadata(d, args.force_mapped_metadata)
     return d
 
+def model_regions(args, whitelist):
+    if args.liftover:
+        raise Exceptions.InvalidArguments("Model regions are in the genotype's coordinates, they can't be used with liftover")
+    if not args.vcf_genotypes and not args.bgen_genotypes:
+        raise Exceptions.InvalidArguments("Model regions need indexed (vcf or bgen) genotypes")
+
+    coordinates = Genomics.coordinates_from_ids(whitelist)
+    if not len(coordinates):
+        raise Exceptions.InvalidArguments("Model regions need variant ids with coordinates, such as chr1_12345_A_G_b38")
+    if len(coordinates) < len(whitelist):
+        logging.warning("%d variant ids have no coordinates; they will not be read", len(whitelist) - len(coordinates))
+    regions = Genomics.regions(coordinates)
+    logging.info("Reading genotypes in %d regions", len(regions))
+    return regions
+
 def model_structure(args):
     model = PredictionModel.load_model(args.model_db_path, args.model_db_snp_key)
     m = {}
@@ -137,11 +157,111 @@ def prepare_prediction(args, extra, samples):
     else:
         if args.prediction_output[1] == "HDF5":
             from metax.predixcan.Utilities import HDF5PredictionRepository
-            results = HDF5PredictionRepository(samples, extra, args.prediction_output[0])
+            buffer_size = args.prediction_hdf5_buffer_mb * (1 << 20) if args.prediction_hdf5_buffer_mb else None
+            results = HDF5PredictionRepository(samples, extra, args.prediction_output[0], args.prediction_hdf5_chunk_genes, buffer_size)
         else:
             raise Exceptions.InvalidArguments("Unsupported output specification")
     return results
 
+def predict(args, dosage_source, model, weight_matrix, results, n_samples, snps_found, dcapture, reporter=None):
+    """Adds the dosages' contributions to `results`; `weight_matrix` (if any) enables the block prediction engine."""
+    engine = None
+    if weight_matrix is not None:
+        engine = Prediction.PredictionEngine(weight_matrix, results, n_samples, args.prediction_block_size)
+
+    for i,e in enumerate(dosage_source):
+        if isinstance(e, RuntimeError):
+            raise e
+        if args.stop_at_variant and i>args.stop_at_variant:
+            break
+        var_id = e[GF.RSID]
+
+        logging.log(8, "variant %i:%s", i, var_id)
+        if var_id in model:
+            s = model[var_id]
+            ref_allele, alt_allele = e[GF.REF_ALLELE], e[GF.ALT_ALLELE]
+
+            allele_align, strand_align = GWASAndModels.match_alleles(ref_allele, alt_allele, s[0], s[1])
+            if not allele_align or not strand_align:
+                continue
+
+            dosage = Genotype.dosage(e)
+            if allele_align == -1:
+                dosage = 2 - dosage
+
+            snps_found.add(var_id)
+
+            if engine:
+                engine.update(var_id, dosage)
+
+            for gene, weight in s[2].items():
+                if not engine:
+                    results.update(gene, dosage, weight)
+                if args.capture:
+                    dcapture.append((gene, weight, var_id, s[0], s[1], ref_allele, alt_allele, strand_align, allele_align) + tuple(Genotype.dosage(e)))
+
+            if reporter:
+                reporter.update(len(snps_found), "%d %% of models' snps used")
+
+    if engine:
+        engine.flush()
+
+def _genotype_files(args):
+    """The genotype argument and its files, in the order they are processed"""
+    if args.text_genotypes:
+        from metax.genotype import DosageGenotype
+        return "text_genotypes", DosageGenotype.sorted_dosage_files(args.text_genotypes)
+    elif args.bgen_genotypes:
+        return "bgen_genotypes", args.bgen_genotypes
+    elif args.vcf_genotypes:
+        return "vcf_genotypes", args.vcf_genotypes
+    raise Exceptions.InvalidArguments("unsupported genotype input")
+
+_parallel_state = None
+
+def _parallel_worker(i):
+    args, model, weight_matrix, weights, extra, samples, variant_mapping, key, files = _parallel_state
+    file_args = copy.copy(args)
+    setattr(file_args, key, [files[i]])
+    logging.log(9, "Processing %s", files[i])
+
+    snps_found = set()
+    dcapture = []
+    from metax.predixcan.Utilities import BasicPredictionRepository
+    partial = BasicPredictionRepository(samples, extra, None)
+    predict(file_args, dosage_generator(file_args, variant_mapping, weights), model, weight_matrix, partial, samples.shape[0], snps_found, dcapture)
+    return partial.genes, partial.stats, snps_found, dcapture
+
+def _run_parallel(args, model, weight_matrix, weights, extra, samples, variant_mapping, results, snps_found, dcapture, reporter):
+    key, files = _genotype_files(args)
+    if len(files) < 2 or args.stop_at_variant:
+        if args.stop_at_variant:
+            logging.warning("--stop_at_variant counts variants across files; ignoring --parallelism")
+        return _run_serial(args, model, weight_matrix, weights, samples, variant_mapping, results, snps_found, dcapture, reporter)
+    try:
+        mp = multiprocessing.get_context("fork")
+    except ValueError:
+        logging.warning("Parallel processing needs process forking, unavailable in this platform; ignoring --parallelism")
+        return _run_serial(args, model, weight_matrix, weights, samples, variant_mapping, results, snps_found, dcapture, reporter)
+
+    global _parallel_state
+    _parallel_state = (args, model, weight_matrix, weights, extra, samples, variant_mapping, key, files)
+    try:
+        with mp.Pool(min(args.parallelism, len(files))) as pool:
+            # partial predictions are reduced in file order, so that genes are reached in the same order as a serial run
+            for genes, stats, s, c in pool.imap(_parallel_worker, range(len(files))):
+                results.update_block(list(genes.keys()), list(genes.values()), [stats[gene][0] for gene in genes])
+                snps_found.update(s)
+                dcapture.extend(c)
+                reporter.update(len(snps_found), "%d %% of models' snps used")
+    finally:
+        _parallel_state = None
+
+def _run_serial(args, model, weight_matrix, weights, samples, variant_mapping, results, snps_found, dcapture, reporter):
+    logging.info("Preparing genotype dosages")
+    dosage_source = dosage_generator(args, variant_mapping, weights)
+    predict(args, dosage_source, model, weight_matrix, results, samples.shape[0], snps_found, dcapture, reporter)
+
 def run(args):
     start = timer()
     if args.prediction_output:
@@ -164,44 +284,20 @@ def run(args):
 
     variant_mapping = get_variant_mapping(args, weights)
 
-    logging.info("Preparing genotype dosages")
-    dosage_source = dosage_generator(args, variant_mapping, weights)
+    weight_matrix = None
+    if args.prediction_block_size:
+        logging.info("Building weight matrix")
+        weight_matrix = Prediction.WeightMatrix(weights)
 
     logging.info("Processing genotypes")
     dcapture = []
     reporter = Utilities.PercentReporter(logging.INFO, len(set(weights.rsid.values)))
     snps_found = set()
     with prepare_prediction(args, extra, samples) as results:
-
-        for i,e in enumerate(dosage_source):
-            if isinstance(e, RuntimeError):
-                raise e
-            if args.stop_at_variant and i>args.stop_at_variant:
-                break
-            var_id = e[GF.RSID]
-
-            logging.log(8, "variant %i:%s", i, var_id)
-            if var_id in model:
-                s = model[var_id]
-                ref_allele, alt_allele = e[GF.REF_ALLELE], e[GF.ALT_ALLELE]
-
-                allele_align, strand_align = GWASAndModels.match_alleles(ref_allele, alt_allele, s[0], s[1])
-                if not allele_align or not strand_align:
-                    continue
-
-                dosage = e[GF.FIRST_DOSAGE:]
-                if allele_align == -1:
-                    dosage = tuple(map(lambda x: 2 - x, dosage))
-                dosage = numpy.array(dosage, dtype=float)
-
-                snps_found.add(var_id)
-
-                for gene, weight in s[2].items():
-                    results.update(gene, dosage, weight)
-                    if args.capture:
-                        dcapture.append((gene, weight, var_id, s[0], s[1], ref_allele, alt_allele, strand_align, allele_align) + e[GF.FIRST_DOSAGE:])
-
-                reporter.update(len(snps_found), "%d %% of models' snps used")
+        if args.parallelism and args.parallelism > 1:
+            _run_parallel(args, model, weight_matrix, weights, extra, samples, variant_mapping, results, snps_found, dcapture, reporter)
+        else:
+            _run_serial(args, model, weight_matrix, weights, samples, variant_mapping, results, snps_found, dcapture, reporter)
 
     reporter.update(len(snps_found), "%d %% of models' snps used", force=True)
      
@@ -249,12 +345,21 @@ def add_arguments(parser):
     parser.add_argument('--text_sample_ids', help="path to file with individual samples' ids", nargs="+", default=[])
     parser.add_argument("--generate_sample_ids", help="Specify a number of samples, the ordinal number will be used as individual id", type=int, default=None)
     parser.add_argument("--prediction_output", help="name of file to put results in", nargs="+", default=[])
+    parser.add_argument("--prediction_hdf5_chunk_genes", help="Genes per HDF5 chunk of the prediction output (default 10)", type=int, default=None)
+    parser.add_argument("--prediction_hdf5_buffer_mb", help="Memory, in megabytes, for predictions held before writing them to HDF5 in whole chunks (default 1024)", type=int, default=None)
     parser.add_argument("--prediction_summary_output", help="name of file to put summary results in")
     parser.add_argument("--variant_mapping", help="Table to convert from genotype variants to model variants.", nargs="+", default=[])
     parser.add_argument("--on_the_fly_mapping", help="Option to convert input genotype metadata to a variant id; this can then be used with a variant mapping or directly match the models.", nargs="+", default=[])
     parser.add_argument("--sub_batches", help="split data in slices", type=int, default=None)
     parser.add_argument("--sub_batch", help="compute on a specific slice of data", type=int, default=None)
     parser.add_argument("--only_entries", help="Compute only these entries in the models (e.g. a whitelist of genes)", nargs="+")
+    parser.add_argument("--model_regions", action="store_true", help="Read only the genomic regions spanned by the model variants, "
+                        "through the vcf's tabix/csi index or the bgen's metadata. Coordinates are taken from the variant ids (e.g. chr1_12345_A_G_b38), "
+                        "which must be in the genotype's build.")
+    parser.add_argument("--prediction_block_size", help="If provided, dosages are buffered in blocks of this many variants and every gene's prediction "
+                        "is updated with a single sparse weight matrix product per block (e.g. 1000)", type=int, default=None)
+    parser.add_argument("--parallelism", help="Number of worker processes to split the genotype files across (e.g. one per chromosome); "
+                        "their partial predictions are added up at the end", type=int, default=None)
     parser.add_argument("--capture")
 
 if __name__ == "__main__":
@@ -2,6 +2,9 @@
 import os
 import logging
 import traceback
+import itertools
+import collections
+import multiprocessing
 
 from metax import __version__
 from metax import Logging
@@ -10,9 +13,140 @@ from metax import Utilities
 from metax.gwas import Utilities as GWASUtilities
 from metax.cross_model import Utilities as CrossModelUtilities
 from metax.cross_model import JointAnalysis
+from metax.misc import DataFrameStreamer
 
 from timeit import default_timer as timer
 
+def _analyse(args, context, gene):
+    if args.throw:
+        return JointAnalysis.joint_analysis(context, gene)
+    try:
+        return JointAnalysis.joint_analysis(context, gene)
+    except Exception as e:
+        logging.info("Error in gene %s\n%s", gene, traceback.format_exc())
+        return None
+
+def _run_serial(args, context, reporter):
+    results = []
+    n_genes = context.get_n_genes()
+    for i,gene in enumerate(context.get_genes()):
+        if args.MAX_M and i > args.MAX_M-1:
+            logging.info("Early exit")
+            break
+
+        logging.log(7, "Gene %d/%d: %s", i+1, n_genes, gene)
+        result = _analyse(args, context, gene)
+        if result is not None:
+            results.append(result)
+        reporter.update(i, "%d %% of model's genes processed so far")
+    return results
+
+def _prepare(args, context, gene):
+    if args.throw:
+        return JointAnalysis.prepare_joint_analysis(context, gene)
+    try:
+        return JointAnalysis.prepare_joint_analysis(context, gene)
+    except Exception as e:
+        logging.info("Error in gene %s\n%s", gene, traceback.format_exc())
+        return None
+
+def _solve(args, context, inputs):
+    if args.throw:
+        return JointAnalysis.solve_joint_analysis(context, inputs)
+    try:
+        return JointAnalysis.solve_joint_analysis(context, inputs)
+    except Exception as e:
+        # Find the culprits one gene at a time
+        results = []
+        for x in inputs:
+            try:
+                results.extend(JointAnalysis.solve_joint_analysis(context, [x]))
+            except Exception as e:
+                logging.info("Error in gene %s\n%s", x.gene, traceback.format_exc())
+        return results
+
+def _analyse_items(args, context, items):
+    """Results for a list of (gene, block) items, configuring the context for each block in turn"""
+    results = []
+    if not args.joint_analysis_batch_size:
+        for gene, block in items:
+            context.use_gene_block(block)
+            result = _analyse(args, context, gene)
+            if result is not None:
+                results.append(result)
+        return results
+
+    inputs = []
+    for gene, block in items:
+        context.use_gene_block(block)
+        x = _prepare(args, context, gene)
+        if x is not None:
+            inputs.append(x)
+    return _solve(args, context, inputs)
+
+def _gene_chunks(args, context, size):
+    items = context.get_gene_blocks()
+    if args.MAX_M:
+        items = itertools.islice(items, args.MAX_M)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not len(chunk):
+            return
+        yield chunk
+
+def _run_batched(args, context, reporter):
+    results = []
+    done = 0
+    for chunk in _gene_chunks(args, context, args.joint_analysis_batch_size):
+        logging.log(7, "Genes %d to %d", done+1, done+len(chunk))
+        results.extend(_analyse_items(args, context, chunk))
+        done += len(chunk)
+        reporter.update(done, "%d %% of model's genes processed so far")
+    return results
+
+# State shared with forked workers. The children inherit it (copy-on-write) instead of receiving it pickled.
+_parallel_state = None
+
+def _parallel_worker(chunk):
+    args, context = _parallel_state
+    return _analyse_items(args, context, chunk), len(chunk)
+
+def _run_parallel(args, context, reporter):
+    try:
+        mp = multiprocessing.get_context("fork")
+    except ValueError:
+        logging.warning("Parallel processing needs process forking, unavailable in this platform; ignoring --parallelism")
+        return _run_batched(args, context, reporter) if args.joint_analysis_batch_size else _run_serial(args, context, reporter)
+
+    # Upcoming genes are read by a background thread, and only a bounded number of them is in flight at any time.
+    # Results are collected in submission order, so that output matches the serial run.
+    chunks = _gene_chunks(args, context, args.joint_analysis_batch_size or 1)
+    in_flight = args.parallelism*2
+
+    global _parallel_state
+    _parallel_state = (args, context)
+    results = []
+    pending = collections.deque()
+    done = 0
+    def _collect():
+        r, n = pending.popleft().get()
+        results.extend(r)
+        reporter.update(done + n, "%d %% of model's genes processed so far")
+        return n
+
+    try:
+        with mp.Pool(args.parallelism) as pool:
+            for i, chunk in enumerate(DataFrameStreamer.prefetched(chunks, in_flight)):
+                logging.log(7, "Chunk %d: %s", i+1, chunk[0][0])
+                pending.append(pool.apply_async(_parallel_worker, (chunk,)))
+                if len(pending) >= in_flight:
+                    done += _collect()
+            while len(pending):
+                done += _collect()
+    finally:
+        _parallel_state = None
+    return results
+
 def run(args):
     start = timer()
     if os.path.exists(args.output):
@@ -20,7 +154,6 @@ def run(args):
         return
     logging.info("Creating context")
     context = CrossModelUtilities.context_from_args(args)
-    results = []
 
     n_genes = context.get_n_genes()
     reporter = Utilities.PercentReporter(logging.INFO, n_genes)
@@ -28,22 +161,12 @@ def run(args):
     logging.info("Processing")
 
     reporter.update(0, "%d %% of model's genes processed so far")
-    for i,gene in enumerate(context.get_genes()):
-        if args.MAX_M and i > args.MAX_M-1:
-            logging.info("Early exit")
-            break
-
-        logging.log(7, "Gene %d/%d: %s", i+1, n_genes, gene)
-        if args.throw:
-            result = JointAnalysis.joint_analysis(context, gene)
-            results.append(result)
-        else:
-            try:
-                result = JointAnalysis.joint_analysis(context, gene)
-                results.append(result)
-            except Exception as e:
-                logging.info("Error in gene %s\n%s", gene, traceback.format_exc())
-        reporter.update(i, "%d %% of model's genes processed so far")
+    if args.parallelism and args.parallelism > 1:
+        results = _run_parallel(args, context, reporter)
+    elif args.joint_analysis_batch_size:
+        results = _run_batched(args, context, reporter)
+    else:
+        results = _run_serial(args, context, reporter)
 
     results = JointAnalysis.format_results(results)
     Utilities.ensure_requisite_folders(args.output)
@@ -84,6 +207,8 @@ if __name__ == "__main__":
     parser.add_argument("--throw", action="store_true", help="Throw exception on error", default=False)
     parser.add_argument("--trimmed_ensemble_id", action="store_true", help="Use ensemble ids without version", default=False)
     parser.add_argument("--MAX_M", help="Compute only the first M genes", type=int)
+    parser.add_argument("--joint_analysis_batch_size", help="If set, solve the joint analysis vectorized over blocks of this many genes", type=int, default=None)
+    parser.add_argument("--parallelism", help="Number of worker processes to split the genes across, while a background thread reads upcoming genes' snp covariance", type=int, default=None)
 
     args = parser.parse_args()
 
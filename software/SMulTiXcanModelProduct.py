@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+import os
+import logging
+from timeit import default_timer as timer
+
+import metax
+from metax import Logging
+from metax import Exceptions
+from metax import Utilities
+from metax.gwas import Utilities as GWASUtilities
+from metax.cross_model import Utilities as CrossModelUtilities
+from metax.cross_model import ModelProduct
+
+def run(args):
+    if os.path.exists(args.output):
+        logging.info("%s already exists, delete it or move it if you want it generated again", args.output)
+        return
+
+    start = timer()
+    if args.cleared_snps or args.gwas_file or args.gwas_folder:
+        intersection = CrossModelUtilities.snp_intersection_from_args(args)
+    else:
+        logging.info("No snp whitelist; using every snp in the covariance")
+        intersection = None
+    model_manager = CrossModelUtilities.model_manager_from_args(args)
+    snp_covariance_streamer = CrossModelUtilities.snp_covariance_streamer_from_args(args, intersection)
+
+    Utilities.ensure_requisite_folders(args.output)
+    logging.info("Computing model products")
+    ModelProduct.build_model_product(snp_covariance_streamer, model_manager, args.output, args.trimmed_ensemble_id, args.dtype)
+    end = timer()
+    logging.info("Computed model products in %s seconds" % (str(end - start)))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="SMulTiXcanModelProduct.py %s: Precompute SMulTiXcan's per gene tissue expression correlations "
+                                     "from prediction models and a snp covariance, into an indexed binary file for SMulTiXcan's --model_product. "
+                                     "They depend on the snps used: provide the same whitelist (--cleared_snps) or GWAS that the MetaXcan results were computed with, "
+                                     "or none to use every snp in the covariance." % (metax.__version__))
+    parser.add_argument("--models_folder", help="Path to folder with prediction models")
+    parser.add_argument("--models_name_filter", help="Path to folder with prediction models", type=str, nargs='+')
+    parser.add_argument("--models_name_pattern", help="regular expression to detect tissue name from file names")
+    parser.add_argument("--model_db_snp_key", help="Specify a key to use as snp_id")
+    parser.add_argument("--snp_covariance", help="path  to snp covariance")
+
+    parser.add_argument("--cleared_snps", help="SNPS to use, a file with an -rsid- column. Alternative to GWAS.")
+    parser.add_argument("--gwas_folder", help="name of folder containing GWAS data. All files in the folder are assumed to belong to a single study.")
+    parser.add_argument("--gwas_file_pattern", help="Pattern to recognice GWAS files in folders (in case there are extra files and you don't want them selected).")
+    parser.add_argument("--gwas_file", help="Path to GWAS file; alternative to gwas_folder and gwas_pattern")
+    GWASUtilities.add_gwas_arguments_to_parser(parser)
+
+    parser.add_argument("--trimmed_ensemble_id", action="store_true", help="Use ensemble ids without version", default=False)
+    parser.add_argument("--dtype", help="Precision of stored values", choices=["float32", "float64"], default="float64")
+    parser.add_argument("--output", help="Where to save the model products")
+    parser.add_argument("--verbosity", help="Log verbosity level. 1 is everything being logged. 10 is only high level messages, above 10 will hardly log anything", default = "10")
+    parser.add_argument("--throw", action="store_true", help="Throw exception on error", default=False)
+
+    args = parser.parse_args()
+
+    Logging.configureLogging(int(args.verbosity))
+    if args.throw:
+        run(args)
+    else:
+        try:
+            run(args)
+        except Exceptions.ReportableException as e:
+            logging.error(e.msg)
+        except Exception as e:
+            logging.info("Unexpected error: %s" % str(e))
+            exit(1)
@@ -16,7 +16,10 @@ import M03_betas
 import M04_zscores
 
 
-def run(args):
+def run(args, _gwas=None):
+    """
+    :param _gwas: optionally, the input gwas as loaded by `M03_betas.load_gwas`, shared across runs.
+    """
     if not args.overwrite and args.output_file and os.path.exists(args.output_file):
         logging.info("%s already exists, move it or delete it if you want it done again", args.output_file)
         return
@@ -26,7 +29,7 @@ def run(args):
     M03_args = copy.copy(args)
     M03_args.output_folder = None
     M03_args.output = None
-    g = M03_betas.run(M03_args)
+    g = M03_betas.run(M03_args, _gwas)
 
     M04_zscores.run(args, g)
 
@@ -49,7 +52,7 @@ if __name__ == "__main__":
 # ZScore calculation
     parser.add_argument("--single_snp_model", action="store_true", help="Models are comprised of a single snp per gene", default=False)
     parser.add_argument("--covariance", help="name of file containing covariance data")
-    parser.add_argument("--stream_covariance", help="Option to better handle large covariances, slower but less memory consuming", action="store_true")
+    parser.add_argument("--stream_covariance", help="Option to better handle large covariances, slower but less memory consuming. A binary covariance (see CovarianceToBinary.py) is memory-mapped instead, with no slowdown", action="store_true")
     parser.add_argument("--output_file", help="name of output file")
     parser.add_argument("--remove_ens_version", help="If set, will drop the -version- postfix in gene id.", action="store_true", default=False)
     parser.add_argument("--verbosity", help="Log verbosity level. 1 is everything being logged. 10 is only high level messages, above 10 will hardly log anything", default = "10")
@@ -57,6 +60,8 @@ if __name__ == "__main__":
     parser.add_argument("--overwrite", help="If set, will overwrite the results file if it exists.", action="store_true", default=False)
     parser.add_argument("--additional_output", help="If set, will output additional information.", action="store_true", default=False)
     parser.add_argument("--MAX_R", help="Run only for the first R genes", type=int, default=None)
+    parser.add_argument("--association_batch_size", help="If set, compute associations vectorized over blocks of this many genes", type=int, default=None)
+    parser.add_argument("--parallelism", help="Number of worker processes to split the genes across", type=int, default=None)
 
     args = parser.parse_args()
 
@@ -0,0 +1,285 @@
+"""
+Binary, indexed alternative to the gzipped "GENE RSID1 RSID2 VALUE" matrix text files.
+
+Each model's (i.e. gene's) matrix is stored as the row-major upper triangle of a dense block,
+with missing entries stored as NaN. The file is laid out as:
+
+    MAGIC | index offset (uint64) | index length (uint64)
+    values: one upper triangle block per model, contiguous
+    ids: int32 codes into the id table, one run per model
+    id table: newline-separated ids
+    index: json with models, dtype, and section positions
+
+Reading a model's matrix is a positioned read of its block; the text file is never parsed.
+"""
+import json
+import logging
+import os
+import struct
+
+import numpy
+import pandas
+
+from . import Exceptions
+from . import MatrixManager
+from .misc import DataFrameStreamer
+
+MAGIC = b"MXCOVBIN"
+_PREFIX = struct.Struct("<8sQQ")
+VERSION = 1
+
+def is_binary_matrix(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+def load_binary_matrix_manager(path, permissive=False, memory_map=False):
+    Klass = MemmapMatrixManager if memory_map else BinaryMatrixManager
+    class _PermissiveBinaryMatrixManager(Klass):
+        def get(self, key, whitelist=None, strict_whitelist=False):
+            return super(_PermissiveBinaryMatrixManager, self).get(key, whitelist, strict_whitelist)
+
+    return Klass(path) if not permissive else _PermissiveBinaryMatrixManager(path)
+
+########################################################################################################################
+class BinaryIndex(object):
+    """Per-model position of the data in a binary matrix file"""
+    def __init__(self, index, ids, codes):
+        self.dtype = numpy.dtype(index["dtype"])
+        self.models = index["models"]
+        self.positions = {x:i for i,x in enumerate(self.models)}
+        self.n_ids = numpy.array(index["n_ids"], dtype=numpy.int64)
+        self.n_valid_ids = index["n_valid_ids"]
+        self.ids = ids
+        self.codes = codes
+
+        n_values = self.n_ids*(self.n_ids+1)//2
+        self.value_offsets = numpy.zeros(len(self.models)+1, dtype=numpy.int64)
+        numpy.cumsum(n_values, out=self.value_offsets[1:])
+        self.id_offsets = numpy.zeros(len(self.models)+1, dtype=numpy.int64)
+        numpy.cumsum(self.n_ids, out=self.id_offsets[1:])
+
+    def model_ids(self, i):
+        c = self.codes[self.id_offsets[i]:self.id_offsets[i+1]]
+        return [self.ids[x] for x in c]
+
+def read_index(path):
+    with open(path, "rb") as f:
+        magic, index_offset, index_length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise Exceptions.InvalidInputFormat("%s is not a binary matrix file" % (path))
+        f.seek(index_offset)
+        index = json.loads(f.read(index_length).decode())
+        if index["version"] != VERSION:
+            raise Exceptions.InvalidInputFormat("Unsupported binary matrix version %s in %s" % (str(index["version"]), path))
+
+        f.seek(index["codes_offset"])
+        codes = numpy.fromfile(f, dtype=numpy.int32, count=index["codes_count"])
+        f.seek(index["ids_offset"])
+        ids = f.read(index["ids_length"]).decode()
+        ids = ids.split("\n") if len(ids) else []
+    return BinaryIndex(index, ids, codes)
+
+########################################################################################################################
+class BinaryMatrixManager(MatrixManager.MatrixManagerBase):
+    """
+    Reads matrices from a binary matrix file (see `build_binary_matrix`).
+    Only the index is loaded in memory; any model can be asked for, in any order.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = read_index(path)
+        self.file = open(path, "rb")
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if getattr(self, "file", None):
+            self.file.close()
+            self.file = None
+
+    def _values(self, i):
+        # Positional read: the file offset is not touched, so that forked processes can share the handle.
+        index = self.index
+        offset = _PREFIX.size + int(index.value_offsets[i]) * index.dtype.itemsize
+        size = int(index.value_offsets[i+1] - index.value_offsets[i]) * index.dtype.itemsize
+        return numpy.frombuffer(os.pread(self.file.fileno(), size, offset), dtype=index.dtype)
+
+    def _block(self, key):
+        i = self.index.positions[key]
+        ids = self.index.model_ids(i)
+        return ids, _to_dense(self._values(i), len(ids))
+
+    def get(self, key, whitelist=None, strict_whitelist=True):
+        if not key in self.index.positions:
+            return None, None
+        ids, matrix = self._block(key)
+        return _get(ids, matrix, key, whitelist, strict_whitelist)
+
+    def get_2(self, key, snps_1, snps_2):
+        if not key in self.index.positions:
+            return None, None
+        ids, matrix = self._block(key)
+        return _get_2(ids, matrix, key, snps_1, snps_2)
+
+    def model_labels(self):
+        return set(self.index.models)
+
+    def n_ids(self, gene):
+        if not gene in self.index.positions:
+            return numpy.nan
+        return self.index.n_valid_ids[self.index.positions[gene]]
+
+class MemmapMatrixManager(BinaryMatrixManager):
+    """
+    Like `BinaryMatrixManager`, but the values are memory-mapped instead of read:
+    a model's block is a slice of the map, so lookups in any order cost no parsing, no read calls,
+    and resident memory holds little beyond the index and the pages currently in use.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = read_index(path)
+        self.file = None
+        n = int(self.index.value_offsets[-1])
+        if n:
+            self.values = numpy.memmap(path, dtype=self.index.dtype, mode="r", offset=_PREFIX.size, shape=(n,))
+        else:
+            self.values = numpy.array([], dtype=self.index.dtype)
+
+    def close(self):
+        self.values = None
+
+    def _values(self, i):
+        return self.values[self.index.value_offsets[i]:self.index.value_offsets[i+1]]
+
+def _to_dense(values, n):
+    matrix = numpy.empty((n, n), dtype=numpy.float64)
+    i, j = numpy.triu_indices(n)
+    matrix[i, j] = values
+    matrix[j, i] = values
+    return matrix
+
+def _valid_rows(matrix):
+    # The text matrix managers drop ids without (non missing) entries as first id; for well formed input, that is an id without variance.
+    return numpy.isfinite(numpy.diag(matrix))
+
+def _get(ids, matrix, key, whitelist, strict_whitelist):
+    if strict_whitelist and whitelist:
+        MatrixManager._check_strict(whitelist, set(ids), key)
+
+    if whitelist:
+        w = whitelist if type(whitelist) == set else set(whitelist)
+        keep = numpy.array([x in w for x in ids], dtype=bool)
+        ids = [x for x in ids if x in w]
+        matrix = matrix[numpy.ix_(keep, keep)]
+
+    keep = _valid_rows(matrix)
+    if not numpy.all(keep):
+        ids = [x for i,x in enumerate(ids) if keep[i]]
+        matrix = matrix[numpy.ix_(keep, keep)]
+    return ids, numpy.matrix(matrix, dtype=numpy.float64)
+
+def _get_2(ids, matrix, key, id_1, id_2):
+    ids, matrix = _get(ids, matrix, key, set(id_1) | set(id_2), False)
+    positions = {x:i for i,x in enumerate(ids)}
+    is1 = sorted([x for x in id_1 if x in positions])
+    is2 = sorted([x for x in id_2 if x in positions])
+    matrix = numpy.asarray(matrix)[numpy.ix_([positions[x] for x in is1], [positions[x] for x in is2])]
+    return is1, is2, numpy.matrix(matrix, dtype=numpy.float64)
+
+########################################################################################################################
+def build_binary_matrix(input_path, output_path, definition=MatrixManager.GENE_SNP_COVARIANCE_DEFINITION, dtype=numpy.float64):
+    """
+    Converts a text matrix file (i.e. a snp covariance) into a binary matrix file.
+    Reads the input one model at a time, so that memory footprint is bounded by the largest model's matrix.
+    """
+    MODEL_KEY = definition[MatrixManager.K_MODEL]
+
+    def _blocks():
+        for d in DataFrameStreamer.data_frame_streamer(input_path, MODEL_KEY):
+            model = d[MODEL_KEY].values[0]
+            logging.log(8, "Converting %s", model)
+            model_ids, matrix = _block_from_dataframe(d, definition, model)
+            yield model, model_ids, matrix
+
+    n_models, n_ids = write_binary_matrix(_blocks(), output_path, dtype)
+    logging.info("Converted %d matrices with %d distinct ids", n_models, n_ids)
+
+def write_binary_matrix(blocks, output_path, dtype=numpy.float64):
+    """
+    Writes `(model, ids, matrix)` blocks, with `matrix` a dense symmetric array (NaN for missing entries), into a binary matrix file.
+    Blocks are written as they come. Returns the number of models and of distinct ids.
+    """
+    dtype = numpy.dtype(dtype)
+
+    models, n_ids, n_valid_ids, codes = [], [], [], []
+    id_codes, ids = {}, []
+    processed = set()
+
+    with open(output_path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, 0, 0))
+        for model, model_ids, matrix in blocks:
+            if model in processed:
+                msg = "Matrix Entries for keys(genes?) must be contiguous but %s was found in two different, uncontiguous places" % (model)
+                raise Exceptions.InvalidInputFormat(msg)
+            processed.add(model)
+
+            values = matrix[numpy.triu_indices(len(model_ids))]
+            f.write(numpy.ascontiguousarray(values, dtype=dtype.newbyteorder("<")).tobytes())
+
+            for x in model_ids:
+                if not x in id_codes:
+                    id_codes[x] = len(ids)
+                    ids.append(x)
+            codes.extend(id_codes[x] for x in model_ids)
+            models.append(str(model))
+            n_ids.append(len(model_ids))
+            n_valid_ids.append(int(numpy.sum(_valid_rows(matrix))))
+
+        codes_offset = f.tell()
+        f.write(numpy.array(codes, dtype="<i4").tobytes())
+
+        ids_offset = f.tell()
+        ids_ = "\n".join(str(x) for x in ids).encode()
+        f.write(ids_)
+
+        index = {"version": VERSION, "dtype": dtype.newbyteorder("<").str,
+                 "models": models, "n_ids": n_ids, "n_valid_ids": n_valid_ids,
+                 "codes_offset": codes_offset, "codes_count": len(codes),
+                 "ids_offset": ids_offset, "ids_length": len(ids_)}
+        index = json.dumps(index).encode()
+        index_offset = f.tell()
+        f.write(index)
+
+        f.seek(0)
+        f.write(_PREFIX.pack(MAGIC, index_offset, len(index)))
+    return len(models), len(ids)
+
+def _block_from_dataframe(d, definition, model):
+    ID1_KEY = definition[MatrixManager.K_ID1]
+    ID2_KEY = definition[MatrixManager.K_ID2]
+    VALUE_KEY = definition[MatrixManager.K_VALUE]
+
+    if numpy.any(d.duplicated()):
+        raise Exceptions.InvalidInputFormat("Duplicated entries found in matrix file")
+
+    id1 = d[ID1_KEY].astype(str).values
+    id2 = d[ID2_KEY].astype(str).values
+    try:
+        value = pandas.to_numeric(d[VALUE_KEY].replace("NA", numpy.nan), errors="raise").values.astype(numpy.float64)
+    except (ValueError, TypeError) as e:
+        raise Exceptions.InvalidInputFormat("Invalid value for %s: %s" % (model, str(e)))
+
+    # ids in order of first appearance as first id, as in the text matrix managers.
+    model_ids = list(pandas.unique(numpy.concatenate([id1, id2])))
+    positions = {x:i for i,x in enumerate(model_ids)}
+    i = numpy.array([positions[x] for x in id1], dtype=numpy.int64)
+    j = numpy.array([positions[x] for x in id2], dtype=numpy.int64)
+
+    matrix = numpy.full((len(model_ids), len(model_ids)), numpy.nan)
+    matrix[i, j] = value
+    matrix[j, i] = value
+    return model_ids, matrix
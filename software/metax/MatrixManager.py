@@ -24,6 +24,11 @@ class CDTF(object):
     VALUE=3
 
 def load_matrix_manager(path, definition=GENE_SNP_COVARIANCE_DEFINITION, permissive=False):
+    from . import BinaryMatrixManager
+    if BinaryMatrixManager.is_binary_matrix(path):
+        logging.info("Using binary matrix from %s", path)
+        return BinaryMatrixManager.load_binary_matrix_manager(path, permissive)
+
     class _PermissiveMatrixManager(MatrixManager):
         def get(self, key, whitelist=None, strict_whitelist=False):
             return super(_PermissiveMatrixManager, self).get(key, whitelist, strict_whitelist)
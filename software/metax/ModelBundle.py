@@ -0,0 +1,213 @@
+"""
+Compiled, columnar alternative to a set of prediction model (sqlite) databases.
+
+A bundle holds the weights of any number of model databases ("sources", i.e. tissues), one row per weight,
+with sources contiguous and in input order. Strings are stored once, in tables, and referred to by int32 codes
+(-1 stands for a missing value). The file is laid out as:
+
+    MAGIC | index offset (uint64) | index length (uint64)
+    arrays: gene, variant, effect allele and non effect allele codes (int32), weights (float64)
+    tables: newline-separated genes, variants and alleles
+    index: json with sources, row offsets, extra tables and section positions
+
+Numeric arrays are memory-mapped; loading a bundle parses no sql and no text beyond the string tables.
+"""
+import json
+import logging
+import os
+import struct
+
+import numpy
+import pandas
+
+from . import Exceptions
+from . import NamingConventions
+from . import PredictionModel
+from .PredictionModel import WDBQF, WDBEQF
+
+MAGIC = b"MXMODBUN"
+_PREFIX = struct.Struct("<8sQQ")
+VERSION = 1
+
+_ARRAYS = [("gene", "<i4"), ("variant", "<i4"), ("effect_allele", "<i4"), ("non_effect_allele", "<i4"), ("weight", "<f8")]
+_TABLES = ["genes", "variants", "alleles"]
+
+def is_model_bundle(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+########################################################################################################################
+class ModelBundle(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, index_offset, index_length = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC:
+                raise Exceptions.InvalidInputFormat("%s is not a model bundle" % (path))
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode())
+            if index["version"] != VERSION:
+                raise Exceptions.InvalidInputFormat("Unsupported model bundle version %s in %s" % (str(index["version"]), path))
+
+            tables = {}
+            for name in _TABLES:
+                f.seek(index[name + "_offset"])
+                t = f.read(index[name + "_length"]).decode()
+                t = t.split("\n") if index[name + "_count"] else []
+                tables[name] = numpy.array(t + [None], dtype=object)
+
+        self.snp_key = index["snp_key"]
+        self.sources = index["sources"]
+        self.row_offsets = numpy.array(index["row_offsets"], dtype=numpy.int64)
+        self.extra = index["extra"]
+        self.tables = tables
+
+        n = int(self.row_offsets[-1])
+        self.arrays = {}
+        for name, dtype in _ARRAYS:
+            if n:
+                self.arrays[name] = numpy.memmap(path, dtype=dtype, mode="r", offset=index[name + "_offset"], shape=(n,))
+            else:
+                self.arrays[name] = numpy.array([], dtype=dtype)
+
+    def check_snp_key(self, snp_key):
+        if (snp_key or None) != self.snp_key:
+            raise Exceptions.InvalidArguments("Model bundle %s was built with snp key %s, but %s was requested" % (self.path, str(self.snp_key), str(snp_key)))
+
+    def weights(self, sources=None):
+        """Weights of the given sources (or all of them), as in `PredictionModel.Model.weights`"""
+        rows = self._rows(sources)
+        a = self.arrays
+        # code -1, the last entry in each table, is a missing value
+        d = {WDBQF.K_RSID: self.tables["variants"][a["variant"][rows]],
+             WDBQF.K_GENE: self.tables["genes"][a["gene"][rows]],
+             WDBQF.K_WEIGHT: numpy.array(a["weight"][rows], dtype=numpy.float64),
+             WDBQF.K_EFFECT_ALLELE: self.tables["alleles"][a["effect_allele"][rows]],
+             WDBQF.K_NON_EFFECT_ALLELE: self.tables["alleles"][a["non_effect_allele"][rows]]}
+        return pandas.DataFrame(d, columns=[key for key, order in WDBQF.ORDER])
+
+    def model(self, source):
+        i = self.sources.index(source)
+        e = self.extra[i]
+        extra = pandas.DataFrame({key: e[key] for key, order in WDBEQF.ORDER}, columns=[key for key, order in WDBEQF.ORDER])
+        return PredictionModel.Model(self.weights([source]), extra)
+
+    def _rows(self, sources):
+        if sources is None:
+            return slice(0, int(self.row_offsets[-1]))
+        positions = [self.sources.index(x) for x in sources]
+        if len(positions) == 1:
+            i = positions[0]
+            return slice(int(self.row_offsets[i]), int(self.row_offsets[i+1]))
+        return numpy.concatenate([numpy.arange(self.row_offsets[i], self.row_offsets[i+1]) for i in positions])
+
+    def source_rows(self):
+        """Index of the source of each row"""
+        return numpy.repeat(numpy.arange(len(self.sources)), numpy.diff(self.row_offsets))
+
+def load_model(path, snp_key=None):
+    bundle = ModelBundle(path)
+    bundle.check_snp_key(snp_key)
+    if len(bundle.sources) != 1:
+        raise Exceptions.InvalidArguments("Model bundle %s holds %d models; a single one was expected" % (path, len(bundle.sources)))
+    return bundle.model(bundle.sources[0])
+
+def load_models(path, name_pattern=None, name_filter=None, snp_key=None):
+    """All of the weights in the bundle with a -model- column, as built by `PredictionModel.load_model_manager` from a folder"""
+    bundle = ModelBundle(path)
+    bundle.check_snp_key(snp_key)
+    sources = _filtered(bundle.sources, name_filter)
+    weights = bundle.weights(sources)
+    names = numpy.array([NamingConventions.extract_model_name(x, name_pattern) for x in sources], dtype=object)
+    counts = [int(bundle.row_offsets[bundle.sources.index(x)+1] - bundle.row_offsets[bundle.sources.index(x)]) for x in sources]
+    weights["model"] = numpy.repeat(names, counts)
+    return weights
+
+def load_genes(path, name_filter=None):
+    bundle = ModelBundle(path)
+    sources = _filtered(bundle.sources, name_filter)
+    e = [bundle.extra[bundle.sources.index(x)] for x in sources]
+    genes = pandas.DataFrame({WDBEQF.K_GENE: [g for x in e for g in x[WDBEQF.K_GENE]],
+                              WDBEQF.K_GENE_NAME: [g for x in e for g in x[WDBEQF.K_GENE_NAME]]})
+    return genes.drop_duplicates()
+
+def _filtered(sources, name_filter):
+    paths = PredictionModel._filter_paths(sources, name_filter)
+    return [x for x in sources if x in set(paths)]
+
+########################################################################################################################
+def build_model_bundle(paths, output_path, snp_key=None):
+    """
+    Compiles the model databases at `paths` into a bundle, one source per database, named after the database's file name.
+    Databases are read one at a time.
+    """
+    codes = {name: {} for name in _TABLES}
+    tables = {name: [] for name in _TABLES}
+    def _encode(table, values):
+        c, t = codes[table], tables[table]
+        r = numpy.empty(len(values), dtype=numpy.int32)
+        for i, x in enumerate(values):
+            if x is None:
+                r[i] = -1
+                continue
+            if not x in c:
+                if "\n" in x:
+                    raise Exceptions.InvalidInputFormat("Unsupported value in model database: %s" % (repr(x)))
+                c[x] = len(t)
+                t.append(x)
+            r[i] = c[x]
+        return r
+
+    sources, row_offsets, extra = [], [0], []
+    columns = {name: [] for name, dtype in _ARRAYS}
+    for path in paths:
+        logging.log(9, "Compiling %s", path)
+        name = os.path.split(path)[1]
+        if name in sources:
+            raise Exceptions.InvalidArguments("Two model databases are named %s" % (name))
+        model = PredictionModel.load_model(path, snp_key)
+        w = model.weights
+        columns["gene"].append(_encode("genes", w[WDBQF.K_GENE].values))
+        columns["variant"].append(_encode("variants", w[WDBQF.K_RSID].values))
+        columns["effect_allele"].append(_encode("alleles", w[WDBQF.K_EFFECT_ALLELE].values))
+        columns["non_effect_allele"].append(_encode("alleles", w[WDBQF.K_NON_EFFECT_ALLELE].values))
+        columns["weight"].append(numpy.array(w[WDBQF.K_WEIGHT].values, dtype=numpy.float64))
+        sources.append(name)
+        row_offsets.append(row_offsets[-1] + w.shape[0])
+        extra.append({key: [_plain(x) for x in model.extra[key]] for key, order in WDBEQF.ORDER})
+
+    index = {"version": VERSION, "snp_key": snp_key or None, "sources": sources, "row_offsets": row_offsets, "extra": extra}
+    with open(output_path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, 0, 0))
+        for name, dtype in _ARRAYS:
+            _align(f)
+            index[name + "_offset"] = f.tell()
+            a = numpy.concatenate(columns[name]) if len(columns[name]) else numpy.array([])
+            f.write(numpy.ascontiguousarray(a, dtype=dtype).tobytes())
+
+        for name in _TABLES:
+            t = "\n".join(tables[name]).encode()
+            index[name + "_offset"] = f.tell()
+            index[name + "_length"] = len(t)
+            index[name + "_count"] = len(tables[name])
+            f.write(t)
+
+        index = json.dumps(index).encode()
+        index_offset = f.tell()
+        f.write(index)
+
+        f.seek(0)
+        f.write(_PREFIX.pack(MAGIC, index_offset, len(index)))
+    logging.info("Compiled %d models with %d weights", len(sources), row_offsets[-1])
+
+def _align(f, alignment=8):
+    p = f.tell()
+    if p % alignment:
+        f.write(b"\0" * (alignment - p % alignment))
+
+def _plain(x):
+    # numpy scalars to their json serializable python equivalents
+    return x.item() if isinstance(x, numpy.generic) else x
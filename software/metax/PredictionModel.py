@@ -2,6 +2,7 @@ import logging
 import os
 import sqlite3
 import re
+import numpy
 import pandas
 
 from . import Exceptions
@@ -137,6 +138,11 @@ def dataframe_from_extra_data(e):
     return extra
 
 def load_model(path, snp_key=None):
+    from . import ModelBundle
+    if ModelBundle.is_model_bundle(path):
+        logging.log(9, "Using model bundle %s", path)
+        return ModelBundle.load_model(path, snp_key)
+
     db = ModelDB(path, snp_key=snp_key)
     weights, extra = db.load_weights(), db.load_extra()
 
@@ -156,6 +162,10 @@ def load_model(path, snp_key=None):
     return model
 
 def load_genes(folder, name_filter=None):
+    from . import ModelBundle
+    if ModelBundle.is_model_bundle(folder):
+        return ModelBundle.load_genes(folder, name_filter)
+
     model_paths = _model_paths(folder, name_filter)
     models = pandas.DataFrame()
 
@@ -228,10 +238,13 @@ def _get_snp_key(models):
     return keys
 
 def _model_paths(path, name_filter=None):
-    f = [re.compile(x) for x in name_filter] if name_filter else [re.compile(".*db$")]
-    paths = [os.path.join(path, x) for x in os.listdir(path) if True in [f_.search(x) is not None for f_ in f]]
+    paths = [os.path.join(path, x) for x in _filter_paths(os.listdir(path), name_filter)]
     return paths
 
+def _filter_paths(names, name_filter=None):
+    f = [re.compile(x) for x in name_filter] if name_filter else [re.compile(".*db$")]
+    return [x for x in names if True in [f_.search(x) is not None for f_ in f]]
+
 ###############################################################################
 class _ModelManager(ModelManagerBase):
     """Version that performs certain operations faster, but returns data in different format!"""
@@ -288,8 +301,76 @@ def _prepare_models_2(models):
         rsid_to_genes[t.rsid].add(t.gene)
     return r, rsids, rsid_to_genes
 
+###############################################################################
+class _ArrayModelManager(ModelManagerBase):
+    """
+    Same interface and output as `_ModelManager`, but the weights are held in integer coded arrays
+    sorted by gene, model and rsid, with offsets to each gene's and each (gene, model)'s rows;
+    lookups are array slices instead of nested dictionaries built row by row.
+    """
+    def __init__(self, models):
+        logging.log(9, "preparing models (array layout)")
+        gene_codes, self.genes = pandas.factorize(models.gene.values)
+        model_codes, self.labels = pandas.factorize(models.model.values)
+        rsid_codes, self.rsid_table = pandas.factorize(models.rsid.values)
+        self.genes = numpy.asarray(self.genes, dtype=object)
+        self.labels = numpy.asarray(self.labels, dtype=object)
+        self.rsid_table = numpy.asarray(self.rsid_table, dtype=object)
+        self.gene_index = {x:i for i,x in enumerate(self.genes)}
+        self.rsid_index = {x:i for i,x in enumerate(self.rsid_table)}
+
+        # stable, so that a repeated (gene, model, rsid) keeps its last weight, as in the dictionary layout
+        order = numpy.lexsort((rsid_codes, model_codes, gene_codes))
+        self.gene_codes = gene_codes[order].astype(numpy.int32)
+        self.model_codes = model_codes[order].astype(numpy.int32)
+        self.rsid_codes = rsid_codes[order].astype(numpy.int32)
+        self.weights = numpy.asarray(models.weight.values, dtype=numpy.float64)[order]
+
+        n = len(order)
+        self.gene_offsets = numpy.searchsorted(self.gene_codes, numpy.arange(len(self.genes)+1))
+        change = numpy.nonzero((self.gene_codes[1:] != self.gene_codes[:-1]) | (self.model_codes[1:] != self.model_codes[:-1]))[0] + 1
+        self.pair_offsets = numpy.concatenate([[0], change, [n]]) if n else numpy.array([0])
+        self.gene_pair_offsets = numpy.searchsorted(self.gene_codes[self.pair_offsets[:-1]], numpy.arange(len(self.genes)+1))
+
+    def get_genes(self):
+        return set(self.genes)
+
+    def get_implicated_genes(self, snps):
+        codes = [self.rsid_index[x] for x in snps if x in self.rsid_index]
+        selected = numpy.zeros(len(self.rsid_table), dtype=bool)
+        selected[codes] = True
+        return set(self.genes[numpy.unique(self.gene_codes[selected[self.rsid_codes]])])
+
+    def get_rsids(self, gene = None):
+        if not gene: return set(self.rsid_table)
+        if not gene in self.gene_index: return None
+        rows = self._gene_rows(gene)
+        return set(self.rsid_table[self.rsid_codes[rows]])
+
+    def get_model_labels(self, gene = None):
+        if not gene: return set(self.labels)
+        if not gene in self.gene_index: return None
+        rows = self._gene_rows(gene)
+        return set(self.labels[self.model_codes[rows]])
+
+    def get_models(self, gene):
+        i = self.gene_index[gene]
+        r = {}
+        for p in range(self.gene_pair_offsets[i], self.gene_pair_offsets[i+1]):
+            s, e = self.pair_offsets[p], self.pair_offsets[p+1]
+            r[self.labels[self.model_codes[s]]] = dict(zip(self.rsid_table[self.rsid_codes[s:e]], self.weights[s:e].tolist()))
+        return r
+
+    def _gene_rows(self, gene):
+        i = self.gene_index[gene]
+        return slice(self.gene_offsets[i], self.gene_offsets[i+1])
+
 ###############################################################################
 def load_model_manager(path, trim_ensemble_version=False, Klass=ModelManager, name_pattern=None, name_filter=None, model_db_snp_key=None):
+    """
+    :param path: a folder with model databases, or a model bundle (see `ModelBundle`)
+    """
+    from . import ModelBundle
 
     def _get_models(paths, trim_ensemble_version=False):
         logging.log(9, "preloading models")
@@ -302,14 +383,22 @@ def load_model_manager(path, trim_ensemble_version=False, Klass=ModelManager, na
             w["model"] = k
         _m = [x.weights for x in list(_m.values())]
         models = pandas.concat(_m)
-        if trim_ensemble_version:
-            k = models.gene.str.split(".").str.get(0)
-            if len(set(k)) != len(set(models.gene)):
-                raise Exceptions.ReportableException("genes cannot lose the ensemble version id")
-            models.gene = k
+        return _trim(models) if trim_ensemble_version else models
+
+    def _trim(models):
+        k = models.gene.str.split(".").str.get(0)
+        if len(set(k)) != len(set(models.gene)):
+            raise Exceptions.ReportableException("genes cannot lose the ensemble version id")
+        models.gene = k
         return models
 
-    paths = _model_paths(path, name_filter)
-    models = _get_models(paths, trim_ensemble_version)
+    if ModelBundle.is_model_bundle(path):
+        logging.log(9, "loading model bundle %s", path)
+        models = ModelBundle.load_models(path, name_pattern, name_filter, model_db_snp_key)
+        if trim_ensemble_version:
+            models = _trim(models)
+    else:
+        paths = _model_paths(path, name_filter)
+        models = _get_models(paths, trim_ensemble_version)
     model_manager = Klass(models)
     return model_manager
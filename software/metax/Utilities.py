@@ -227,6 +227,20 @@ def save_dataframe(d, path, mode="w", header=True):
     ensure_requisite_folders(path)
     d.to_csv(path, header=header, mode=mode, compression=compression, sep="\t", index=False, na_rep="NA")
 
+def save_dataframe_atomically(d, path, **kwargs):
+    """Writes a csv (pandas.DataFrame.to_csv arguments) to a temporary file besides `path`, then moves it in place,
+    so that `path` is either absent or complete."""
+    ensure_requisite_folders(path)
+    folder, name = os.path.split(path)
+    # keep the name's extension, pandas infers compression from it
+    temporary = os.path.join(folder, ".{}.{}".format(os.getpid(), name))
+    try:
+        d.to_csv(temporary, **kwargs)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
 def save_table(data, path, mode="w", header=None):
     compression = "gzip" if "gz" in path else None
     def _ogz(p):
@@ -10,10 +10,12 @@ from .. import Utilities
 class Context(object):
     def __init__(self): raise Exceptions.ReportableException("Tried to instantiate abstract Joint Analysis context")
     def get_genes(self): raise  Exceptions.NotImplemented("Context: get_genes")
+    def get_gene_blocks(self): raise  Exceptions.NotImplemented("Context: get_gene_blocks")
+    def use_gene_block(self, block): raise  Exceptions.NotImplemented("Context: use_gene_block")
     def get_n_genes(self): raise  Exceptions.NotImplemented("Context: get_n_genes")
     def get_metaxcan_zscores(self, gene): raise  Exceptions.NotImplemented("Context: get_metaxcan_zscores")
     def get_model_matrix(self, gene, tissues): raise  Exceptions.NotImplemented("Context: get_model_matrix")
-    def get_cutoff(self, matrix): raise  Exceptions.NotImplemented("Context: get_cutoff")
+    def get_cutoff(self, matrix, eigenvalues=None): raise  Exceptions.NotImplemented("Context: get_cutoff")
     def get_gene_name(self, gene): raise  Exceptions.NotImplemented("Context: get_gene_name")
     def check(self): raise Exceptions.NotImplemented("Context: check")
 
@@ -34,8 +36,8 @@ class ContextMixin(object):
     def get_model_matrix(self, gene, tissues):
         return self.matrix_manager.get(gene, tissues)
 
-    def get_cutoff(self, matrix):
-        return self.cutoff(matrix)
+    def get_cutoff(self, matrix, eigenvalues=None):
+        return self.cutoff(matrix, eigenvalues)
 
     def get_gene_name(self, gene):
         return self.gene_names[gene]
@@ -61,7 +63,26 @@ class CalculationStatus(object):
     COMPLEX_COVARIANCE = -7
     INADEQUATE_INVERSE = -8
 
-def joint_analysis(context, gene):
+class JointAnalysisInput(object):
+    """
+    A gene's input to the joint analysis, as gathered from the context by `prepare_joint_analysis`.
+    `result` holds the finished result tuple for genes that need no further calculation.
+    """
+    def __init__(self, gene, g, g_n, n, z_min, z_max, z_mean, z_sd, labels=None, matrix=None, zscores=None, result=None):
+        self.gene = gene
+        self.g = g
+        self.g_n = g_n
+        self.n = n
+        self.z_min = z_min
+        self.z_max = z_max
+        self.z_mean = z_mean
+        self.z_sd = z_sd
+        self.labels = labels
+        self.matrix = matrix
+        self.zscores = zscores
+        self.result = result
+
+def prepare_joint_analysis(context, gene):
     g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status \
         = None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalculationStatus.NO_DATA
     g = gene.split(".")[0] if context.get_trimmed_ensemble_id() else gene
@@ -72,7 +93,8 @@ def joint_analysis(context, gene):
     zscores, tissue_labels = context.get_metaxcan_zscores(gene)
     if not zscores or len(zscores) == 0:
         status = CalculationStatus.NO_METAXCAN_RESULTS
-        return g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status
+        result = g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status
+        return JointAnalysisInput(gene, g, g_n, n, z_min, z_max, z_mean, z_sd, result=result)
     n = len(zscores)
     z_min = numpy.min(zscores)
     z_max = numpy.max(zscores)
@@ -85,7 +107,21 @@ def joint_analysis(context, gene):
 
     if not labels or len(labels) == 0:
         status = CalculationStatus.NO_PRODUCT
-        return g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status
+        result = g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status
+        return JointAnalysisInput(gene, g, g_n, n, z_min, z_max, z_mean, z_sd, result=result)
+
+    _d = {tissue_labels[i]:zscores[i] for i in range(0, len(tissue_labels))}
+    zscores = array([_d[l] for l in labels])
+    return JointAnalysisInput(gene, g, g_n, n, z_min, z_max, z_mean, z_sd, labels, matrix, zscores)
+
+def joint_analysis(context, gene):
+    prepared = prepare_joint_analysis(context, gene)
+    if prepared.result is not None:
+        return prepared.result
+
+    g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status \
+        = prepared.g, prepared.g_n, None, prepared.n, None, None, None, None, None, None, None, None, prepared.z_min, prepared.z_max, prepared.z_mean, prepared.z_sd, None, CalculationStatus.NO_DATA
+    labels, matrix, zscores = prepared.labels, prepared.matrix, prepared.zscores
 
     # also, check that the matrix actually makes sense. We are currently returning it just in case but matrices with complex covariance are suspicious.
     e, v = numpy.linalg.eigh(matrix)
@@ -96,12 +132,10 @@ def joint_analysis(context, gene):
         return g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status
 
     # If no eigenvalue satisfies our cutoff criteria, at least the first component will be used
-    # Note there is a slight numerical mismatch between the resolution in eigh and the svd
-    cutoff = context.get_cutoff(matrix)
+    # The cutoff, the pseudo inverse and everything derived from them reuse this single eigendecomposition.
+    cutoff = context.get_cutoff(matrix, e)
 
-    _d = {tissue_labels[i]:zscores[i] for i in range(0, len(tissue_labels))}
-    zscores = array([_d[l] for l in labels])
-    inv, n_indep, eigen = Math.capinv(matrix, cutoff, context.epsilon)
+    inverse_eigen, n_indep, eigen = Math.capinv_eigh(e, cutoff, context.epsilon)
 
     eigen_max, eigen_min = numpy.max(eigen), numpy.min(eigen)
     eigen_min_kept = numpy.min([x for x in eigen[0:n_indep]])
@@ -118,19 +152,19 @@ def joint_analysis(context, gene):
     t_i_worst = labels[_minzi]
 
     #TODO: implement a better heuristic
-    try:
-        eigen_w, eigen_v = numpy.linalg.eigh(inv)
-    except:
+    if not numpy.all(numpy.isfinite(inverse_eigen)):
         #WTCCC 'ENSG00000204560.5'
         logging.log(8, "Problems with inverse for %s, skipping", gene)
         status = CalculationStatus.INVERSE_ERROR
         return g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status
 
     ####################################################################################################################
-    w = float(dot(dot(zscores, inv), zscores))
+    # z'.inv.z and trace(matrix.inv), with inv = v.diag(inverse_eigen).v'
+    y = dot(numpy.asarray(v).T, zscores)
+    w = float(numpy.sum(inverse_eigen * y * y))
     chi2_p = stats.chi2.sf(w, n_indep)
 
-    tmi = numpy.trace(numpy.dot(matrix,inv))
+    tmi = numpy.sum(e * inverse_eigen)
 
     # if we got to this point, we are  ok-ish. The chi distribution might have been unable to calculate the pvalue because it is too small...
     if chi2_p == 0:
@@ -142,6 +176,78 @@ def joint_analysis(context, gene):
 
     return g, g_n, pvalue, n, n_indep, p_i_best, t_i_best, p_i_worst, t_i_worst, eigen_max, eigen_min, eigen_min_kept, z_min, z_max, z_mean, z_sd, tmi, status
 
+def joint_analysis_batch(context, genes):
+    """
+    Same as `joint_analysis`, for several genes at once. Returns a list of result tuples, in the same order as `genes`.
+    """
+    return solve_joint_analysis(context, [prepare_joint_analysis(context, gene) for gene in genes])
+
+def solve_joint_analysis(context, inputs):
+    """
+    Results for genes' `JointAnalysisInput`, in the same order.
+    Genes whose matrices have the same dimension are stacked and solved together, with a single call to each linear algebra routine.
+    Contexts that hold data one gene at a time (such as a streamed snp covariance) can prepare each gene as it comes,
+    and solve them later.
+    """
+    results = [x.result for x in inputs]
+    by_size = {}
+    for j, x in enumerate(inputs):
+        if x.result is None:
+            by_size.setdefault(len(x.labels), []).append(j)
+    for size in sorted(by_size):
+        indices = by_size[size]
+        for j, result in zip(indices, _solve_stack(context, [inputs[j] for j in indices])):
+            results[j] = result
+    return results
+
+def _solve_stack(context, inputs):
+    matrix = numpy.array([numpy.asarray(x.matrix) for x in inputs], dtype=numpy.float64)
+    zscores = numpy.array([x.zscores for x in inputs], dtype=numpy.float64)
+    e, v = numpy.linalg.eigh(matrix)
+    complex_covariance = numpy.imag(e).any(axis=1)
+    e = numpy.real(e)
+
+    cutoff = numpy.array([context.get_cutoff(x.matrix, e[j]) for j, x in enumerate(inputs)], dtype=numpy.float64)
+    inverse_eigen, n_indep, eigen = Math.capinv_eigh(e, cutoff, context.epsilon)
+    rows = numpy.arange(len(inputs))
+    # singular values come sorted in decreasing order, and the kept ones are always the first
+    eigen_max, eigen_min, eigen_min_kept = eigen[:, 0], eigen[:, -1], eigen[rows, n_indep-1]
+
+    _absz = numpy.abs(zscores)
+    _maxzi = numpy.argmax(_absz, axis=1)
+    p_i_best = 2*stats.norm.sf(_absz[rows, _maxzi])
+    _minzi = numpy.argmin(_absz, axis=1)
+    p_i_worst = 2*stats.norm.sf(_absz[rows, _minzi])
+
+    inverse_error = ~numpy.all(numpy.isfinite(inverse_eigen), axis=1)
+
+    # z'.inv.z and trace(matrix.inv), with inv = v.diag(inverse_eigen).v'
+    y = numpy.matmul(zscores[:, numpy.newaxis, :], v)[:, 0, :]
+    with numpy.errstate(invalid="ignore"):
+        w = numpy.sum(inverse_eigen * y * y, axis=1)
+        chi2_p = stats.chi2.sf(w, n_indep)
+        tmi = numpy.sum(e * inverse_eigen, axis=1)
+
+    results = []
+    for j, x in enumerate(inputs):
+        if complex_covariance[j]:
+            results.append((x.g, x.g_n, None, x.n, None, None, None, None, None, numpy.max(e[j]), numpy.min(e[j]), None,
+                            x.z_min, x.z_max, x.z_mean, x.z_sd, None, CalculationStatus.COMPLEX_COVARIANCE))
+            continue
+
+        t_i_best, t_i_worst = x.labels[_maxzi[j]], x.labels[_minzi[j]]
+        if inverse_error[j]:
+            logging.log(8, "Problems with inverse for %s, skipping", x.gene)
+            results.append((x.g, x.g_n, None, x.n, int(n_indep[j]), p_i_best[j], t_i_best, p_i_worst[j], t_i_worst, eigen_max[j], eigen_min[j], eigen_min_kept[j],
+                            x.z_min, x.z_max, x.z_mean, x.z_sd, None, CalculationStatus.INVERSE_ERROR))
+            continue
+
+        # if we got to this point, we are  ok-ish. The chi distribution might have been unable to calculate the pvalue because it is too small...
+        status = CalculationStatus.INSUFFICIENT_NUMERICAL_RESOLUTION if chi2_p[j] == 0 else CalculationStatus.OK
+        results.append((x.g, x.g_n, chi2_p[j], x.n, int(n_indep[j]), p_i_best[j], t_i_best, p_i_worst[j], t_i_worst, eigen_max[j], eigen_min[j], eigen_min_kept[j],
+                        x.z_min, x.z_max, x.z_mean, x.z_sd, tmi[j], status))
+    return results
+
 def format_results(results):
     columns = ["gene", "gene_name", "pvalue", "n", "n_indep", "p_i_best", "t_i_best", "p_i_worst", "t_i_worst", "eigen_max", "eigen_min", "eigen_min_kept", "z_min", "z_max", "z_mean", "z_sd", "tmi",  "status"]
     results = Utilities.to_dataframe(results, columns)
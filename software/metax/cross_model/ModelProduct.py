@@ -0,0 +1,44 @@
+"""
+Precomputed model products: each gene's tissue by tissue expression correlation, as SMulTiXcan builds it from a snp covariance.
+
+A gene's model product depends only on the models, the snp covariance (the reference panel) and the snps allowed in
+(the intersection with the GWAS, or any standard whitelist), not on the GWAS' results. It can be computed once
+into a binary matrix file (see `BinaryMatrixManager`), and used through SMulTiXcan's `--model_product`
+for any number of phenotypes, skipping the parsing of the snp covariance.
+"""
+import logging
+
+import numpy
+
+from .. import BinaryMatrixManager
+from ..genotype import GeneExpressionMatrixManager
+
+def model_products(snp_covariance_streamer, model_manager, trimmed_ensemble_id=False):
+    """
+    Yields (gene, tissues, matrix) for every gene in both the snp covariance and the models.
+    `tissues` are all of the gene's models, sorted; those left out of the calculation
+    (no snps in the covariance, or no variance) have NaN entries.
+    """
+    genes = model_manager.get_genes()
+    for d in snp_covariance_streamer:
+        if trimmed_ensemble_id:
+            d.GENE = d.GENE.str.split(".").str.get(0)
+        gene = d.GENE.values[0]
+        if not gene in genes:
+            logging.log(6, "Gene %s not in models", gene)
+            continue
+        logging.log(8, "Model product for %s", gene)
+
+        tissues = sorted(model_manager.get_model_labels(gene))
+        labels, matrix = GeneExpressionMatrixManager._GeneExpressionMatrixManager(d, model_manager).get(gene, tissues)
+        product = numpy.full((len(tissues), len(tissues)), numpy.nan)
+        if len(labels):
+            positions = {x:i for i,x in enumerate(tissues)}
+            k = [positions[x] for x in labels]
+            product[numpy.ix_(k, k)] = matrix
+        yield gene, tissues, product
+
+def build_model_product(snp_covariance_streamer, model_manager, output_path, trimmed_ensemble_id=False, dtype=numpy.float64):
+    products = model_products(snp_covariance_streamer, model_manager, trimmed_ensemble_id)
+    n_genes, n_tissues = BinaryMatrixManager.write_binary_matrix(products, output_path, dtype)
+    logging.info("Saved model products for %d genes and %d models", n_genes, n_tissues)
@@ -35,6 +35,13 @@ class SimpleContext(ContextMixin, Context):
             genes = {x for x in matrix_genes if x in results_genes}
         return genes
 
+    def get_gene_blocks(self):
+        # everything is already in memory
+        return ((gene, None) for gene in self.get_genes())
+
+    def use_gene_block(self, block):
+        pass
+
     def get_n_genes(self):
         return len(self.get_genes())
 
@@ -62,6 +69,12 @@ class ExpressionStreamedContext(ContextMixin, Context):
         self.matrix_manager = None
 
     def get_genes(self):
+        for g, d in self.get_gene_blocks():
+            self.use_gene_block(d)
+            yield g
+
+    def get_gene_blocks(self):
+        """Yields each gene with its snp covariance, without configuring the context for it; see `use_gene_block`"""
         for d in self.snp_covariance_streamer:
             if self.trimmed_ensemble_id:
                 d.GENE = d.GENE.str.split(".").str.get(0)
@@ -69,8 +82,10 @@ class ExpressionStreamedContext(ContextMixin, Context):
             if not g in self.gene_names:
                 logging.log(6, "Gene %s not in pre-processed data. Unless you are running with a reduced set of models, this is fishy.", g)
                 continue
-            self.matrix_manager = GeneExpressionMatrixManager._GeneExpressionMatrixManager(d, self.model_manager)
-            yield g
+            yield g, d
+
+    def use_gene_block(self, block):
+        self.matrix_manager = GeneExpressionMatrixManager._GeneExpressionMatrixManager(block, self.model_manager)
 
     def get_n_genes(self):
         return len(self.gene_names)
@@ -86,16 +101,20 @@ def _index(matrix_manager):
     labels = {x.split(".")[0]:x for x in labels}
     return labels
 
+def _eigenvalues(matrix, eigenvalues):
+    # the caller might have them already
+    return eigenvalues if eigenvalues is not None else numpy.linalg.eigh(matrix)[0]
+
 def _cutoff(args):
     class CutoffEigenRatio(object):
         def __init__(self, cutoff_ratio):
             self.cutoff_ratio = float(cutoff_ratio)
 
-        def __call__(self, matrix):
+        def __call__(self, matrix, eigenvalues=None):
             # conceptual shotcut
             if self.cutoff_ratio == 0:
                 return 0.0
-            w, v = numpy.linalg.eigh(matrix)
+            w = _eigenvalues(matrix, eigenvalues)
             w = -numpy.sort(-w)
             cutoff = self.cutoff_ratio * w[0]
             return cutoff
@@ -104,7 +123,7 @@ def _cutoff(args):
         def __init__(self, cutoff_ratio):
             self.cutoff_ratio = float(cutoff_ratio)
 
-        def __call__(self, matrix):
+        def __call__(self, matrix, eigenvalues=None):
             # conceptual shotcut
             if self.cutoff_ratio == 0:
                 return 0.0
@@ -116,11 +135,11 @@ def _cutoff(args):
         def __init__(self, cutoff_threshold):
             self.cutoff_threshold = float(cutoff_threshold)
 
-        def __call__(self, matrix):
+        def __call__(self, matrix, eigenvalues=None):
             #conceptual shotcut
             if self.cutoff_threshold== 0:
                 return 0.0
-            eigen = sorted(numpy.linalg.eigh(matrix)[0], reverse=True)
+            eigen = sorted(_eigenvalues(matrix, eigenvalues), reverse=True)
             trace = numpy.sum(eigen)
             cumsum = numpy.cumsum(eigen)
             objective = trace*(1-self.cutoff_threshold)
@@ -155,6 +174,33 @@ def load_variance(path, trim_ensemble_version=True):
     gene_variance_data = gene_variance_data.sort_index()
     return gene_variance_data
 
+def snp_intersection_from_args(args):
+    logging.info("Assessing GWAS-Models SNP intersection")
+    if args.cleared_snps:
+        intersection = KeyedDataSource.load_data_column(args.cleared_snps, "rsid")
+        intersection = set(intersection)
+    else:
+        intersection = GWASAndModels.gwas_model_intersection(args)
+
+    if len(intersection) == 0:
+        raise Exceptions.ReportableException("No intersection of snps between GWAS and models.")
+    return intersection
+
+def model_manager_from_args(args):
+    logging.info("Loading Model Manager")
+    return PredictionModel.load_model_manager(args.models_folder,
+        trim_ensemble_version=args.trimmed_ensemble_id, Klass=PredictionModel._ArrayModelManager,
+        name_pattern=args.models_name_pattern, name_filter=args.models_name_filter,
+        model_db_snp_key=args.model_db_snp_key)
+
+def snp_covariance_streamer_from_args(args, intersection=None):
+    def _check_in(comps, intersection):
+        return comps[1] not in intersection or comps[2] not in intersection
+
+    logging.info("Preparing SNP covariance")
+    check = (lambda x: _check_in(x, intersection)) if intersection is not None else None
+    return DataFrameStreamer.data_frame_streamer(args.snp_covariance, "GENE", additional_skip_row_check=check)
+
 def context_from_args(args):
     context = None
 
@@ -178,27 +224,9 @@ def context_from_args(args):
     elif args.snp_covariance:
         logging.info("Context for snp covariance")
 
-        logging.info("Assessing GWAS-Models SNP intersection")
-        if args.cleared_snps:
-            intersection = KeyedDataSource.load_data_column(args.cleared_snps, "rsid")
-            intersection = set(intersection)
-        else:
-            intersection = GWASAndModels.gwas_model_intersection(args)
-
-        if len(intersection) == 0:
-            raise Exceptions.ReportableException("No intersection of snps between GWAS and models.")
-
-        logging.info("Loading Model Manager")
-        model_manager = PredictionModel.load_model_manager(args.models_folder,
-            trim_ensemble_version=args.trimmed_ensemble_id, Klass=PredictionModel._ModelManager,
-            name_pattern=args.models_name_pattern, name_filter=args.models_name_filter,
-            model_db_snp_key=args.model_db_snp_key)
-
-        def _check_in(comps, intersection):
-            return comps[1] not in intersection or comps[2] not in intersection
-
-        logging.info("Preparing SNP covariance")
-        snp_covariance_streamer = DataFrameStreamer.data_frame_streamer(args.snp_covariance, "GENE", additional_skip_row_check= lambda x: _check_in(x, intersection))
+        intersection = snp_intersection_from_args(args)
+        model_manager = model_manager_from_args(args)
+        snp_covariance_streamer = snp_covariance_streamer_from_args(args, intersection)
 
         cutoff = _cutoff(args)
 
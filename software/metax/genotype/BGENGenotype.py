@@ -1,25 +1,51 @@
-import bgen_reader
+from bgen_reader import open_bgen
 import numpy
 import pandas
 import logging
 
 from ..misc import Genomics
 
-def bgen_file_geno_lines(file, variant_mapping = None, force_colon = False, use_rsid=False, whitelist=None, skip_palindromic=False, liftover_conversion=None):
+# Upper bound for the probabilities read at once, in bytes
+READ_SIZE = 1 << 28
+
+def bgen_file_geno_lines(file, variant_mapping = None, force_colon = False, use_rsid=False, whitelist=None, skip_palindromic=False, liftover_conversion=None, batch_size=None, regions=None):
+    """
+    Yields (varid, chromosome, position, allele_0, allele_1, allele_1 frequency, dosages) for the selected variants,
+    where dosages is a numpy array with an entry per sample.
+    Genotype probabilities are read `batch_size` variants at a time (by default, as many as fit in `READ_SIZE`).
+    If `regions` (chromosome, start, end) are given, variants outside of them are discarded from the index metadata alone.
+    """
     logging.log(9, "Processing bgen %s", file)
-    bgen = bgen_reader.read_bgen(file)
-    variants = bgen["variants"]
-    dict_mapping = variant_mapping is not None and type(variant_mapping) == dict
-    for variant in variants.itertuples():
-        if use_rsid:
-            varid = variant.rsid
-        else:
-            varid = variant.id
+    # complex files have variants with different phasing or number of alleles
+    with open_bgen(file, allow_complex=True, verbose=False) as bgen:
+        selected = _select(file, bgen, variant_mapping, force_colon, use_rsid, whitelist, skip_palindromic, liftover_conversion, regions)
+        if batch_size is None:
+            batch_size = max(1, READ_SIZE // (bgen.nsamples * 4 * 8))
 
+        for i in range(0, len(selected), batch_size):
+            batch = selected[i:i+batch_size]
+            dosages = _dosages(bgen, [x[0] for x in batch])
+            frequencies = numpy.mean(dosages, axis=0)/2
+            for j, (index, varid, chr, pos, allele_0, allele_1) in enumerate(batch):
+                yield (varid, chr, pos, allele_0, allele_1, frequencies[j], dosages[:,j])
+
+def _select(file, bgen, variant_mapping, force_colon, use_rsid, whitelist, skip_palindromic, liftover_conversion, regions):
+    """Index and metadata of the variants to read"""
+    dict_mapping = variant_mapping is not None and type(variant_mapping) == dict
+    ids = bgen.rsids if use_rsid else bgen.ids
+    rows = slice(None)
+    if regions is not None:
+        rows = numpy.where(Genomics.in_regions(bgen.chromosomes, bgen.positions, regions))[0]
+        if len(rows) == 0:
+            logging.warning("No variant of %s falls in the requested regions; check that its chromosome names match the models'", file)
+    indices = numpy.arange(bgen.nvariants)[rows]
+    selected = []
+    for index, varid, alleles, chr, pos in zip(indices, ids[rows], bgen.allele_ids[rows], bgen.chromosomes[rows], bgen.positions[rows]):
+        varid, chr, pos = str(varid), str(chr), int(pos)
         if force_colon:
             varid = varid.replace("_", ":")
 
-        alleles = variant.allele_ids.split(",")
+        alleles = alleles.split(",")
         if len(alleles) > 2:
             logging.info("variant %s is multiallelic, skipping", varid)
             continue
@@ -27,8 +53,6 @@ def bgen_file_geno_lines(file, variant_mapping = None, force_colon = False, use_
         if skip_palindromic and Genomics.is_palindromic(allele_0, allele_1):
             continue
 
-        pos = variant.pos
-        chr = variant.chrom
         if liftover_conversion:
             chr_, pos_ = chr, pos
             chr, pos = liftover_conversion(chr, pos)
@@ -37,7 +61,7 @@ def bgen_file_geno_lines(file, variant_mapping = None, force_colon = False, use_
 
         if whitelist and not varid in whitelist:
             continue
-        
+
         if variant_mapping:
             if dict_mapping:
                 if not varid in variant_mapping:
@@ -50,27 +74,28 @@ def bgen_file_geno_lines(file, variant_mapping = None, force_colon = False, use_
         # subtlety: even though we replace the variant id,
         # the alleles in the genotype might be swapped respect the variant in the mapping
         # You should verify if you must match it
+        selected.append((index, varid, chr, pos, allele_0, allele_1))
+    return selected
 
-        v = bgen["genotype"][variant.Index].compute()
-        if v["phased"]:
-            d = numpy.apply_along_axis(lambda x: x[1] + x[3], 1, numpy.array(v["probs"], dtype=float))
-        else:
-            d = numpy.apply_along_axis(lambda x: x[1] + x[2] * 2, 1, numpy.array(v["probs"], dtype=float))
-
-        #e = bgen_reader.allele_expectation(bgen, variant.Index)
-        #d2 = bgen_reader.compute_dosage(e, alt=1)
-
-        yield (varid, chr, pos, allele_0, allele_1, numpy.mean(d)/2) + tuple(d)
+def _dosages(bgen, indices):
+    """samples x variants allele_1 dosages"""
+    phased = numpy.array(bgen.phased[indices], dtype=bool)
+    # biallelic variants have at most 4 (phased) probabilities per sample
+    probabilities = bgen.read((slice(None), indices), max_combinations=4 if phased.any() else 3)
+    dosages = probabilities[:,:,1] + probabilities[:,:,2]*2
+    if phased.any():
+        dosages[:,phased] = probabilities[:,phased,1] + probabilities[:,phased,3]
+    return dosages
 
-def bgen_files_geno_lines(files, variant_mapping = None, force_colon = False, use_rsid=False, whitelist=None, skip_palindromic=False, liftover_conversion=None):
+def bgen_files_geno_lines(files, variant_mapping = None, force_colon = False, use_rsid=False, whitelist=None, skip_palindromic=False, liftover_conversion=None, batch_size=None, regions=None):
     logging.log(9, "Processing bgens")
     for file in files:
-        for l in bgen_file_geno_lines(file, variant_mapping=variant_mapping, force_colon=force_colon, use_rsid=use_rsid, whitelist=whitelist, skip_palindromic=skip_palindromic, liftover_conversion=liftover_conversion):
+        for l in bgen_file_geno_lines(file, variant_mapping=variant_mapping, force_colon=force_colon, use_rsid=use_rsid, whitelist=whitelist, skip_palindromic=skip_palindromic, liftover_conversion=liftover_conversion, batch_size=batch_size, regions=regions):
             yield l
 
 def get_samples(path):
     logging.info("Opening bgen to get samples")
-    bgen = bgen_reader.read_bgen(path, verbose=False)
-    samples = bgen["samples"].values
+    with open_bgen(path, allow_complex=True, verbose=False) as bgen:
+        samples = numpy.array(bgen.samples)
     samples = pandas.DataFrame({"FID":samples, "IID":samples})[["FID", "IID"]]
     return samples
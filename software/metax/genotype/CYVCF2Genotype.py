@@ -4,15 +4,20 @@ import logging
 import pandas
 import numpy
 
+from metax import Exceptions
 from metax.misc import Genomics
 
-def vcf_file_geno_lines(path, mode="genotyped", variant_mapping=None, whitelist=None, skip_palindromic=False, liftover_conversion=None):
+def vcf_file_geno_lines(path, mode="genotyped", variant_mapping=None, whitelist=None, skip_palindromic=False, liftover_conversion=None, regions=None):
+    """
+    If `regions` (chromosome, start, end) are given, only records starting in them are read, through the file's tabix/csi index.
+    """
     logging.log(9, "Processing vcf %s", path)
     vcf_reader = VCF(path)
 
     is_dict_mapping = variant_mapping is not None and type(variant_mapping) == dict
 
-    for variant in vcf_reader:
+    records = vcf_reader if regions is None else _records_in_regions(vcf_reader, path, regions)
+    for variant in records:
         chr = variant.CHROM
         pos = variant.POS
         variant_id = variant.ID
@@ -26,6 +31,7 @@ def vcf_file_geno_lines(path, mode="genotyped", variant_mapping=None, whitelist=
                 continue
 
         if mode == "genotyped":
+            alleles = None
             for a,alt in enumerate(alts):
                 if skip_palindromic and Genomics.is_palindromic(ref, alt):
                     continue
@@ -36,12 +42,11 @@ def vcf_file_geno_lines(path, mode="genotyped", variant_mapping=None, whitelist=
                 if whitelist and variant_id not in whitelist:
                     continue
 
-                d = []
-                for sample in variant.genotypes:
-                    d_ = (sample[0] == a+1) + (sample[1] == a+1)
-                    d.append(d_)
-                f = numpy.mean(numpy.array(d,dtype=numpy.int32))/2
-                yield (variant_id, chr, pos, ref, alt, f) + tuple(d)
+                if alleles is None:
+                    alleles = _called_alleles(variant)
+                d = numpy.sum(alleles == a+1, axis=1)
+                f = numpy.mean(d)/2
+                yield (variant_id, chr, pos, ref, alt, f, d)
 
         elif mode == "imputed":
             if len(alts) > 1:
@@ -59,21 +64,48 @@ def vcf_file_geno_lines(path, mode="genotyped", variant_mapping=None, whitelist=
                 continue
             
             try:
-                d = numpy.apply_along_axis(lambda x: x[0], 1, variant.format("DS"))
-                f = numpy.mean(numpy.array(d)) / 2
-                yield (variant_id, chr, pos, ref, alt, f) + tuple(d)
+                d = variant.format("DS")[:,0]
+                f = numpy.mean(d) / 2
+                yield (variant_id, chr, pos, ref, alt, f, numpy.array(d, dtype=numpy.float64))
             except KeyError:
                 yield RuntimeError("Missing DS field when vcf mode is imputed")
         else:
             yield RuntimeError(f"Unsupported vcf mode = {mode}")
 
 
-def vcf_files_geno_lines(files, mode="genotyped", variant_mapping=None, whitelist=None, skip_palindromic=False, liftover_conversion=None):
+def _records_in_regions(vcf_reader, path, regions):
+    seqnames = {x:i for i,x in enumerate(vcf_reader.seqnames)}
+    contigs = {Genomics.contig_name(x):x for x in vcf_reader.seqnames}
+
+    file_regions = [(contigs.get(Genomics.contig_name(chromosome)), start, end) for chromosome, start, end in regions]
+    file_regions = sorted([x for x in file_regions if x[0] is not None], key=lambda x: (seqnames[x[0]], x[1]))
+    logging.log(9, "Reading %d regions", len(file_regions))
+    n = 0
+    for contig, start, end in file_regions:
+        try:
+            for variant in vcf_reader("{}:{}-{}".format(contig, start, end)):
+                # records overlapping a region but starting before it belong to another one
+                if variant.POS < start:
+                    continue
+                n += 1
+                yield variant
+        except AssertionError:
+            raise Exceptions.InvalidInputFormat("Could not load the tabix/csi index of {}, needed to read regions".format(path))
+    if n == 0:
+        logging.warning("No variant of %s falls in the requested regions; check that its chromosome names match the models'", path)
+
+def _called_alleles(variant):
+    """samples x (up to) two allele indexes of the genotype calls; -1 stands for missing, other negative values for absent"""
+    g = variant.genotype.array()
+    # the last column holds phasing
+    return g[:, :min(2, g.shape[1]-1)]
+
+def vcf_files_geno_lines(files, mode="genotyped", variant_mapping=None, whitelist=None, skip_palindromic=False, liftover_conversion=None, regions=None):
     logging.log(9, "Processing vcfs")
     for file in files:
         for l in vcf_file_geno_lines(file, mode=mode, variant_mapping=variant_mapping,
                     whitelist=whitelist, skip_palindromic=skip_palindromic,
-                    liftover_conversion=liftover_conversion):
+                    liftover_conversion=liftover_conversion, regions=regions):
             yield l
 
 def get_samples(path):
@@ -46,7 +46,8 @@ def dosage_file_geno_lines(file, variant_mapping=None, whitelist=None, skip_pali
 
         yield (id, int(chrom), pos, ref_allele, alt_allele, float(comps[DTF.FREQ])) + tuple(dosage)
 
-def dosage_files_geno_lines(dosage_files, variant_mapping=None, whitelist=None, skip_palindromic=False, liftover_conversion=None):
+def sorted_dosage_files(dosage_files):
+    """Dosage files sorted by the chromosome number in their name"""
     chr_ = re.compile(".*chr(\d+).*")
     def sort_geno(x):
         x_ = chr_.search(x)
@@ -56,7 +57,10 @@ def dosage_files_geno_lines(dosage_files, variant_mapping=None, whitelist=None,
             return int(x_)
         else:
             return x
-    dosage_files = sorted(dosage_files, key=sort_geno)
+    return sorted(dosage_files, key=sort_geno)
+
+def dosage_files_geno_lines(dosage_files, variant_mapping=None, whitelist=None, skip_palindromic=False, liftover_conversion=None):
+    dosage_files = sorted_dosage_files(dosage_files)
 
     for f in dosage_files:
         for e in dosage_file_geno_lines(f, variant_mapping=variant_mapping, whitelist=whitelist, skip_palindromic=skip_palindromic, liftover_conversion=liftover_conversion):
@@ -1,6 +1,8 @@
 import numpy
+import pandas
 from numpy import dot as _d
 
+from .. import Exceptions
 from .. import MatrixManager2
 from .. import MatrixManager
 
@@ -96,63 +98,68 @@ def _get_coef(gene, models,  matrix_manager, variances, t1, t2):
 ###############################################################################
 # Like the above but faster and dirtier
 class _GeneExpressionMatrixManager(object):
-    """Like 'GeneExpressionMatrixManager', but relying on faster implementation."""
+    """
+    Like 'GeneExpressionMatrixManager', but relying on faster implementation:
+    each gene's snp covariance is held as a dense array, and the tissues' weights are stacked into a (snp x tissue) matrix W,
+    so that the expression covariance is W'SW.
+    """
     def __init__(self, snp_covariance, model_manager):
-        self.snp_covariance_manager = MatrixManager2.MatrixManager2(snp_covariance, MatrixManager.GENE_SNP_COVARIANCE_DEFINITION)
+        self.snp_covariance = _dense_covariances(snp_covariance, MatrixManager.GENE_SNP_COVARIANCE_DEFINITION)
         self.model_manager = model_manager
 
     def get(self, gene, tissues):
         t = set(tissues)
         models = self.model_manager.get_models(gene)
-        models = {k:v for k,v in models.items() if k in t}
-        tissues = sorted(set(models.keys()))
-        variances = _get_variances_2(models, self.snp_covariance_manager, gene)
-        tissues, matrix = _build_matrix(gene, models, self.snp_covariance_manager, tissues, variances, _get_coef_2)
-        return tissues, matrix
-
-def _get_variances_2(models, matrix_manager, gene):
-    tissues = list(models.keys())
-    variances = {t:_get_variance_2(models, matrix_manager, gene, t) for t in tissues}
-    variances = {k:v for k,v in variances.items() if v is not None}
-    return variances
-
-def _get_variance_2(models, matrix_manager, gene, tissue):
-    model = models[tissue]
-    snps = set(model.keys())
-
-    #Remember that only those snps with data in the GWAS will get loaded.
-    snps, matrix = matrix_manager.get(gene, snps, strict_whitelist=False)
-    if len(snps) == 0:
-        return None
-
-    weights = numpy.array([model[x] for x in snps], dtype=numpy.float64)
-    variance = _d(_d(weights, matrix), weights)
-    variance = numpy.float64(variance)
-    return variance
-
-def _get_coef_2(gene, models,  matrix_manager, variances, t1, t2):
-    model_1 = models[t1]
-    snps_1 = set(model_1.keys())
-    if len(snps_1) == 0:
-        return None
-
-    model_2 = models[t2]
-    snps_2 = set(model_2.keys())
-    if len(snps_2) == 0:
-        return None
-
-    s1, s2, matrix = matrix_manager.get_2(gene, snps_1, snps_2)
-
-    if len(s1) == 0 or len(s2) == 0:
-        return None
-
-    w1 = numpy.array([model_1[x] for x in s1], dtype=numpy.float64)
-    w2 = numpy.array([model_2[x] for x in s2], dtype=numpy.float64)
-
-    denom = numpy.float64(numpy.sqrt(variances[t1] * variances[t2]))
-    if denom == 0:
-        return numpy.nan
-
-    num = numpy.float64(_d(_d(w1, matrix), w2))
-    coef = num/denom
-    return coef
+        tissues = sorted(k for k in models.keys() if k in t)
+        if not gene in self.snp_covariance:
+            return [], None
+        snps, covariance = self.snp_covariance[gene]
+
+        #Remember that only those snps with data in the GWAS will get loaded.
+        weights, n = _weight_matrix(models, tissues, snps)
+        matrix = _d(weights.T, _d(covariance, weights))
+        variances = numpy.diag(matrix)
+
+        # tissues without snps in the covariance, or with null variance, are left out
+        keep = (n > 0) & (variances != 0)
+        tissues = [x for x, k in zip(tissues, keep) if k]
+        matrix = matrix[keep][:, keep]
+        variances = variances[keep]
+        matrix = matrix / numpy.sqrt(numpy.outer(variances, variances))
+        return tissues, numpy.matrix(matrix)
+
+def _dense_covariances(d, definition):
+    """Maps each gene to a (snps, covariance) tuple, with snps sorted and the covariance as a symmetric array"""
+    MODEL_KEY = definition[MatrixManager.K_MODEL]
+    ID1_KEY = definition[MatrixManager.K_ID1]
+    ID2_KEY = definition[MatrixManager.K_ID2]
+    VALUE_KEY = definition[MatrixManager.K_VALUE]
+
+    MatrixManager._validate(d, definition)
+    d = d[~pandas.isnull(d[VALUE_KEY]) & (d[VALUE_KEY] != "NA")]
+    r = {}
+    for gene, g in d.groupby(MODEL_KEY, sort=False):
+        snps = numpy.unique(numpy.concatenate([g[ID1_KEY].values, g[ID2_KEY].values]).astype(str))
+        i = numpy.searchsorted(snps, g[ID1_KEY].values.astype(str))
+        j = numpy.searchsorted(snps, g[ID2_KEY].values.astype(str))
+        covariance = numpy.full((len(snps), len(snps)), numpy.nan)
+        values = pandas.to_numeric(g[VALUE_KEY]).values.astype(numpy.float64)
+        covariance[i, j] = values
+        covariance[j, i] = values
+        if numpy.isnan(covariance).any():
+            raise Exceptions.InvalidInputFormat("Snp covariance for %s does not cover every pair of its snps" % (gene))
+        r[gene] = (list(snps), covariance)
+    return r
+
+def _weight_matrix(models, tissues, snps):
+    """(snp x tissue) weights, zero where a tissue's model lacks the snp; and the number of snps available to each tissue."""
+    index = {x:i for i,x in enumerate(snps)}
+    weights = numpy.zeros((len(snps), len(tissues)), dtype=numpy.float64)
+    n = numpy.zeros(len(tissues), dtype=numpy.int64)
+    for j, tissue in enumerate(tissues):
+        for snp, weight in models[tissue].items():
+            i = index.get(snp)
+            if i is None: continue
+            weights[i, j] = weight
+            n[j] += 1
+    return weights, n
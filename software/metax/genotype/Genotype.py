@@ -1,3 +1,5 @@
+import numpy
+
 from ..misc import GWASAndModels
 
 class GF(object):
@@ -9,6 +11,13 @@ class GF(object):
     FREQUENCY=5
     FIRST_DOSAGE=6
 
+def dosage(line):
+    """Dosages in a genotype line, as a numpy array. Lines hold them either spread from GF.FIRST_DOSAGE on, or as a single numpy array."""
+    d = line[GF.FIRST_DOSAGE:]
+    if len(d) == 1 and isinstance(d[0], numpy.ndarray):
+        return d[0]
+    return numpy.array(d, dtype=float)
+
 def force_mapped_metadata(generator, sep):
     for line in generator:
         varid = line[GF.RSID]
@@ -5,6 +5,7 @@ import gzip
 import scipy.stats as stats
 
 from . import GWASSpecialHandling
+from . import GWASCache
 
 from .. import  Exceptions
 
@@ -81,7 +82,7 @@ def validate_format_for_strict(format):
 
 ########################################################################################################################
 # Load a gwas
-def load_gwas(source, gwas_format, strict=True, separator=None, skip_until_header=False, snps=None, force_special_handling=False, handle_empty_columns=False, input_pvalue_fix=None, keep_non_rsid=False):
+def load_gwas(source, gwas_format, strict=True, separator=None, skip_until_header=False, snps=None, force_special_handling=False, handle_empty_columns=False, input_pvalue_fix=None, keep_non_rsid=False, cache_folder=None):
     """
     Attempts to read a GWAS summary statistics file, and load it into a uniform format,
     in a pandas dataframe.
@@ -89,9 +90,40 @@ def load_gwas(source, gwas_format, strict=True, separator=None, skip_until_heade
     :param source: Either a string with path to file containing GWAS summary statistics, or a generator.
     :param gwas_format: dictionary specifying GWAS format column mapping.
         For example
+    :param cache_folder: if given, and `source` is a file, the parsed input (before snp whitelisting) is saved to,
+        or loaded from, a cache there. See `GWASCache`.
     :return:
     """
-    if force_special_handling or skip_until_header or snps:
+    special_handling = bool(force_special_handling or skip_until_header or snps)
+    if cache_folder and GWASCache.cacheable(source):
+        d = _read_cached_gwas(cache_folder, source, gwas_format, strict, separator, skip_until_header, snps, special_handling, handle_empty_columns, keep_non_rsid)
+    else:
+        if cache_folder:
+            logging.info("GWAS input is not a file, it will not be cached")
+        d = _read_gwas(source, gwas_format, strict, separator, skip_until_header, snps, special_handling, handle_empty_columns, keep_non_rsid)
+
+    logging.info("Processing input gwas")
+    return _finish_gwas(d, strict, input_pvalue_fix)
+
+def _read_cached_gwas(cache_folder, source, gwas_format, strict, separator, skip_until_header, snps, special_handling, handle_empty_columns, keep_non_rsid):
+    key = GWASCache.cache_key(source, gwas_format, strict=strict, separator=separator, skip_until_header=skip_until_header,
+            special_handling=special_handling, handle_empty_columns=handle_empty_columns, keep_non_rsid=keep_non_rsid)
+    path = GWASCache.cache_path(cache_folder, source, key)
+    d = GWASCache.load(path)
+    if d is None:
+        d = _read_gwas(source, gwas_format, False, separator, skip_until_header, None, special_handling, handle_empty_columns, keep_non_rsid)
+        if strict:
+            d = _enforce_numeric_columns(d, lenient=True)
+        GWASCache.save(d, path)
+    if snps:
+        d = d[d[SNP].isin(snps)].reset_index(drop=True)
+    if strict:
+        # columns left as text in the cache fail only on malformed values of the snps kept, as when parsing without cache
+        d = _enforce_numeric_columns(d)
+    return d
+
+def _read_gwas(source, gwas_format, strict, separator, skip_until_header, snps, special_handling, handle_empty_columns, keep_non_rsid):
+    if special_handling:
         logging.info("Reading input gwas with special handling: %s", source)
         snp_column_name = gwas_format[COLUMN_SNP]
         d = GWASSpecialHandling.gwas_data_source(source, snps, snp_column_name, skip_until_header, separator, handle_empty_columns)
@@ -101,8 +133,43 @@ def load_gwas(source, gwas_format, strict=True, separator=None, skip_until_heade
         if separator is None or separator == "ANY_WHITESPACE":
             separator = '\s+'
         d = pandas.read_table(source, sep=separator)
+    return _clean_gwas(d, gwas_format, strict, keep_non_rsid)
 
-    logging.info("Processing input gwas")
+def load_gwas_chunks(source, gwas_format, strict=True, separator=None, skip_until_header=False, snps=None, handle_empty_columns=False, input_pvalue_fix=None, keep_non_rsid=False, chunk_size=GWASSpecialHandling.DEFAULT_CHUNK_SIZE):
+    """
+    Same as `load_gwas`, but yields the result in pieces, from at most `chunk_size` input lines each.
+    Only the columns declared in `gwas_format` are read, so that the memory footprint is bounded regardless of the file size.
+
+    Pvalues too small to be handled are replaced as in `load_gwas`, with the smallest one in the whole file (or `input_pvalue_fix`);
+    the first time a chunk needs it, that pvalue is found with an extra pass over the file's snp and pvalue columns.
+    """
+    logging.info("Reading input gwas in chunks: %s", source)
+    snp_column_name = gwas_format[COLUMN_SNP]
+    columns = set(gwas_format.values())
+    floor = []
+    def pvalue_floor():
+        if not floor:
+            floor.append(_pvalue_floor(source, gwas_format, separator, skip_until_header, snps, handle_empty_columns, keep_non_rsid, chunk_size))
+        return floor[0]
+
+    for i, d in enumerate(GWASSpecialHandling.gwas_data_chunks(source, snps, snp_column_name, skip_until_header, separator, handle_empty_columns, columns, chunk_size)):
+        logging.log(9, "Processing input gwas chunk %d", i)
+        d = _clean_gwas(pandas.DataFrame(d), gwas_format, strict, keep_non_rsid)
+        yield _finish_gwas(d, strict, input_pvalue_fix, pvalue_floor)
+
+def _pvalue_floor(source, gwas_format, separator, skip_until_header, snps, handle_empty_columns, keep_non_rsid, chunk_size):
+    """Smallest usable pvalue in the whole file, or None if there is none"""
+    logging.info("Looking for the smallest gwas pvalue")
+    format = {COLUMN_SNP:gwas_format[COLUMN_SNP], COLUMN_PVALUE:gwas_format[COLUMN_PVALUE]}
+    the_min = None
+    for d in GWASSpecialHandling.gwas_data_chunks(source, snps, format[COLUMN_SNP], skip_until_header, separator, handle_empty_columns, set(format.values()), chunk_size):
+        d = _clean_gwas(pandas.DataFrame(d), format, True, keep_non_rsid)
+        m = _smallest_pvalue(d[PVALUE].values) if d.shape[0] else None
+        if m is not None and (the_min is None or m < the_min):
+            the_min = m
+    return the_min
+
+def _clean_gwas(d, gwas_format, strict, keep_non_rsid):
     d = _rename_columns(d, gwas_format)
 
     if not SNP in d:
@@ -116,7 +183,11 @@ def load_gwas(source, gwas_format, strict=True, separator=None, skip_until_heade
 
     if strict:
         d = _enforce_numeric_columns(d)
-        d = _ensure_columns(d, input_pvalue_fix)
+    return d
+
+def _finish_gwas(d, strict, input_pvalue_fix, pvalue_floor=None):
+    if strict:
+        d = _ensure_columns(d, input_pvalue_fix, pvalue_floor)
         d = _keep_gwas_columns(d)
         if d.shape[0] >0 and numpy.any(~ numpy.isfinite(d[ZSCORE])):
             logging.warning("Some GWAS snp zscores are not finite.")
@@ -153,15 +224,15 @@ def _rename_columns(d, gwas_format):
 
     return d
 
-def _ensure_columns(d, input_pvalue_fix):
+def _ensure_columns(d, input_pvalue_fix, pvalue_floor=None):
     if d.shape[0] == 0:
         if OR in d: d[BETA] = None
         if BETA_SIGN in d: d[BETA_SIGN] = None
         d[ZSCORE] = None
         return d
 
-    d[EFFECT_ALLELE] = d[EFFECT_ALLELE].str.upper()
-    d[NON_EFFECT_ALLELE] = d[NON_EFFECT_ALLELE].str.upper()
+    d[EFFECT_ALLELE] = _upper(d[EFFECT_ALLELE])
+    d[NON_EFFECT_ALLELE] = _upper(d[NON_EFFECT_ALLELE])
 
     if OR in d:
         logging.log(9, "Calculating beta from odds ratio")
@@ -173,23 +244,35 @@ def _ensure_columns(d, input_pvalue_fix):
         b = b.apply(lambda x: 1.0 if x == "+" else -1.0)
         d[BETA_SIGN] = b
 
-    _ensure_z(d, input_pvalue_fix)
+    _ensure_z(d, input_pvalue_fix, pvalue_floor)
 
     d[ZSCORE] = numpy.array(d[ZSCORE], dtype=numpy.float32)
     return d
 
+def _upper(alleles):
+    # Same as alleles.str.upper(), once for each distinct allele
+    codes, uniques = pandas.factorize(alleles)
+    upper = pandas.Series(uniques, dtype=object).str.upper().values
+    return pandas.Series(numpy.append(upper, numpy.nan)[codes], index=alleles.index)
+
 _numeric_columns = [BETA, OR, SE, PVALUE, ZSCORE]
-def _enforce_numeric_columns(d):
+def _enforce_numeric_columns(d, lenient=False):
+    """If `lenient`, columns with values that can't be converted are left as they are, instead of raising an error"""
     for column in _numeric_columns:
         if column in d:
             a = d[column]
             if a.dtype == object:
                 a = [str(x) for x in a]
                 a = [GWASSpecialHandling.sanitize_component(x) for x in a]
-            d[column] = numpy.array(a, dtype=numpy.float64)
+            try:
+                d[column] = numpy.array(a, dtype=numpy.float64)
+            except ValueError:
+                if not lenient:
+                    raise
+                logging.log(9, "GWAS column %s holds non numeric values, left as text", column)
     return d
 
-def _ensure_z(d, input_pvalue_fix):
+def _ensure_z(d, input_pvalue_fix, pvalue_floor=None):
     if ZSCORE in d:
         logging.log(9, "Using declared zscore")
         return d
@@ -198,7 +281,7 @@ def _ensure_z(d, input_pvalue_fix):
 
     if PVALUE in d:
         logging.log(9, "Calculating zscore from pvalue")
-        z = _z_from_p(d, input_pvalue_fix)
+        z = _z_from_p(d, input_pvalue_fix, pvalue_floor)
     elif SE in d and BETA in d:
         logging.info("Calculating zscore from se and beta")
         z = d[BETA] / d[SE]
@@ -207,7 +290,8 @@ def _ensure_z(d, input_pvalue_fix):
     d[ZSCORE] = z
     return d
 
-def _z_from_p(d, input_pvalue_fix):
+def _z_from_p(d, input_pvalue_fix, pvalue_floor=None):
+    """`pvalue_floor`, if given, provides the smallest usable pvalue when it must be looked for beyond `d`"""
     p = d[PVALUE].values
     if numpy.any(p == 0):
         logging.warning("Encountered GWAS pvalues equal to zero. This might be caused by numerical resolution. Please consider using another scheme such as -beta- and -se- columns, or checking your input gwas for zeros.")
@@ -217,8 +301,8 @@ def _z_from_p(d, input_pvalue_fix):
 
     if numpy.any(numpy.isinf(abs_z)) and input_pvalue_fix:
         logging.warning("Applying thresholding to divergent zscores. You can disable this behavior by using '--input_pvalue_fix 0' in the command line")
-        the_min = numpy.min(p[numpy.logical_and(numpy.isfinite(abs_z),p != 0)])
-        if input_pvalue_fix < the_min:
+        the_min = pvalue_floor() if pvalue_floor else _smallest_pvalue(p)
+        if the_min is None or input_pvalue_fix < the_min:
             the_min = input_pvalue_fix
         fix_z = -stats.norm.ppf(the_min / 2)
         logging.warning("Using %f to fill in divergent zscores", fix_z)
@@ -227,6 +311,11 @@ def _z_from_p(d, input_pvalue_fix):
     z = abs_z * s
     return z
 
+def _smallest_pvalue(p):
+    abs_z = -stats.norm.ppf(p / 2)
+    usable = numpy.logical_and(numpy.isfinite(abs_z), p != 0)
+    return numpy.min(p[usable]) if numpy.any(usable) else None
+
 def _beta_sign(d):
     b = None
     if BETA in d:
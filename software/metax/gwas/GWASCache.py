@@ -0,0 +1,89 @@
+"""
+On-disk cache of parsed GWAS files.
+
+The cache holds a GWAS as it is right after parsing and numeric conversion, before any model dependent step
+(snp whitelisting, allele case, zscore derivation). Columns with values that are not numbers are kept as text,
+so that they only raise errors if the whitelisted snps hold them. Entries are stored as uncompressed numpy `.npz` files,
+one array per column, named after a hash of the source file's contents, the gwas format and the parsing options;
+any change in them results in a different entry.
+"""
+import hashlib
+import json
+import logging
+import os
+
+import numpy
+import pandas
+
+VERSION = 1
+_MANIFEST = "__manifest__"
+
+def cacheable(source):
+    """Only files are cached; generators and streams are not"""
+    return isinstance(source, str) and os.path.isfile(source)
+
+def file_hash(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_key(path, gwas_format, **options):
+    description = {"version": VERSION, "source": file_hash(path), "format": gwas_format, "options": options}
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+def cache_path(folder, path, key):
+    return os.path.join(folder, "{}.{}.npz".format(os.path.basename(path), key))
+
+def load(path):
+    """Returns the cached dataframe, or None if there is no (readable) entry at `path`"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with numpy.load(path, allow_pickle=False) as f:
+            manifest = json.loads(str(f[_MANIFEST]))
+            d = {}
+            for i, (column, kind) in enumerate(manifest["columns"]):
+                d[column] = _from_array(f["c{}".format(i)], f["m{}".format(i)] if kind == "str" else None)
+    except Exception as e:
+        logging.warning("Could not read cached gwas %s, will parse the input instead: %s", path, str(e))
+        return None
+    logging.info("Loaded cached gwas %s", path)
+    return pandas.DataFrame(d, columns=[x[0] for x in manifest["columns"]])
+
+def save(d, path):
+    """Writes `d` to `path`, through a temporary file so that concurrent readers never see partial entries"""
+    folder = os.path.split(path)[0]
+    if len(folder) and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    arrays, columns = {}, []
+    for i, column in enumerate(d.columns):
+        a = d[column].values
+        if a.dtype.kind in "biuf":
+            arrays["c{}".format(i)] = a
+            columns.append((column, "numeric"))
+        else:
+            missing = pandas.isnull(a)
+            arrays["c{}".format(i)] = numpy.array([str(x) for x in numpy.where(missing, "", a)], dtype=str)
+            arrays["m{}".format(i)] = missing
+            columns.append((column, "str"))
+    arrays[_MANIFEST] = numpy.array(json.dumps({"version": VERSION, "columns": columns}))
+
+    temporary = os.path.join(folder, ".{}.{}".format(os.getpid(), os.path.basename(path)))
+    try:
+        with open(temporary, "wb") as f:
+            numpy.savez(f, **arrays)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    logging.info("Saved gwas to cache %s", path)
+
+def _from_array(a, missing):
+    if missing is None:
+        return a
+    a = a.astype(object)
+    a[missing] = numpy.nan
+    return a
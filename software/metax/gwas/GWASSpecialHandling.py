@@ -1,78 +1,240 @@
+import csv
 import gzip
 import logging
 import re
 import io
+import itertools
 import numpy
 import pandas
 
 from .. import Exceptions
 
-def gwas_data_source(path, snps=None, snp_column_name=None, skip_until_header=None, separator=None, handle_empty_columns=False):
-    s = {}
+DEFAULT_CHUNK_SIZE = 1000000
+# Lines split at once; small enough to keep temporary per-line lists cheap.
+BLOCK_SIZE = 10000
+
+def _open(path):
     def _ogz(p):
         return io.TextIOWrapper(gzip.open(p, "r"), newline="")
     _o = _ogz if ".gz" in path else open
-    with _o(path) as file:
-        header = None
-        if skip_until_header:
-            for line in file:
-                if skip_until_header in line:
-                    header = skip_until_header
-                    c = line.split(skip_until_header)
-                    if len(c) > 1: header += c[1]
-                    break
-            if header is None: raise Exceptions.ReportableException("Did not find specified header")
+    return _o(path)
+
+def _read_header(file, skip_until_header, separator, snp_column_name):
+    header = None
+    if skip_until_header:
+        for line in file:
+            if skip_until_header in line:
+                header = skip_until_header
+                c = line.split(skip_until_header)
+                if len(c) > 1: header += c[1]
+                break
+        if header is None: raise Exceptions.ReportableException("Did not find specified header")
+    else:
+        header = file.readline()
+
+    header_comps = header.strip().split(separator)
+    if snp_column_name:
+        if not snp_column_name in header_comps: raise Exceptions.ReportableException("Did not find snp colum name")
+
+    header_count = {k:header_comps.count(k) for k in header_comps}
+    if len(header_count) < len(header_comps):
+        duplicated = [k for k,v in header_count.items() if v>1]
+        logging.info("The input GWAS has duplicated columns: %s, will only use the first one in each case", str(duplicated))
+    return header_comps
+
+def _column_positions(header_comps, columns):
+    # Load only the first column if in presence of duplicated columns. Yuck!
+    positions = {}
+    for i,c in enumerate(header_comps):
+        if c in positions: continue
+        if columns is not None and not c in columns: continue
+        positions[c] = i
+    return positions
+
+def _splitters(separator, handle_empty_columns):
+    """Functions splitting a block of lines into components; the second one lazily splits at most the given number of times"""
+    if handle_empty_columns:
+        split_r = re.compile(separator) if separator is not None else re.compile("\s")
+        return (lambda block: [split_r.split(l.replace("\n", "")) for l in block],
+                lambda block, n: (split_r.split(l.replace("\n", ""), n) for l in block))
+    if separator is None:
+        # splitting on whitespace already ignores it at both ends
+        return (lambda block: [l.split() for l in block],
+                lambda block, n: map(str.split, block, itertools.repeat(None), itertools.repeat(n)))
+    return (lambda block: [l.strip().split(separator) for l in block],
+            lambda block, n: (l.strip().split(separator, n) for l in block))
+
+def _whitelisted(block, split_head, snps, snp_index):
+    """Indexes of the lines whose snp component is in the whitelist, looking at that component alone"""
+    if snp_index >= 0:
+        return [i for i,h in enumerate(split_head(block, snp_index+1)) if len(h) > snp_index and h[snp_index] in snps]
+    return [i for i,l in enumerate(block) if l.strip() and l.split()[snp_index] in snps]
+
+def _log_bad_lines(numbers):
+    #Yeah, there are those kinds of files
+    for i in numbers:
+        logging.log(8, "Found line with less components than headers, line %i", i)
+
+def _read_columns(lines, header_comps, positions, snps, snp_index, separator, handle_empty_columns, offset=0):
+    """
+    Reads lines into a dictionary of the columns at `positions`, converted to numbers where possible.
+    Lines are read BLOCK_SIZE at a time. They are checked against the snp whitelist from their snp component alone,
+    before being split entirely.
+    Returns the columns and the number of lines read.
+    """
+    if separator is None and not handle_empty_columns:
+        return _read_whitespace_columns(lines, header_comps, positions, snps, snp_index, offset)
+
+    split, split_head = _splitters(separator, handle_empty_columns)
+    n = len(header_comps)
+    pieces = {c:[] for c in positions}
+    read = 0
+    lines = iter(lines)
+    while True:
+        block = list(itertools.islice(lines, BLOCK_SIZE))
+        if not block:
+            break
+        numbers = numpy.arange(offset+read, offset+read+len(block))
+        read += len(block)
+
+        if snps and snp_index >= 0:
+            keep = _whitelisted(block, split_head, snps, snp_index)
+            block, numbers = [block[i] for i in keep], numbers[keep]
+
+        rows = split(block)
+        bad = numpy.fromiter(map(len, rows), dtype=numpy.int64, count=len(rows)) != n
+        if numpy.any(bad):
+            _log_bad_lines(numbers[bad])
+            rows = [rows[i] for i in numpy.nonzero(~bad)[0]]
+
+        if snps and snp_index < 0:
+            rows = [r for r in rows if r[snp_index] in snps]
+
+        if not rows:
+            continue
+
+        # transpose the whole block at once, instead of appending field by field
+        columns = list(zip(*rows))
+        for c,j in positions.items():
+            pieces[c].append(columns[j])
+
+    s = {c:list(itertools.chain.from_iterable(v)) for c,v in pieces.items()}
+    return _to_numeric(s), read
+
+# str.split() whitespace, among ascii characters; only space, tab and line ends are known to the C parser
+_WHITESPACE = numpy.zeros(256, dtype=bool)
+_WHITESPACE[list(b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f")] = True
+_SPECIAL_WHITESPACE = numpy.zeros(256, dtype=bool)
+_SPECIAL_WHITESPACE[list(b"\x0b\x0c\x1c\x1d\x1e\x1f")] = True
+
+def _count_fields(block, text):
+    """Number of whitespace separated fields in each line, as python's `str.split()` would find them,
+    or None if `text` (the joined block) holds whitespace the C parser would not split on. Requires ascii text."""
+    b = numpy.frombuffer(text.encode("ascii"), dtype=numpy.uint8)
+    if _SPECIAL_WHITESPACE[b].any():
+        return None
+    ws = _WHITESPACE[b]
+    # a field starts at a non whitespace character preceded by whitespace, or at the start of its line
+    starts = ~ws
+    starts[1:] &= ws[:-1]
+    lengths = numpy.fromiter(map(len, block), dtype=numpy.int64, count=len(block))
+    line_starts = numpy.cumsum(lengths) - lengths
+    starts[line_starts] = ~ws[line_starts]
+    return numpy.add.reduceat(starts, line_starts, dtype=numpy.int64) if len(b) else numpy.zeros(len(block), dtype=numpy.int64)
+
+def _read_whitespace_columns(lines, header_comps, positions, snps, snp_index, offset):
+    """
+    Whitespace separated input (the default) is validated here in bulk, and the surviving lines are then parsed
+    with pandas' C parser all at once. Its type inference matches `pandas.to_numeric` on each column.
+    """
+    split, split_head = _splitters(None, False)
+    n = len(header_comps)
+    kept = []
+    read = 0
+    lines = iter(lines)
+    while True:
+        block = list(itertools.islice(lines, BLOCK_SIZE))
+        if not block:
+            break
+        numbers = numpy.arange(offset+read, offset+read+len(block))
+        read += len(block)
+
+        if snps:
+            keep = _whitelisted(block, split_head, snps, snp_index)
+            block, numbers = [block[i] for i in keep], numbers[keep]
+        if not block:
+            continue
+
+        text = "".join(block)
+        counts = _count_fields(block, text) if text.isascii() else None
+        if counts is not None:
+            bad = counts != n
+            if numpy.any(bad):
+                _log_bad_lines(numbers[bad])
+                block = [block[i] for i in numpy.nonzero(~bad)[0]]
+            # the last line in the file might lack its line end
+            kept.extend(block if not block or block[-1].endswith(("\n", "\r")) else block[:-1] + [block[-1] + "\n"])
         else:
-            header = file.readline()
-
-        header_comps = header.strip().split(separator)
-        s = {c:[] for c in header_comps}
-        index = -1
-        if snp_column_name:
-            if not snp_column_name in header_comps: raise Exceptions.ReportableException("Did not find snp colum name")
-            index = header_comps.index(snp_column_name)
-
-        header_count = {k:header_comps.count(k) for k in header_comps}
-        if len(header_count) < len(header_comps):
-            duplicated = [k for k,v in header_count.items() if v>1]
-            logging.info("The input GWAS has duplicated columns: %s, will only use the first one in each case", str(duplicated))
-
-        if handle_empty_columns:
-            split_r = re.compile(separator) if separator is not None else re.compile("\s")
-
-        for i,line in enumerate(file):
-            if handle_empty_columns:
-                line = line.replace("\n", "")
-                comps = split_r.split(line)
-            else:
-                comps = line.strip().split(separator)
-
-            #Yeah, there are those kinds of files
-            if not len(comps) == len(header_comps):
-                logging.log(8, "Found line with less components than headers, line %i", i)
-                continue
-
-            if snps and not comps[index] in snps:
-                continue
-
-            # Load only the first column if in presence of duplicated columns. Yuck!
-            sentinel=set()
-            for i,c in enumerate(comps):
-                comp = header_comps[i]
-                if comp in sentinel: continue
-                sentinel.add(comp)
-                s[comp].append(c)
-
-        for c in header_comps:
-            try:
-                s[c] = numpy.array(pandas.to_numeric(s[c], errors='raise'))
-            except Exception as e:
-                # logging.error("Error converting array to_numeric: ", e)
-                s[c] = s[c] # This is the behavior "ignore" was doing
+            # whitespace the C parser does not know about; normalize it
+            rows = split(block)
+            bad = numpy.fromiter(map(len, rows), dtype=numpy.int64, count=len(rows)) != n
+            _log_bad_lines(numbers[bad])
+            kept.extend(" ".join(r) + "\n" for r,b in zip(rows, bad) if not b)
 
+    if not kept:
+        return _to_numeric({c:[] for c in positions}), read
 
+    usecols = sorted(positions.values())
+    d = pandas.read_csv(io.StringIO("".join(kept)), header=None, names=list(range(n)), usecols=usecols, delim_whitespace=True,
+            quoting=csv.QUOTE_NONE, na_filter=False, index_col=False, low_memory=False)
+    s = {}
+    for c,j in positions.items():
+        a = d[j].values
+        if a.dtype == bool:
+            # the C parser reads booleans; pandas.to_numeric does not
+            a = pandas.read_csv(io.StringIO("".join(kept)), header=None, names=list(range(n)), usecols=[j], delim_whitespace=True,
+                    quoting=csv.QUOTE_NONE, na_filter=False, index_col=False, dtype=str)[j].values
+        if a.dtype == object:
+            s.update(_to_numeric({c:a.tolist()}))
+        else:
+            s[c] = a
+    return s, read
+
+def _to_numeric(s):
+    for c in s:
+        try:
+            s[c] = numpy.array(pandas.to_numeric(s[c], errors='raise'))
+        except Exception as e:
+            # logging.error("Error converting array to_numeric: ", e)
+            s[c] = s[c] # This is the behavior "ignore" was doing
     return s
 
+def gwas_data_source(path, snps=None, snp_column_name=None, skip_until_header=None, separator=None, handle_empty_columns=False):
+    with _open(path) as file:
+        header_comps = _read_header(file, skip_until_header, separator, snp_column_name)
+        snp_index = header_comps.index(snp_column_name) if snp_column_name else -1
+        positions = _column_positions(header_comps, None)
+        s, read = _read_columns(file, header_comps, positions, snps, snp_index, separator, handle_empty_columns)
+    return s
+
+def gwas_data_chunks(path, snps=None, snp_column_name=None, skip_until_header=None, separator=None, handle_empty_columns=False, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Same as `gwas_data_source`, but yields the data in pieces, read from at most `chunk_size` lines at a time,
+    so that memory use does not depend on the size of the file.
+    Only the `columns` (if given) found in the header are loaded. Type conversion happens within each piece.
+    """
+    with _open(path) as file:
+        header_comps = _read_header(file, skip_until_header, separator, snp_column_name)
+        snp_index = header_comps.index(snp_column_name) if snp_column_name else -1
+        positions = _column_positions(header_comps, columns)
+        offset = 0
+        while True:
+            s, read = _read_columns(itertools.islice(file, chunk_size), header_comps, positions, snps, snp_index, separator, handle_empty_columns, offset)
+            if not read:
+                break
+            yield s
+            offset += read
+
 non_en_number = re.compile("^[-\+]?[0-9]*,{1}[0-9]+([eE]{1}[-\+]?[0-9]+)?$")
 def sanitize_component(c):
     if non_en_number.match(c): c = c.replace(",",".")
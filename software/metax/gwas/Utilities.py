@@ -38,8 +38,14 @@ def add_gwas_arguments_to_parser(parser):
 
     parser.add_argument("--snp_map_file", help="table specifying conversion between a particular set of snps and those in the models' reference")
 
+    parser.add_argument("--match_strand", help="Also keep GWAS variants whose alleles match the models' on the opposite strand (complemented). "
+                        "Ambiguous (palindromic) variants are only matched on the same strand.", action="store_true", default=False)
+
     parser.add_argument("--split_column", help="Present for future compatibility.", nargs="+")
 
+    parser.add_argument("--gwas_cache_folder", help="Optional folder where the parsed input GWAS is cached, so that later runs on the same file "
+                        "(with the same format and parsing options) skip the parsing. Entries are keyed by the file contents.")
+
 def add_gwas_format_json_to_parser(parser):
     parser.add_argument("--input_gwas_format_json",
                         help="File containing a json description of the gwas.")
@@ -100,6 +106,12 @@ def gwas_from_data(data, extra_columns=None):
             g[k] = numpy.array(d[i])
     return g
 
+def gwas_cache_folder(args):
+    return args.gwas_cache_folder if hasattr(args, "gwas_cache_folder") else None
+
+def match_strand(args):
+    return args.match_strand if hasattr(args, "match_strand") else False
+
 def load_plain_gwas_from_args(args):
     regexp = re.compile(args.gwas_file_pattern) if args.gwas_file_pattern else  None
     gwas_format = gwas_format_from_args(args)
@@ -108,7 +120,7 @@ def load_plain_gwas_from_args(args):
 
     _l = lambda x: GWAS.load_gwas(x, gwas_format, skip_until_header=args.skip_until_header,
             separator=args.separator, handle_empty_columns=args.handle_empty_columns, input_pvalue_fix=args.input_pvalue_fix,
-            keep_non_rsid=args.keep_non_rsid)
+            keep_non_rsid=args.keep_non_rsid, cache_folder=gwas_cache_folder(args))
     if args.gwas_folder:
         names = BUtilities.contentsWithRegexpFromFolder(args.gwas_folder, regexp)
         names.sort()  # cosmetic, because different filesystems/OS yield folders in different order
@@ -50,6 +50,7 @@ class Context(object):
     def get_model_snps(self): pass
     def get_data_intersection(self): pass
     def provide_calculation(self, gene): pass
+    def provide_calculation_blocks(self, genes): pass
     def get_model_info(self): pass
 
 def association(gene, context, return_snps=False):
@@ -93,6 +94,134 @@ def association(gene, context, return_snps=False):
     else:
         return r
 
+class AssociationBlocks(object):
+    """
+    Several genes' association input, packed as ragged blocks:
+    snp-level data for gene i lives in [snp_offsets[i], snp_offsets[i+1]) of the flat arrays,
+    and its (row-major) covariance in [covariance_offsets[i], covariance_offsets[i+1]) of the flat covariance.
+    """
+    def __init__(self, genes, n_snps_in_model, n_snps_in_cov, snps, snp_offsets, weight, zscore, beta, covariance, covariance_offsets):
+        self.genes = genes
+        self.n_snps_in_model = n_snps_in_model
+        self.n_snps_in_cov = n_snps_in_cov
+        self.snps = snps
+        self.snp_offsets = snp_offsets
+        self.weight = weight
+        self.zscore = zscore
+        self.beta = beta
+        self.covariance = covariance
+        self.covariance_offsets = covariance_offsets
+
+class _BlocksBuilder(object):
+    def __init__(self):
+        self.genes, self.n_snps_in_model, self.n_snps_in_cov, self.snps = [], [], [], []
+        self.sizes, self.weight, self.zscore, self.beta, self.covariance = [], [], [], [], []
+
+    def append(self, gene, n_snps_in_model, n_snps_in_cov, snps, weight, zscore, beta, covariance):
+        self.genes.append(gene)
+        self.n_snps_in_model.append(n_snps_in_model)
+        self.n_snps_in_cov.append(n_snps_in_cov)
+        self.sizes.append(len(snps))
+        if not len(snps):
+            return
+        self.snps.extend(snps)
+        self.weight.extend(weight)
+        self.zscore.extend(zscore)
+        self.beta.extend(beta)
+        self.covariance.append(numpy.asarray(covariance, dtype=numpy.float64).ravel())
+
+    def build(self):
+        sizes = numpy.array(self.sizes, dtype=numpy.int64)
+        snp_offsets = numpy.zeros(len(sizes)+1, dtype=numpy.int64)
+        numpy.cumsum(sizes, out=snp_offsets[1:])
+        covariance_offsets = numpy.zeros(len(sizes)+1, dtype=numpy.int64)
+        numpy.cumsum(sizes**2, out=covariance_offsets[1:])
+        covariance = numpy.concatenate(self.covariance) if len(self.covariance) else numpy.array([], dtype=numpy.float64)
+        return AssociationBlocks(self.genes,
+            numpy.array(self.n_snps_in_model), numpy.array(self.n_snps_in_cov, dtype=numpy.float64),
+            self.snps, snp_offsets,
+            numpy.array(self.weight, dtype=numpy.float64), numpy.array(self.zscore, dtype=numpy.float64), numpy.array(self.beta, dtype=numpy.float64),
+            covariance, covariance_offsets)
+
+def blocks_from_calculations(genes, context):
+    """Packs association input for genes by going through the context's per-gene `provide_calculation`."""
+    builder = _BlocksBuilder()
+    for gene in genes:
+        n_snps_in_model, i, cov, snps = context.provide_calculation(gene)
+        n_snps_in_cov = context.get_n_in_covariance(gene)
+        builder.append(gene, n_snps_in_model, n_snps_in_cov, list(i[Constants.SNP]),
+            i[WDBQF.K_WEIGHT], i[Constants.ZSCORE], _beta_or_nan(i[Constants.BETA]), cov)
+    return builder.build()
+
+def _beta_or_nan(beta):
+    return [numpy.nan if x is None else x for x in beta]
+
+def association_batch(blocks):
+    """
+    Same as `association`, but computed at once for every gene packed in `blocks` (see `Context.provide_calculation_blocks`).
+    Returns a list of result tuples, in the same order as the packed genes.
+    """
+    if logging.getLogger().getEffectiveLevel() < 10:
+        _log_singular_blocks(blocks)
+    zscore, effect_size, sigma_g_2, n_snps_used = _block_association(blocks)
+    return list(zip(blocks.genes, zscore, effect_size, sigma_g_2, blocks.n_snps_in_model, blocks.n_snps_in_cov, n_snps_used))
+
+def _block_association(blocks):
+    n_genes = len(blocks.genes)
+    snp_offsets, covariance_offsets = blocks.snp_offsets, blocks.covariance_offsets
+    sizes = numpy.diff(snp_offsets)
+    w = blocks.weight
+
+    # Map every flat snp and covariance entry back to its gene, and every covariance entry to its (row, column) snps
+    gene_of_snp = numpy.repeat(numpy.arange(n_genes), sizes)
+    local_snp = numpy.arange(len(w)) - snp_offsets[gene_of_snp]
+    gene_of_entry = numpy.repeat(numpy.arange(n_genes), sizes**2)
+    local_entry = numpy.arange(len(blocks.covariance)) - covariance_offsets[gene_of_entry]
+    entry_size = sizes[gene_of_entry]
+    row = snp_offsets[gene_of_entry] + local_entry // entry_size
+    column = snp_offsets[gene_of_entry] + local_entry % entry_size
+
+    # sigma_g_2 = w' C w, as sum_i w_i (C w)_i
+    cw = numpy.bincount(row, weights=blocks.covariance*w[column], minlength=len(w))
+    # (bincount yields integers when there are no snps at all)
+    sigma_g_2 = numpy.bincount(gene_of_snp, weights=w*cw, minlength=n_genes).astype(numpy.float64)
+
+    variances = blocks.covariance[covariance_offsets[gene_of_snp] + local_snp*sizes[gene_of_snp] + local_snp]
+    sigma_l = numpy.sqrt(variances)
+    z_num = numpy.bincount(gene_of_snp, weights=w * blocks.zscore * sigma_l, minlength=n_genes)
+    e_num = numpy.bincount(gene_of_snp, weights=w * blocks.beta * (sigma_l**2), minlength=n_genes)
+
+    used = sizes > 0
+    sigma_g_2[~used] = numpy.nan
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        ok = sigma_g_2 > 0
+        zscore = numpy.where(ok, z_num / numpy.sqrt(numpy.where(ok, sigma_g_2, 1)), numpy.nan)
+        effect_size = numpy.where(ok, e_num / numpy.where(ok, sigma_g_2, 1), numpy.nan)
+    return zscore, effect_size, sigma_g_2, sizes
+
+def _log_singular_blocks(blocks):
+    sizes = numpy.diff(blocks.snp_offsets)
+    for i, gene in enumerate(blocks.genes):
+        if sizes[i] == 0:
+            continue
+        cov = blocks.covariance[blocks.covariance_offsets[i]:blocks.covariance_offsets[i+1]].reshape(sizes[i], sizes[i])
+        d_ = numpy.linalg.eig(cov)[0]
+        if numpy.sum(numpy.less(d_,1e-6)):
+            logging.info("Gene %s has covariance close to singular", gene)
+
+def additional_stats_batch(blocks):
+    """Same as `additional_stats` for every gene in the packed blocks"""
+    sizes = numpy.diff(blocks.snp_offsets)
+    used = sizes > 0
+    starts = blocks.snp_offsets[:-1][used]
+    p = numpy.full(len(blocks.genes), numpy.nan)
+    best_weight = numpy.full(len(blocks.genes), numpy.nan)
+    if len(starts):
+        best_zscore = numpy.maximum.reduceat(numpy.abs(blocks.zscore), starts)
+        p[used] = 2 * stats.norm.cdf(-best_zscore)
+        best_weight[used] = numpy.maximum.reduceat(numpy.abs(blocks.weight), starts)
+    return list(zip(blocks.genes, p, best_weight))
+
 def dataframe_from_results(results):
     results = list(zip(*results))
     if len(results) == 0:
@@ -10,18 +10,23 @@ from .. import Utilities
 
 
 class MetaXcanResultsManager(object):
+    """
+    Holds the results as a (gene x model) zscore matrix, with models sorted and NaN where there is no (finite) zscore.
+    """
     def __init__(self, data):
-        data, genes, models = _build_data(data)
-        self.data = data
-        self.genes = genes
-        self.models = models
+        genes, models, zscores = _build_data(data)
+        self.gene_index = {x:i for i,x in enumerate(genes)}
+        self.genes = set(genes)
+        self.models = set(models)
+        self.labels = models
+        self.zscores = zscores
+        self.finite = numpy.isfinite(zscores)
 
     def results_for_gene(self, gene):
-        if not gene in self.data: return None, None
-        results = self.data[gene]
-        labels = sorted(results.keys())
-        values = [results[k] for k in labels]
-        return values, labels
+        i = self.gene_index.get(gene)
+        if i is None: return None, None
+        mask = self.finite[i]
+        return list(self.zscores[i][mask]), list(self.labels[mask])
 
     def get_genes(self):
         return self.genes
@@ -52,7 +57,7 @@ def _load_results(files, file_name_pattern):
     results = {}
     for file in sorted(files):
         logging.log(9, "Loading metaxcan %s", file)
-        e = pandas.read_csv(file)
+        e = pandas.read_csv(file, usecols=["gene", "zscore"])
         root, name = os.path.split(file)
         pheno, model = _parse_name(name, file_name_pattern)
         e["pheno"] = pheno
@@ -62,21 +67,19 @@ def _load_results(files, file_name_pattern):
 
 def _build_data(data):
     logging.log(9,"Building data")
-    genes = set()
-    models = set()
-    result = {}
-    for k, df in data.items():
-        logging.log(9, "Processing %s", k)
-        for i, row in df.iterrows():
-            if not numpy.isfinite(row.zscore):
-                continue
-            if not row.gene in result:
-                result[row.gene]={}
-            gene_entries = result[row.gene]
-            gene_entries[row.tissue] = row.zscore
-            genes.add(row.gene)
-            models.add(row.tissue)
-    return result, genes, models
+    d = [df[["gene", "tissue", "zscore"]] for k, df in data.items()]
+    d = pandas.concat(d, ignore_index=True) if len(d) else pandas.DataFrame({"gene":[], "tissue":[], "zscore":[]})
+    zscore = numpy.asarray(d.zscore.values, dtype=numpy.float64)
+    d = d.assign(zscore=zscore)[numpy.isfinite(zscore)]
+    # as with successive assignment, the last entry for a (gene, model) wins
+    d = d.drop_duplicates(["gene", "tissue"], keep="last")
+
+    gene_codes, genes = pandas.factorize(d.gene.values)
+    models = numpy.array(sorted(set(d.tissue.values)), dtype=object)
+    model_codes = numpy.searchsorted(models, d.tissue.values)
+    zscores = numpy.full((len(genes), len(models)), numpy.nan)
+    zscores[gene_codes, model_codes] = d.zscore.values
+    return list(genes), models, zscores
 
 def _get_columns(data):
     logging.info("Getting columns")
@@ -7,6 +7,7 @@ from scipy import stats
 from .. import Constants
 from .. import Utilities
 from .. import MatrixManager
+from .. import BinaryMatrixManager
 from ..PredictionModel import WDBQF, WDBEQF, load_model, dataframe_from_weight_data
 from ..misc import DataFrameStreamer
 from . import AssociationCalculation
@@ -62,6 +63,9 @@ class SimpleContext(AssociationCalculation.Context):
             i = pandas.DataFrame(columns=d_columns)
         return len(w.weight), i, cov, snps
 
+    def provide_calculation_blocks(self, genes):
+        return AssociationCalculation.blocks_from_calculations(genes, self)
+
     def get_model_info(self):
         return self.model.extra
 
@@ -139,6 +143,19 @@ class OptimizedContext(SimpleContext):
 
         return self.data_cache
 
+    def provide_calculation_blocks(self, genes):
+        builder = AssociationCalculation._BlocksBuilder()
+        for gene in genes:
+            w = self._get_weights(gene)
+            gwas = self._get_gwas(list(w.keys()))
+            snps, cov = self.get_covariance(gene, [x for x in w if x in gwas])
+            n_snps_in_cov = self.get_n_in_covariance(gene)
+            if snps is None:
+                snps = []
+            builder.append(gene, len(w), n_snps_in_cov, snps,
+                [w[x] for x in snps], [gwas[x][0] for x in snps], [gwas[x][1] for x in snps], cov)
+        return builder.build()
+
     def get_model_info(self):
         return self.extra
 
@@ -254,6 +271,9 @@ def build_context(args, gwas):
         if not args.stream_covariance:
             logging.info("Loading covariance data from: %s", args.covariance)
             covariance_manager = MatrixManager.load_matrix_manager(args.covariance)
+        elif BinaryMatrixManager.is_binary_matrix(args.covariance):
+            logging.info("Using memory-mapped covariance from: %s", args.covariance)
+            covariance_manager = BinaryMatrixManager.load_binary_matrix_manager(args.covariance, memory_map=True)
         else:
             logging.info("Using streamed covariance from: %s", args.covariance)
             logging.warning("This version is more lenient with input covariances, as many potential errors can't be checked for the whole input covariance in advance. Pay extra care to your covariances!")
@@ -2,6 +2,8 @@ import gzip
 import io
 import pandas
 import logging
+import queue
+import threading
 from .. import Utilities
 
 def data_frame_streamer(path, sentinel_column, sentinel_white_list=None, sentinel_suffix=None, additional_skip_row_check=None):
@@ -52,6 +54,34 @@ def data_frame_streamer(path, sentinel_column, sentinel_white_list=None, sentine
             yield data
 
 
+def prefetched(iterable, size=4):
+    """
+    Iterates over `iterable` from a background thread, keeping up to `size` upcoming items ready in a bounded queue,
+    so that producing them (i.e. parsing a stream) overlaps with consuming them. Exceptions are raised to the consumer.
+    Abandoning the iteration early leaves the producer blocked on a full queue, in a daemon thread.
+    """
+    q = queue.Queue(size)
+    _end = object()
+
+    def _produce():
+        try:
+            for x in iterable:
+                q.put((x, None))
+        except BaseException as e:
+            q.put((_end, e))
+            return
+        q.put((_end, None))
+
+    thread = threading.Thread(target=_produce, daemon=True)
+    thread.start()
+    while True:
+        x, e = q.get()
+        if x is _end:
+            if e is not None:
+                raise e
+            return
+        yield x
+
 def _check_sentinel(sentinel_white_list, sentinel_suffix):
     if not sentinel_white_list:
         return
@@ -1,5 +1,6 @@
 import logging
 import string
+import numpy
 import pandas
 
 from .. import Constants
@@ -9,28 +10,56 @@ from ..gwas import Utilities as GWASUtilities
 EA, NEA = Constants.EFFECT_ALLELE, Constants.NON_EFFECT_ALLELE
 EA_BASE, NEA_BASE = EA + "_BASE", NEA + "_BASE"
 
-def align_data_to_alleles(data, base, left_on, right_on):
+def align_data_to_alleles(data, base, left_on, right_on, match_strand=False):
+    """
+    Joins `data` to `base` and keeps the rows whose pair of alleles matches base's, in either order.
+    Rows with missing alleles are dropped.
+    Effect sizes of rows with swapped alleles are flipped, and their alleles replaced by base's.
+    With `match_strand`, rows whose alleles match base's complement (on the opposite strand) are also kept,
+    with the same precedence as `match_alleles`: alleles on the same strand first, and ambiguous or
+    multi-letter alleles matched on the opposite strand only without swapping.
+    """
     merged = pandas.merge(data, base, left_on=left_on, right_on=right_on, suffixes=("", "_BASE"))
-
-    alleles_1 = pandas.Series([set(e) for e in zip(merged[EA], merged[NEA])])
-    alleles_2 = pandas.Series([set(e) for e in zip(merged[EA_BASE], merged[NEA_BASE])])
-    eq = alleles_1 == alleles_2
-    merged = merged[eq]
-    if eq.shape[0] == 0:
+    if merged.shape[0] == 0:
         return merged
 
-    flipped = merged[EA] != merged[EA_BASE]
-    Z = Constants.ZSCORE
-    if Z in merged:
-        merged.loc[flipped, Z] = - merged.loc[flipped, Z]
-    B = Constants.BETA
-    if B in merged:
-        merged.loc[flipped, B] = - merged.loc[flipped, B]
+    ea, nea = merged[EA].values, merged[NEA].values
+    ea_base, nea_base = merged[EA_BASE].values, merged[NEA_BASE].values
+    # missing alleles match nothing; NaN never compares equal, but None does, to None.
+    valid = pandas.notnull(ea) & pandas.notnull(nea)
+    same = valid & (ea == ea_base) & (nea == nea_base)
+    flipped = valid & ~same & (ea == nea_base) & (nea == ea_base)
+    if match_strand:
+        t_ea_base, t_nea_base = _complement(ea_base), _complement(nea_base)
+        single = (_per_allele(ea, len, 0, numpy.int64) == 1) & (_per_allele(nea, len, 0, numpy.int64) == 1)
+        unmatched = valid & ~(same | flipped)
+        strand = unmatched & (ea == t_ea_base) & (nea == t_nea_base)
+        strand_flipped = unmatched & ~strand & single & (ea == t_nea_base) & (nea == t_ea_base)
+        flipped |= strand_flipped
+        keep = same | flipped | strand
+    else:
+        keep = same | flipped
+
+    merged = merged[keep]
+    flipped, replaced = flipped[keep], ~same[keep]
+
+    columns = {c:_negated(merged[c].values, flipped) for c in [Constants.ZSCORE, Constants.BETA] if c in merged}
+    columns[EA] = numpy.where(replaced, merged[EA_BASE].values, merged[EA].values)
+    columns[NEA] = numpy.where(replaced, merged[NEA_BASE].values, merged[NEA].values)
+    return merged.assign(**columns)
+
+def _per_allele(alleles, f, missing, dtype):
+    # evaluate once for each distinct allele; missing alleles get code -1, i.e. the last entry
+    codes, uniques = pandas.factorize(alleles)
+    return numpy.array([f(x) if type(x) == str else missing for x in uniques] + [missing], dtype=dtype)[codes]
 
-    merged.loc[flipped, EA] = merged.loc[flipped, EA_BASE]
-    merged.loc[flipped, NEA] = merged.loc[flipped, NEA_BASE]
+def _complement(alleles):
+    return _per_allele(alleles, lambda x: x.translate(complement_translation), None, object)
 
-    return merged
+def _negated(v, flipped):
+    v = v.copy()
+    v[flipped] = -v[flipped]
+    return v
 
 def gwas_model_intersection(args):
     gwas= GWASUtilities.load_plain_gwas_from_args(args)
@@ -41,7 +70,7 @@ def gwas_model_intersection(args):
         logging.log(9, "loading %s", db_path)
         model = PredictionModel.load_model(db_path, args.model_db_snp_key)
         base = model.weights[[PF.K_RSID, PF.K_EFFECT_ALLELE, PF.K_NON_EFFECT_ALLELE]].drop_duplicates()
-        b = align_data_to_alleles(gwas, base, Constants.SNP, PF.K_RSID)
+        b = align_data_to_alleles(gwas, base, Constants.SNP, PF.K_RSID, GWASUtilities.match_strand(args))
         intersection.update(b[Constants.SNP])
     return intersection
 
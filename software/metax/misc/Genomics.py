@@ -1,6 +1,9 @@
+import re
 import pyliftover
 import logging
 
+import numpy
+
 BASEPAIR = {
     "A": "T",
     "C": "G", 
@@ -116,3 +119,61 @@ def maybe_map_variant(varid, chr, pos, ref, alt, variant_mapping, is_dict_mappin
         else:
             varid = variant_mapping(chr, pos, ref, alt)
     return _varid, varid
+
+# chromosome and position at the start of ids such as chr1_12345_A_G_b38 or 1:12345:A:G
+COORDINATE_ID = re.compile(r"^(?:chr)?([0-9A-Za-z]+)[_:](\d+)(?:[_:]|$)")
+
+def coordinates_from_ids(ids):
+    """(chromosome, position) for each variant id that carries them; chromosomes are stripped of a -chr- prefix"""
+    coordinates = []
+    for id in ids:
+        m = COORDINATE_ID.match(id) if id else None
+        if m:
+            coordinates.append((m.group(1), int(m.group(2))))
+    return coordinates
+
+def regions(coordinates, gap=10000):
+    """
+    Sorted (chromosome, start, end) regions covering the coordinates; positions up to `gap` apart share a region.
+    Chromosomes are named after `contig_name`.
+    """
+    by_chromosome = {}
+    for chromosome, position in coordinates:
+        by_chromosome.setdefault(contig_name(chromosome), []).append(position)
+
+    r = []
+    for chromosome in sorted(by_chromosome):
+        positions = numpy.unique(by_chromosome[chromosome])
+        breaks = numpy.where(numpy.diff(positions) > gap)[0]
+        starts = positions[numpy.concatenate([[0], breaks+1])]
+        ends = positions[numpy.concatenate([breaks, [len(positions)-1]])]
+        r.extend((chromosome, int(start), int(end)) for start, end in zip(starts, ends))
+    return r
+
+def contig_name(chromosome):
+    """Chromosome name without -chr- prefix or leading zeros, so that e.g. chr1, 1 and 01 (or chrM, M and MT) match"""
+    c = str(chromosome)
+    if c[:3].lower() == "chr":
+        c = c[3:]
+    if c.isdigit():
+        c = c.lstrip("0") or "0"
+    c = c.upper()
+    return "MT" if c == "M" else c
+
+def in_regions(chromosomes, positions, regions):
+    """Boolean mask of the variants whose position falls in a region; chromosome names are compared through `contig_name`"""
+    names, chromosomes = numpy.unique(numpy.asarray(chromosomes, dtype=str), return_inverse=True)
+    names = numpy.array([contig_name(x) for x in names], dtype=object)
+    chromosomes = names[chromosomes]
+    positions = numpy.asarray(positions)
+    mask = numpy.zeros(len(positions), dtype=bool)
+    by_chromosome = {}
+    for chromosome, start, end in regions:
+        by_chromosome.setdefault(contig_name(chromosome), []).append((start, end))
+    for chromosome, r in by_chromosome.items():
+        starts, ends = (numpy.array(x) for x in zip(*sorted(r)))
+        selected = numpy.where(chromosomes == chromosome)[0]
+        i = numpy.searchsorted(starts, positions[selected], side="right") - 1
+        inside = (i >= 0) & (positions[selected] <= ends[numpy.maximum(i, 0)])
+        mask[selected[inside]] = True
+    return mask
@@ -58,6 +58,39 @@ def _inv(a, cf, rcond, epsilon):
     res = dot(transpose(vt), multiply(s[:, newaxis], transpose(u)))
     return wrap(res), n_indep, eigen
 
+def capinv_eigh(w, rcond=1e-15, epsilon=None):
+    """
+    Like `capinv`, for a symmetric matrix given its eigenvalues `w` (as from `w, v = numpy.linalg.eigh(a)`),
+    so that the matrix needs not be factorized again.
+    Returns the pseudo inverse in factored form, as `d` such that the inverse is v.diag(d).v' (`d` in the order of `w`);
+    the number of kept components, and the singular values (absolute eigenvalues) in decreasing order.
+    `w` can also be a stack of eigenvalues, one row per matrix, with `rcond` a scalar or one value per matrix;
+    results are then stacked likewise.
+    """
+    w = numpy.asarray(w, dtype=numpy.float64)
+    if w.size == 0:
+        raise RuntimeError("Arrays cannot be empty")
+    single = w.ndim == 1
+    w = numpy.atleast_2d(w)
+    if epsilon is not None:
+        w = w + epsilon
+
+    # For a symmetric matrix, the singular values are the absolute eigenvalues
+    s = numpy.abs(w)
+    eigen = -numpy.sort(-s, axis=1)
+    cutoff = numpy.reshape(_ac(eigen, rcond), (-1, 1))
+    keep = s >= cutoff
+    # The first Singular Value will always be selected because we want at least one, and the first is the highest
+    keep[numpy.arange(w.shape[0]), numpy.argmax(s, axis=1)] = True
+
+    d = numpy.zeros(w.shape, dtype=numpy.float64)
+    with numpy.errstate(divide="ignore"):
+        d[keep] = 1. / w[keep]
+    n_indep = numpy.count_nonzero(d, axis=1)
+    if single:
+        return d[0], int(n_indep[0]), eigen[0]
+    return d, n_indep, eigen
+
 def standardize(x):
     mean = numpy.mean(x)
     #follow R's convention, ddof=1
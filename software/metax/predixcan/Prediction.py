@@ -0,0 +1,92 @@
+"""
+Block-wise expression prediction.
+
+Model weights are held as a sparse genes x variants matrix; dosages are buffered into a variants x samples block,
+and each full block updates every gene's prediction with a single sparse-dense product.
+"""
+import logging
+
+import numpy
+import pandas
+from scipy import sparse
+
+from ..PredictionModel import WDBQF
+
+class WeightMatrix(object):
+    """
+    Model weights as a sparse genes x variants matrix, in compressed column layout.
+    Genes and variants are numbered in order of first appearance in the weights.
+    """
+    def __init__(self, weights):
+        # A variant with two weights for a gene keeps the last one, as the per variant model dictionary does
+        weights = weights.drop_duplicates([WDBQF.K_RSID, WDBQF.K_GENE], keep="last")
+        variant_codes, variants = pandas.factorize(weights[WDBQF.K_RSID].values)
+        gene_codes, genes = pandas.factorize(weights[WDBQF.K_GENE].values)
+
+        self.genes = genes
+        self.variants = {x:i for i,x in enumerate(variants)}
+
+        # weights are sorted by variant, keeping model order within each variant
+        order = numpy.argsort(variant_codes, kind="stable")
+        counts = numpy.bincount(variant_codes, minlength=len(variants))
+        self.indptr = numpy.concatenate([[0], numpy.cumsum(counts)])
+        self.indices = gene_codes[order]
+        self.data = numpy.array(weights[WDBQF.K_WEIGHT].values, dtype=numpy.float64)[order]
+        # position of each weight among its variant's; it tells the order in which genes are first updated
+        self.rank = numpy.arange(len(order)) - numpy.repeat(self.indptr[:-1], counts)
+        self.max_rank = int(counts.max()) if len(counts) else 0
+
+    def column(self, variant):
+        return self.variants.get(variant)
+
+    def block(self, columns):
+        """
+        Weights of the given columns, restricted to the genes that have any.
+        Returns the genes, a sparse genes x columns matrix and the number of columns with weights for each gene.
+        Genes are sorted in the order that a column by column pass would reach them.
+        """
+        columns = numpy.array(columns, dtype=numpy.int64)
+        starts = self.indptr[columns]
+        lengths = self.indptr[columns+1] - starts
+        indptr = numpy.concatenate([[0], numpy.cumsum(lengths)])
+        positions = numpy.arange(indptr[-1]) + numpy.repeat(starts - indptr[:-1], lengths)
+
+        genes, rows = numpy.unique(self.indices[positions], return_inverse=True)
+        first = numpy.full(len(genes), numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+        key = numpy.repeat(numpy.arange(len(columns)), lengths) * (self.max_rank + 1) + self.rank[positions]
+        numpy.minimum.at(first, rows, key)
+        order = numpy.argsort(first, kind="stable")
+        remap = numpy.empty(len(order), dtype=numpy.int64)
+        remap[order] = numpy.arange(len(order))
+        rows = remap[rows]
+
+        w = sparse.csc_matrix((self.data[positions], rows, indptr), shape=(len(genes), len(columns)))
+        counts = numpy.bincount(rows, minlength=len(genes))
+        return self.genes[genes[order]], w, counts
+
+class PredictionEngine(object):
+    """
+    Accumulates dosages of model variants and updates a prediction repository one block at a time.
+    For each block, the repository gets the genes with weights in it (in the order that a variant by variant
+    update would have reached them), their predicted expression contribution and the number of variants used.
+    """
+    def __init__(self, weight_matrix, results, n_samples, block_size=1000):
+        self.weight_matrix = weight_matrix
+        self.results = results
+        self.block = numpy.empty((block_size, n_samples), dtype=numpy.float64)
+        self.columns = []
+
+    def update(self, variant, dosage):
+        self.block[len(self.columns), :] = dosage
+        self.columns.append(self.weight_matrix.column(variant))
+        if len(self.columns) == self.block.shape[0]:
+            self.flush()
+
+    def flush(self):
+        n = len(self.columns)
+        if not n:
+            return
+        logging.log(8, "Predicting from a block of %d variants", n)
+        genes, w, counts = self.weight_matrix.block(self.columns)
+        self.results.update_block(genes, w.dot(self.block[:n]), counts)
+        self.columns = []
@@ -2,7 +2,10 @@ import logging
 import pandas
 import numpy
 
+from collections import OrderedDict
+
 from patsy import dmatrices
+from scipy.linalg.blas import daxpy
 import statsmodels.api as sm
 
 from .MultiPrediXcanAssociation import Context as _MTPContext, MTPMode
@@ -23,6 +26,9 @@ except:
 
 from .. import Exceptions
 
+# Upper bound for the predictions held in memory before writing to HDF5, in bytes
+PREDICTION_BUFFER_SIZE = 1 << 30
+
 ########################################################################################################################
 class MTPContext(_MTPContext):
     def __init__(self, args, expression):
@@ -243,6 +249,7 @@ def _get_residual(pheno, covariates):
 
 class PredictionRepository:
     def update(self, gene, dosage, weight): raise Exceptions.NotImplemented("gene_repository is not implemented")
+    def update_block(self, genes, prediction, counts): raise Exceptions.NotImplemented("gene_repository is not implemented")
     def store_prediction(self): raise Exceptions.NotImplemented("gene_repository is not implemented")
     def summary(self): raise Exceptions.NotImplemented("gene_repository is not implemented")
 
@@ -253,20 +260,54 @@ class PredictionRepository:
         pass
 
 class BasicPredictionRepository(PredictionRepository):
+    """
+    Predictions are accumulated in place, in a genes x samples float64 matrix preallocated from `extra`'s genes.
+    `genes` maps each gene, in the order they are first updated, to its row of the matrix.
+    Without `extra`, or for genes missing from it, each gene gets its own row array.
+    """
     def __init__(self, samples, extra, output_path):
         self.genes = {}
         self.samples = samples
         self.stats = {}
         self.extra = extra
         self.output_path = output_path
+        self.genes_index = {x:i for i,x in enumerate(extra.gene)} if extra is not None else None
+        self.prediction = None
+
+    def _row(self, gene, n_samples):
+        row = self.genes.get(gene)
+        if row is None:
+            if self.genes_index is None or not gene in self.genes_index:
+                row = numpy.zeros(n_samples)
+            else:
+                if self.prediction is None:
+                    n_samples = self.samples.shape[0] if self.samples is not None else n_samples
+                    # untouched rows are never written, so they don't take up physical memory
+                    self.prediction = numpy.zeros((len(self.genes_index), n_samples))
+                row = self.prediction[self.genes_index[gene]]
+            self.genes[gene] = row
+        return row
 
     def update(self, gene, dosage, weight):
-        if not gene in self.genes:
+        if not gene in self.stats:
             self.stats[gene] = [1, ]
-            self.genes[gene] = weight * dosage
         else:
             self.stats[gene][0] += 1
-            self.genes[gene] += weight * dosage
+        row = self._row(gene, len(dosage))
+        if dosage.dtype == numpy.float64:
+            # fused, in place row += weight*dosage
+            daxpy(dosage, row, a=weight)
+        else:
+            row += weight * dosage
+
+    def update_block(self, genes, prediction, counts):
+        for gene, p, n in zip(genes, prediction, counts):
+            if not gene in self.stats:
+                self.stats[gene] = [int(n), ]
+            else:
+                self.stats[gene][0] += int(n)
+            row = self._row(gene, len(p))
+            numpy.add(row, p, out=row)
 
     def store_prediction(self):
         logging.info("Saving prediction as a text file")
@@ -284,16 +325,27 @@ class BasicPredictionRepository(PredictionRepository):
         pass
 
 class HDF5PredictionRepository(PredictionRepository):
-    def __init__(self, samples, extra, path):
+    """
+    Predictions are accumulated in memory as float64 blocks of `chunk_genes` rows, matching the HDF5 chunks,
+    and each block is written at once. At most `buffer_size` bytes are held in memory;
+    beyond that, the least recently updated block is flushed and read back when updated again.
+    """
+    def __init__(self, samples, extra, path, chunk_genes=None, buffer_size=None):
         self.path = path
         self.samples = samples
         self.extra = extra
+        self.chunk_genes = chunk_genes if chunk_genes else 10
+        self.buffer_size = buffer_size if buffer_size else PREDICTION_BUFFER_SIZE
         self.genes_index = None
         self.h5 = None
         self.d_genes = None
         self.d_prediction = None
         self.d_computed = None
         self.d_samples = None
+        self.blocks = None
+        self.flushed = None
+        self.computed = None
+        self.max_blocks = None
         self.stats = {}
         self.closed = True
 
@@ -303,11 +355,15 @@ class HDF5PredictionRepository(PredictionRepository):
 
         n_genes = self.extra.shape[0]
         n_samples = self.samples.shape[0]
-        n_genes_chunk = numpy.min((n_genes, 10))
+        self.chunk_genes = int(numpy.max((1, numpy.min((n_genes, self.chunk_genes)))))
 
         logging.log(9, "Creating prediction dataset")
-        self.d_prediction = self.h5.create_dataset("pred_expr", shape=(n_genes, n_samples), chunks=(n_genes_chunk, n_samples), dtype=numpy.dtype('float32'), scaleoffset=4, compression='gzip')
+        self.d_prediction = self.h5.create_dataset("pred_expr", shape=(n_genes, n_samples), chunks=(self.chunk_genes, n_samples), dtype=numpy.dtype('float32'), scaleoffset=4, compression='gzip')
         self.d_computed = self.h5.create_dataset("computed", (n_genes,), dtype=int)
+        self.computed = numpy.zeros(n_genes, dtype=int)
+        self.blocks = OrderedDict()
+        self.flushed = set()
+        self.max_blocks = int(numpy.max((1, self.buffer_size // (self.chunk_genes * n_samples * 8))))
 
         logging.log(9, "Creating genes")
         try:
@@ -329,24 +385,63 @@ class HDF5PredictionRepository(PredictionRepository):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        logging.log(9, "closing HDF5 prediction repository")
-        self.h5.file.close()
-        self.closed = True
+        self._close()
         return self
 
     def store_prediction(self):
+        self._close()
+
+    def _close(self):
         if not self.closed:
             logging.log(9, "closing HDF5 prediction repository")
+            self._flush()
             self.h5.file.close()
+            self.closed = True
+
+    def _flush(self):
+        while len(self.blocks):
+            self._write(*self.blocks.popitem(last=False))
+        self.d_computed[:] = self.computed
+
+    def _write(self, block, data):
+        start = block * self.chunk_genes
+        self.d_prediction[start:start+data.shape[0], :] = data
+        self.flushed.add(block)
+
+    def _row(self, gene):
+        """In-memory prediction row for the gene"""
+        index = self.genes_index[gene]
+        block, row = divmod(index, self.chunk_genes)
+        if block in self.blocks:
+            self.blocks.move_to_end(block)
+        else:
+            if len(self.blocks) >= self.max_blocks:
+                self._write(*self.blocks.popitem(last=False))
+            start = block * self.chunk_genes
+            end = numpy.min((start + self.chunk_genes, self.d_prediction.shape[0]))
+            if block in self.flushed:
+                self.blocks[block] = self.d_prediction[start:end, :].astype(numpy.float64)
+            else:
+                self.blocks[block] = numpy.zeros((end - start, self.d_prediction.shape[1]))
+        self.computed[index] = 1
+        return self.blocks[block][row]
 
     def update(self, gene, dosage, weight):
         if not gene in self.stats:
             self.stats[gene] = [1, ]
-            self.d_prediction[self.genes_index[gene], :] = weight * dosage
-            self.d_computed[self.genes_index[gene]] = 1
         else:
             self.stats[gene][0] += 1
-            self.d_prediction[self.genes_index[gene], :] += weight * dosage
+        row = self._row(gene)
+        row += weight * dosage
+
+    def update_block(self, genes, prediction, counts):
+        for gene, p, n in zip(genes, prediction, counts):
+            if not gene in self.stats:
+                self.stats[gene] = [int(n), ]
+            else:
+                self.stats[gene][0] += int(n)
+            row = self._row(gene)
+            row += p
 
     def summary(self):
         return summary_report(self.stats, self.extra)
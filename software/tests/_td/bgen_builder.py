@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Writes small BGEN (v1.2, layout 2, zlib compressed, 8 bit probabilities) files for testing.
+Run from this folder to regenerate genotype/example.bgen
+"""
+import struct
+import zlib
+
+import numpy
+
+def _string(s, length_format="<H"):
+    s = s.encode()
+    return struct.pack(length_format, len(s)) + s
+
+def _probabilities(variant, n_samples):
+    probabilities = numpy.asarray(variant["probabilities"], dtype=numpy.uint8)
+    missing = numpy.asarray(variant.get("missing", numpy.zeros(n_samples, dtype=bool)))
+    k = len(variant["alleles"])
+    ploidy = (missing.astype(numpy.uint8) << 7) | 2
+    probabilities[missing] = 0
+    d = struct.pack("<IHBB", n_samples, k, 2, 2) + ploidy.tobytes() + struct.pack("<BB", int(variant["phased"]), 8)
+    return d + probabilities.tobytes()
+
+def write_bgen(path, samples, variants):
+    """
+    `variants` holds dictionaries with id, rsid, chrom, pos, alleles, phased, missing (optional) and probabilities:
+    per sample, the stored (i.e. all but the last) probabilities of each genotype or haplotype, times 255
+    """
+    n_samples = len(samples)
+    # zlib compression, layout 2, sample identifiers present
+    flags = 1 | (2 << 2) | (1 << 31)
+    header = struct.pack("<III4sI", 20, len(variants), n_samples, b"bgen", flags)
+    sample_block = b"".join(_string(x) for x in samples)
+    sample_block = struct.pack("<II", 8 + len(sample_block), n_samples) + sample_block
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<I", len(header) + len(sample_block)))
+        f.write(header)
+        f.write(sample_block)
+        for v in variants:
+            f.write(_string(v["id"]) + _string(v["rsid"]) + _string(v["chrom"]) + struct.pack("<I", v["pos"]))
+            f.write(struct.pack("<H", len(v["alleles"])) + b"".join(_string(x, "<I") for x in v["alleles"]))
+            d = _probabilities(v, n_samples)
+            c = zlib.compress(d)
+            f.write(struct.pack("<II", len(c) + 4, len(d)) + c)
+
+def _unphased(rng, n, k=2):
+    combinations = k*(k+1)//2
+    p = rng.dirichlet(numpy.ones(combinations), n)
+    return numpy.floor(p[:, :-1] * 255)
+
+def _phased(rng, n):
+    return numpy.floor(rng.uniform(0, 1, (n, 2)) * 256).clip(0, 255)
+
+if __name__ == "__main__":
+    rng = numpy.random.RandomState(0)
+    n = 8
+    samples = ["s{}".format(i) for i in range(n)]
+    missing = numpy.zeros(n, dtype=bool)
+    missing[3] = True
+    variants = [
+        {"id": "1_10_A_G", "rsid": "rs1", "chrom": "1", "pos": 10, "alleles": ["A", "G"], "phased": False, "probabilities": _unphased(rng, n)},
+        {"id": "1_20_C_T", "rsid": "rs2", "chrom": "1", "pos": 20, "alleles": ["C", "T"], "phased": True, "probabilities": _phased(rng, n)},
+        {"id": "1_30_A_C_G", "rsid": "rs3", "chrom": "1", "pos": 30, "alleles": ["A", "C", "G"], "phased": False, "probabilities": _unphased(rng, n, 3)},
+        {"id": "1_40_C_G", "rsid": "rs4", "chrom": "1", "pos": 40, "alleles": ["C", "G"], "phased": False, "probabilities": _unphased(rng, n)},
+        {"id": "1_50_G_A", "rsid": "rs5", "chrom": "1", "pos": 50, "alleles": ["G", "A"], "phased": False, "probabilities": _unphased(rng, n), "missing": missing},
+        {"id": "1_60_T_C", "rsid": "rs6", "chrom": "1", "pos": 60, "alleles": ["T", "C"], "phased": True, "probabilities": _phased(rng, n)},
+    ]
+    write_bgen("genotype/example.bgen", samples, variants)
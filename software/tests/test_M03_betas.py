@@ -17,6 +17,7 @@ from metax.Constants import ZSCORE
 from metax import Exceptions
 
 from M03_betas import run
+from M03_betas import load_gwas
 from . import scz2_sample
 
 class DummyArgs(object):
@@ -48,6 +49,7 @@ class DummyArgs(object):
         self.keep_non_rsid = None
         self.output = None
         self.snp_map_file = None
+        self.chunk_size = None
 
 def base_args(folder="tests/_td/GWAS/scz2", file=None):
     args = DummyArgs()
@@ -197,6 +199,23 @@ class TestM03(unittest.TestCase):
 
         assert_model_beta_pb(self, r)
 
+    def test_shared_gwas(self):
+        args = base_args("tests/_td/GWAS/scz2b")
+        args.gwas_file_pattern = ".*gz"
+        args.pvalue_column = "P"
+        args.or_column = "OR"
+        gwas = load_gwas(args)
+        shared = gwas.copy()
+
+        for db in ["tests/_td/dbs/test_3.db", "tests/_td/dbs/test_2.db"]:
+            args.model_db_path = db
+            pandas.testing.assert_frame_equal(run(args, gwas).reset_index(drop=True), run(args).reset_index(drop=True), check_dtype=False)
+
+        args.model_db_path = "tests/_td/dbs/test_3.db"
+        assert_model_beta_pb(self, run(args, gwas))
+        # the shared gwas is left untouched
+        pandas.testing.assert_frame_equal(gwas, shared)
+
     def test_run_to_file(self):
         op = ".kk_test"
         if os.path.exists(op): shutil.rmtree(op)
@@ -213,6 +232,27 @@ class TestM03(unittest.TestCase):
         assert_beta_pb(self, r)
         shutil.rmtree(op)
 
+    def test_run_chunks(self):
+        op = ".kk_test"
+        if os.path.exists(op): shutil.rmtree(op)
+        args = base_args("tests/_td/GWAS/scz2b")
+        args.gwas_file_pattern = ".*gz"
+        args.pvalue_column = "P"
+        args.or_column = "OR"
+        args.model_db_path = "tests/_td/dbs/test_3.db"
+        expected = run(args)
+
+        args.chunk_size = 2
+        r = run(args)
+        assert_model_beta_pb(self, r)
+
+        args.output_folder = op
+        run(args)
+        r = pandas.concat([pandas.read_table(os.path.join(op, n)) for n in sorted(os.listdir(op))])
+        assert_model_beta_pb(self, r)
+        numpy.testing.assert_allclose(r[ZSCORE], expected[ZSCORE], rtol=1e-6)
+        shutil.rmtree(op)
+
     def test_run_to_files(self):
         op = ".kk_test"
         if os.path.exists(op): shutil.rmtree(op)
@@ -242,6 +282,39 @@ class TestM03(unittest.TestCase):
         r = run(args)
         assert_beta_pb_fix(self, r)
 
+    def test_match_strand(self):
+        op = ".kk_test"
+        if os.path.exists(op): shutil.rmtree(op)
+        os.makedirs(op)
+        args = base_args()
+        args.pvalue_column = "P"
+        args.or_column = "OR"
+        args.model_db_path = "tests/_td/dbs/test_3.db"
+        plain = run(args)
+        args.match_strand = True
+        expected = run(args).set_index(SNP)
+        # rs12082473 is reported on the opposite strand
+        self.assertEqual(sorted(expected.index), sorted(list(plain[SNP]) + ["rs12082473"]))
+
+        # the same gwas, with every variant on the opposite strand
+        complement = {"A":"T", "T":"A", "C":"G", "G":"C"}
+        d = pandas.read_table("tests/_td/GWAS/scz2/scz2.gwas.results.txt.gz")
+        d = d.assign(A1=d.A1.map(complement), A2=d.A2.map(complement))
+        d.to_csv(os.path.join(op, "scz2.txt.gz"), sep="\t", index=False)
+        args.gwas_folder = op
+
+        args.match_strand = False
+        r = run(args)
+        # the palindromic rs940550 can't be told apart, and is (wrongly) kept flipped
+        self.assertEqual(list(r[SNP]), ["rs940550", "rs12082473"])
+
+        args.match_strand = True
+        r = run(args).set_index(SNP)
+        self.assertEqual(sorted(r.index), sorted(expected.index))
+        k = [x for x in expected.index if x != "rs940550"]
+        numpy.testing.assert_allclose(r.loc[k, ZSCORE], expected.loc[k, ZSCORE], rtol=1e-6)
+        shutil.rmtree(op)
+
     def test_align(self):
         pass
 
@@ -0,0 +1,32 @@
+import unittest
+import numpy.testing
+import pandas
+
+from M04_zscores import run_metaxcan
+
+from .test_association_calculation import _context
+
+class DummyArgs(object):
+    def __init__(self, parallelism=None, association_batch_size=None):
+        self.MAX_R = None
+        self.additional_output = True
+        self.association_batch_size = association_batch_size
+        self.parallelism = parallelism
+        self.gwas_h2 = None
+        self.gwas_N = None
+        self.output_file = None
+        self.remove_ens_version = False
+
+class TestM04(unittest.TestCase):
+    def test_parallel(self):
+        context = _context()
+        expected = run_metaxcan(DummyArgs(), context)
+        for args in [DummyArgs(parallelism=2), DummyArgs(parallelism=3, association_batch_size=2)]:
+            results = run_metaxcan(args, context)
+            self.assertEqual(list(results.columns), list(expected.columns))
+            self.assertEqual(list(results.gene), list(expected.gene))
+            for c in ["zscore", "effect_size", "pvalue", "var_g", "n_snps_used", "n_snps_in_cov", "n_snps_in_model"]:
+                numpy.testing.assert_allclose(pandas.to_numeric(results[c], errors="coerce"), pandas.to_numeric(expected[c], errors="coerce"))
+
+if __name__ == '__main__':
+    unittest.main()
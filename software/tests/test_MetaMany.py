@@ -0,0 +1,115 @@
+import argparse
+import os
+import shutil
+import unittest
+
+import pandas
+
+from metax import Exceptions
+from metax import PredictionModel
+from metax import BinaryMatrixManager
+import MetaMany
+from MetaMany import schedule
+
+OP = ".kk_metamany"
+
+def _run(jobs, budget, n, finish):
+    """Drives the scheduler, finishing jobs with `finish` (running labels -> labels to finish); returns the started batches"""
+    started = []
+    running = []
+    scheduler = schedule(jobs, budget, n)
+    start = next(scheduler)
+    while True:
+        started.append([x[0] for x in start])
+        running.extend(x[0] for x in start)
+        finished = finish(running)
+        running = [x for x in running if not x in finished]
+        try:
+            start = scheduler.send(finished)
+        except StopIteration:
+            break
+    return started
+
+def _first(running):
+    return running[:1]
+
+class TestMetaMany(unittest.TestCase):
+    def test_schedule(self):
+        jobs = [("a", 5), ("b", 5), ("c", 5), ("d", 5)]
+        self.assertEqual(_run(jobs, None, 2, _first), [["a", "b"], ["c"], ["d"], []])
+        self.assertEqual(_run(jobs, None, 1, _first), [["a"], ["b"], ["c"], ["d"]])
+        self.assertEqual(_run(jobs, 10, 4, _first), [["a", "b"], ["c"], ["d"], []])
+        self.assertEqual(_run(jobs, 10, 4, lambda x: list(x)), [["a", "b"], ["c", "d"]])
+
+        # over budget jobs run alone; smaller ones can go ahead of pending bigger ones
+        jobs = [("a", 20), ("b", 5), ("c", 8), ("d", 1)]
+        self.assertEqual(_run(jobs, 10, 4, _first), [["a"], ["b", "d"], ["c"], []])
+
+    def test_estimate_footprint(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+        try:
+            args = argparse.Namespace(tissue_footprint=None, model_db_path="tests/_td/dbs/test_1.db", model_db_snp_key=None,
+                single_snp_model=False, covariance="tests/_td/cov/cov.txt.gz", stream_covariance=False)
+            model = PredictionModel.load_model(args.model_db_path).weights
+            model = model.memory_usage(deep=True, index=False).sum()
+            covariance = pandas.read_table(args.covariance, sep=r"\s+")
+            row = covariance.memory_usage(deep=True, index=False).sum() / covariance.shape[0]
+
+            # small enough inputs are parsed whole
+            self.assertEqual(MetaMany.estimate_footprint(args), int(2*model + row*covariance.shape[0]))
+
+            args.stream_covariance = True
+            self.assertEqual(MetaMany.estimate_footprint(args), int(2*model + row*covariance.GENE.value_counts().max()))
+
+            args.covariance = os.path.join(OP, "cov.bin")
+            BinaryMatrixManager.build_binary_matrix("tests/_td/cov/cov.txt.gz", args.covariance)
+            footprint = MetaMany.estimate_footprint(args)
+            # only the index is held
+            self.assertGreater(footprint, 2*model)
+            self.assertLess(footprint, 2*model + row*covariance.shape[0])
+            args.stream_covariance = False
+            self.assertEqual(MetaMany.estimate_footprint(args), footprint)
+
+            args.single_snp_model = True
+            self.assertEqual(MetaMany.estimate_footprint(args), int(2*model))
+
+            args.tissue_footprint = 1.5
+            self.assertEqual(MetaMany.estimate_footprint(args), int(1.5*2**30))
+        finally:
+            shutil.rmtree(OP)
+
+    def test_pending_tissues(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+        try:
+            weight_dbs = [open("tests/_td/dbs/test_1.db"), open("tests/_td/dbs/test_2.db")]
+            for x in weight_dbs: x.close()
+            # neither the gwas file nor the arguments to read it exist: loading it would fail
+            args = argparse.Namespace(weight_dbs=weight_dbs, gwas_folder=None, gwas_file=os.path.join(OP, "missing.txt"),
+                covariance_directory="SAME", covariance_suffix=".txt.gz..db", output_directory=OP, output_file_prefix="results", overwrite=False,
+                tissue_parallelism=None, parallelism=None)
+            outputs = [MetaMany.tissue_args(args, x.name).output_file for x in weight_dbs]
+            self.assertEqual(MetaMany.pending_tissues(args), [x.name for x in weight_dbs])
+
+            open(outputs[0], "w").close()
+            self.assertEqual(MetaMany.pending_tissues(args), [weight_dbs[1].name])
+
+            open(outputs[1], "w").close()
+            self.assertEqual(MetaMany.pending_tissues(args), [])
+            MetaMany.run(args)
+
+            args.overwrite = True
+            self.assertEqual(MetaMany.pending_tissues(args), [x.name for x in weight_dbs])
+
+            # tissue workers would each start their own association workers
+            args.tissue_parallelism, args.parallelism = 2, 2
+            with self.assertRaises(Exceptions.InvalidArguments):
+                MetaMany.run(args)
+            args.parallelism = 1
+            MetaMany.validate(args)
+        finally:
+            shutil.rmtree(OP)
+
+if __name__ == '__main__':
+    unittest.main()
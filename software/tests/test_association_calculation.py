@@ -76,6 +76,30 @@ class TestAssociationCalculation(unittest.TestCase):
         r, snps = AssociationCalculation.association("G", c, return_snps=True)
         assert_equal_tuple(self, r, ('G', numpy.nan, numpy.nan, 0, 1, 1, 1))
 
+    def test_association_batch(self):
+        genes = ["A", "B", "C", "D", "E", "F", "G"]
+        c = _context()
+        expected = [AssociationCalculation.association(gene, c, return_snps=True) for gene in genes]
+        expected_snps = {snp for r, snps in expected for snp in snps}
+        expected = [r for r, snps in expected]
+
+        blocks = c.provide_calculation_blocks(genes)
+        results = AssociationCalculation.association_batch(blocks)
+        self.assertEqual(len(results), len(expected))
+        for r, e in zip(results, expected):
+            assert_equal_tuple(self, r, e)
+        self.assertEqual(set(blocks.snps), expected_snps)
+
+        additional = AssociationCalculation.additional_stats_batch(blocks)
+        for r, e in zip(additional, [AssociationCalculation.additional_stats(gene, c) for gene in genes]):
+            self.assertEqual(r[0], e[0])
+            numpy.testing.assert_allclose(r[1:], e[1:])
+
+        # a block without any snp
+        results = AssociationCalculation.association_batch(c.provide_calculation_blocks(["D", "E"]))
+        for r, gene in zip(results, ["D", "E"]):
+            assert_equal_tuple(self, r, AssociationCalculation.association(gene, c))
+
     def test_dataframe_from_results(self):
         results = [
             ('A', 0.42313735862217716, 0.42845528455235105, 0.10250000000002803, 4, 4, 3),
@@ -0,0 +1,71 @@
+import os
+import shutil
+import numpy
+import numpy.testing
+
+import unittest
+
+from metax.genotype import BGENGenotype
+from metax.genotype import Genotype
+
+OP = ".kk_bgen_genotype"
+# readers leave index files next to the bgen
+BGEN = os.path.join(OP, "example.bgen")
+
+# allele_1 dosages, computed variant by variant with the dask based reader
+def _expected(variant):
+    import bgen_reader
+    bgen = bgen_reader.read_bgen(BGEN, verbose=False)
+    v = bgen["genotype"][variant].compute()
+    p = numpy.array(v["probs"], dtype=float)
+    return p[:,1] + p[:,3] if v["phased"] else p[:,1] + p[:,2]*2
+
+class TestBGENGenotype(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+        shutil.copy("tests/_td/genotype/example.bgen", BGEN)
+
+    def tearDown(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+
+    def test_geno_lines(self):
+        for batch_size in [None, 1, 2]:
+            lines = list(BGENGenotype.bgen_file_geno_lines(BGEN, batch_size=batch_size))
+            self.assertEqual([x[:5] for x in lines],
+                [("1_10_A_G", "1", 10, "A", "G"), ("1_20_C_T", "1", 20, "C", "T"), ("1_40_C_G", "1", 40, "C", "G"),
+                 ("1_50_G_A", "1", 50, "G", "A"), ("1_60_T_C", "1", 60, "T", "C")])
+            for line, variant in zip(lines, [0, 1, 3, 4, 5]):
+                expected = _expected(variant)
+                d = Genotype.dosage(line)
+                self.assertEqual(d.shape, (8,))
+                numpy.testing.assert_allclose(d, expected, rtol=1e-12)
+                numpy.testing.assert_allclose(line[5], numpy.mean(expected)/2, rtol=1e-12)
+            # missing sample
+            self.assertTrue(numpy.isnan(Genotype.dosage(lines[3])[3]))
+
+        lines = list(BGENGenotype.bgen_files_geno_lines([BGEN], use_rsid=True, whitelist={"rs2", "rs4"}, variant_mapping={"rs2":"x2", "rs4":"x4"}))
+        self.assertEqual([x[0] for x in lines], ["x2", "x4"])
+        numpy.testing.assert_allclose(Genotype.dosage(lines[1]), _expected(3), rtol=1e-12)
+
+        lines = list(BGENGenotype.bgen_file_geno_lines(BGEN, force_colon=True, skip_palindromic=True))
+        self.assertEqual([x[0] for x in lines], ["1:10:A:G", "1:20:C:T", "1:50:G:A", "1:60:T:C"])
+
+        lines = list(BGENGenotype.bgen_file_geno_lines(BGEN, regions=[("1", 15, 30), ("1", 40, 40), ("2", 1, 100)]))
+        self.assertEqual([x[0] for x in lines], ["1_20_C_T", "1_40_C_G"])
+        numpy.testing.assert_allclose(Genotype.dosage(lines[1]), _expected(3), rtol=1e-12)
+
+        lines = list(BGENGenotype.bgen_file_geno_lines(BGEN, regions=[("01", 15, 30), ("chr1", 40, 40)]))
+        self.assertEqual([x[0] for x in lines], ["1_20_C_T", "1_40_C_G"])
+
+        with self.assertLogs(level="WARNING"):
+            lines = list(BGENGenotype.bgen_file_geno_lines(BGEN, regions=[("2", 1, 100)]))
+        self.assertEqual(lines, [])
+
+    def test_samples(self):
+        samples = BGENGenotype.get_samples(BGEN)
+        self.assertEqual(list(samples.FID), ["s{}".format(i) for i in range(8)])
+        self.assertEqual(list(samples.IID), ["s{}".format(i) for i in range(8)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import shutil
+import numpy
+import numpy.testing
+
+import unittest
+
+from metax import Exceptions
+from metax import MatrixManager
+from metax import BinaryMatrixManager
+D = MatrixManager.GENE_SNP_COVARIANCE_DEFINITION
+
+from . import cov_data
+from . import SampleData
+
+OP = ".kk_binary_matrix"
+
+def _convert(input_path, name="cov.bin", dtype="float64"):
+    output = os.path.join(OP, name)
+    BinaryMatrixManager.build_binary_matrix(input_path, output, D, dtype)
+    return output
+
+class TestBinaryMatrixManager(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+
+    def tearDown(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+
+    def test_invalid_data(self):
+        with self.assertRaises(Exceptions.InvalidInputFormat) as ctx:
+            _convert("tests/_td/cov/cov.duplicate.txt.gz")
+        self.assertTrue("duplicate" in ctx.exception.msg.lower())
+
+        with self.assertRaises(Exceptions.InvalidInputFormat) as ctx:
+            _convert("tests/_td/cov/cov.uncontiguous.txt.gz")
+        self.assertTrue("contiguous" in ctx.exception.msg.lower())
+
+        self.assertFalse(BinaryMatrixManager.is_binary_matrix("tests/_td/cov/cov.txt.gz"))
+
+    def test_from_load(self):
+        path = _convert("tests/_td/cov/cov.txt.gz")
+        self.assertTrue(BinaryMatrixManager.is_binary_matrix(path))
+        m = MatrixManager.load_matrix_manager(path)
+        self.assertTrue(isinstance(m, BinaryMatrixManager.BinaryMatrixManager))
+        self.assertEqual(m.model_labels(), MatrixManager.load_matrix_manager("tests/_td/cov/cov.txt.gz").model_labels())
+
+        # out of file order
+        snps, cov = m.get("ENSG00000004766.11")
+        self.assertEqual(snps, cov_data.SNPS_ENSG00000004766_11)
+        numpy.testing.assert_array_almost_equal(cov, cov_data.COV_ENSG00000004766_11)
+        self.assertEqual(m.n_ids("ENSG00000004766.11"), len(cov_data.COV_ENSG00000004766_11))
+
+        snps, cov = m.get("ENSG00000239789.1")
+        self.assertEqual(snps, cov_data.SNPS_ENSG00000239789_1)
+        numpy.testing.assert_array_almost_equal(cov, cov_data.COV_ENSG00000239789_1)
+        self.assertEqual(m.n_ids("ENSG00000239789.1"), len(cov_data.SNPS_ENSG00000239789_1))
+
+        with self.assertRaises(Exceptions.InvalidArguments) as ctx:
+            m.get("ENSG00000183742.8", ["rs7806506", "rs12718973"])
+        self.assertTrue("whitelist" in ctx.exception.msg)
+
+        whitelist = ["rs3094989", "rs7806506", "rs12536095", "rs10226814"]
+        snps, cov = m.get("ENSG00000183742.8", whitelist)
+        self.assertEqual(snps, cov_data.SNPS_ENSG00000183742_8_w)
+        numpy.testing.assert_array_almost_equal(cov, cov_data.COV_ENSG00000183742_8_w)
+
+        self.assertEqual(m.get("nope"), (None, None))
+        self.assertTrue(numpy.isnan(m.n_ids("nope")))
+
+        m = MatrixManager.load_matrix_manager(path, permissive=True)
+        snps, cov = m.get("ENSG00000183742.8", ["rs7806506", "rs12718973"])
+        self.assertEqual(snps, ["rs7806506"])
+
+    def test_memmap(self):
+        path = _convert("tests/_td/cov/cov.txt.gz")
+        b = BinaryMatrixManager.BinaryMatrixManager(path)
+        m = BinaryMatrixManager.load_binary_matrix_manager(path, memory_map=True)
+        self.assertTrue(isinstance(m, BinaryMatrixManager.MemmapMatrixManager))
+        self.assertEqual(m.model_labels(), b.model_labels())
+
+        # any order, any number of times
+        genes = sorted(b.model_labels(), reverse=True)
+        for gene in genes + genes:
+            snps, cov = m.get(gene)
+            e_snps, e_cov = b.get(gene)
+            self.assertEqual(snps, e_snps)
+            numpy.testing.assert_array_equal(cov, e_cov)
+            self.assertEqual(m.n_ids(gene), b.n_ids(gene))
+
+        snps, cov = m.get("ENSG00000183742.8", ["rs3094989", "rs7806506", "rs12536095", "rs10226814"])
+        self.assertEqual(snps, cov_data.SNPS_ENSG00000183742_8_w)
+        numpy.testing.assert_array_almost_equal(cov, cov_data.COV_ENSG00000183742_8_w)
+
+    def test_float32(self):
+        path = _convert("tests/_td/cov/cov.txt.gz", dtype="float32")
+        m = BinaryMatrixManager.BinaryMatrixManager(path)
+        snps, cov = m.get("ENSG00000004766.11")
+        self.assertEqual(snps, cov_data.SNPS_ENSG00000004766_11)
+        numpy.testing.assert_array_almost_equal(cov, cov_data.COV_ENSG00000004766_11, decimal=6)
+
+    def test_from_data(self):
+        s = SampleData.dataframe_from_covariance(SampleData.sample_covariance_s_1())
+        text = os.path.join(OP, "cov.txt.gz")
+        s.to_csv(text, sep="\t", index=False, na_rep="NA", compression="gzip")
+        m = BinaryMatrixManager.BinaryMatrixManager(_convert(text))
+        e = MatrixManager.MatrixManager(s, D)
+
+        for gene in ["A", "B", "C", "F"]:
+            snps, cov = m.get(gene)
+            e_snps, e_cov = e.get(gene)
+            self.assertEqual(snps, e_snps)
+            numpy.testing.assert_array_almost_equal(cov, e_cov)
+            self.assertEqual(m.n_ids(gene), e.n_ids(gene))
+
+        snps, cov = m.get("C", ['rs100', 'rs101', 'rs102'])
+        self.assertEqual(snps, cov_data.SNPS_C)
+        numpy.testing.assert_array_almost_equal(cov, cov_data.COV_C)
+
+        s1, s2, cov = m.get_2("B", ["rs9", "rs3"], ["rs7", "rs6", "rs1"])
+        e1, e2, e_cov = e.get_2("B", ["rs9", "rs3"], ["rs7", "rs6", "rs1"])
+        self.assertEqual(s1, e1)
+        self.assertEqual(s2, e2)
+        numpy.testing.assert_array_almost_equal(cov, e_cov)
+
+if __name__ == '__main__':
+    unittest.main()
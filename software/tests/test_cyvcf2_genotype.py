@@ -0,0 +1,61 @@
+import numpy
+import numpy.testing
+
+import unittest
+
+from metax import Exceptions
+from metax.genotype import CYVCF2Genotype
+from metax.genotype import Genotype
+
+VCF = "tests/_td/genotype/example.vcf"
+
+class TestCYVCF2Genotype(unittest.TestCase):
+    def test_genotyped(self):
+        lines = list(CYVCF2Genotype.vcf_file_geno_lines(VCF, mode="genotyped"))
+        self.assertEqual([x[:5] for x in lines],
+            [("rs1", "1", 10, "A", "G"), ("rs2", "1", 20, "C", "T"), ("rs2", "1", 20, "C", "G"),
+             ("rs3", "1", 30, "C", "G"), ("rs4", "1", 40, "T", "C")])
+        expected = [[0, 1, 2, 0], [1, 1, 0, 0], [0, 1, 2, 0], [1, 2, 0, 1], [1, 0, 2, 1]]
+        for line, e in zip(lines, expected):
+            numpy.testing.assert_array_equal(Genotype.dosage(line), e)
+            self.assertEqual(line[5], numpy.mean(e)/2)
+
+        lines = list(CYVCF2Genotype.vcf_files_geno_lines([VCF], mode="genotyped", whitelist={"rs2", "rs3"}, skip_palindromic=True))
+        self.assertEqual([x[:5] for x in lines], [("rs2", "1", 20, "C", "T")])
+
+    def test_imputed(self):
+        lines = list(CYVCF2Genotype.vcf_file_geno_lines(VCF, mode="imputed"))
+        self.assertEqual([x[0] for x in lines], ["rs1", "rs3", "rs4"])
+        expected = [[0.1, 0.9, 1.8, 1.0], [1.25, 2.0, 0.0, 0.75], [1.0, 0.0, 1.5, 0.5]]
+        for line, e in zip(lines, expected):
+            d = Genotype.dosage(line)
+            self.assertEqual(d.dtype, numpy.float64)
+            numpy.testing.assert_allclose(d, e, rtol=1e-6)
+
+    def test_regions(self):
+        # regions are visited in file order; contigs missing from the file are skipped
+        regions = [("1", 35, 50), ("1", 10, 20), ("1", 21, 30), ("2", 1, 100)]
+        lines = list(CYVCF2Genotype.vcf_file_geno_lines(VCF + ".gz", mode="genotyped", regions=regions))
+        expected = list(CYVCF2Genotype.vcf_file_geno_lines(VCF, mode="genotyped"))
+        self.assertEqual([x[:6] for x in lines], [x[:6] for x in expected])
+
+        lines = list(CYVCF2Genotype.vcf_file_geno_lines(VCF + ".gz", mode="genotyped", regions=[("1", 15, 30)]))
+        self.assertEqual([x[0] for x in lines], ["rs2", "rs2", "rs3"])
+        numpy.testing.assert_array_equal(Genotype.dosage(lines[2]), [1, 2, 0, 1])
+
+        lines = list(CYVCF2Genotype.vcf_file_geno_lines(VCF + ".gz", mode="genotyped", regions=[("01", 15, 30)]))
+        self.assertEqual([x[0] for x in lines], ["rs2", "rs2", "rs3"])
+
+        with self.assertLogs(level="WARNING"):
+            lines = list(CYVCF2Genotype.vcf_file_geno_lines(VCF + ".gz", mode="genotyped", regions=[("2", 1, 100)]))
+        self.assertEqual(lines, [])
+
+        with self.assertRaises(Exceptions.InvalidInputFormat):
+            list(CYVCF2Genotype.vcf_file_geno_lines(VCF, mode="genotyped", regions=[("1", 15, 30)]))
+
+    def test_samples(self):
+        samples = CYVCF2Genotype.get_samples(VCF)
+        self.assertEqual(list(samples.IID), ["S0", "S1", "S2", "S3"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,25 @@ class TestDataframeStreamer(unittest.TestCase):
         kk = pandas.read_table(kk)
         self.assertTrue(kk.equals(kkk))
 
+    def test_prefetched(self):
+        kk = "tests/_td/gtex_like_eqtl/data.txt"
+        expected = list(DataFrameStreamer.data_frame_streamer(kk, "gene_id"))
+        for size in [1, 2, 100]:
+            d = list(DataFrameStreamer.prefetched(DataFrameStreamer.data_frame_streamer(kk, "gene_id"), size))
+            self.assertEqual(len(d), len(expected))
+            for a, b in zip(d, expected):
+                self.assertTrue(a.equals(b))
+
+        self.assertEqual(list(DataFrameStreamer.prefetched(iter([]))), [])
+
+        def _failing():
+            yield 1
+            raise ValueError("nope")
+        d = DataFrameStreamer.prefetched(_failing())
+        self.assertEqual(next(d), 1)
+        with self.assertRaises(ValueError):
+            next(d)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
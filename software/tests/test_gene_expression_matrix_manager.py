@@ -0,0 +1,37 @@
+import numpy
+import numpy.testing
+import pandas
+
+import unittest
+
+from metax import Exceptions
+from metax import PredictionModel
+from metax.genotype import GeneExpressionMatrixManager
+
+def _covariance():
+    return pandas.read_table("tests/_td/meta_covariance/snps_covariance.txt.gz")
+
+class TestGeneExpressionMatrixManager(unittest.TestCase):
+    def test_get(self):
+        d = _covariance()
+        m = GeneExpressionMatrixManager._GeneExpressionMatrixManager(d, PredictionModel.load_model_manager("tests/_td/dbs_3", Klass=PredictionModel._ArrayModelManager))
+        e = GeneExpressionMatrixManager.GeneExpressionMatrixManager(d, PredictionModel.load_model_manager("tests/_td/dbs_3"))
+        model_manager = PredictionModel.load_model_manager("tests/_td/dbs_3", Klass=PredictionModel._ModelManager)
+        for gene in sorted(set(d.GENE)):
+            all_tissues = sorted(model_manager.get_model_labels(gene))
+            for tissues in [all_tissues, all_tissues[::3], all_tissues[:1], ["nope"]]:
+                t, matrix = m.get(gene, tissues)
+                t_e, matrix_e = e.get(gene, [x for x in tissues if x in all_tissues])
+                self.assertEqual(t, t_e)
+                if len(t):
+                    numpy.testing.assert_allclose(matrix, matrix_e, rtol=1e-10)
+                    numpy.testing.assert_allclose(numpy.diag(matrix), 1.0)
+
+    def test_incomplete_covariance(self):
+        d = _covariance()
+        d = d[~((d.RSID1 != d.RSID2) & (d.index == d.index[d.RSID1 != d.RSID2][0]))]
+        with self.assertRaises(Exceptions.InvalidInputFormat):
+            GeneExpressionMatrixManager._GeneExpressionMatrixManager(d, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import numpy
+import numpy.testing
+
+import unittest
+
+from metax.misc import Genomics
+
+class TestGenomics(unittest.TestCase):
+    def test_coordinates_from_ids(self):
+        ids = ["chr1_12345_A_G_b38", "1:200:A:G", "chrX_5_C_T", "2_30", "rs123", "chr1", None]
+        self.assertEqual(Genomics.coordinates_from_ids(ids), [("1", 12345), ("1", 200), ("X", 5), ("2", 30)])
+
+    def test_regions(self):
+        coordinates = [("2", 100), ("1", 50000), ("1", 100), ("1", 5000), ("1", 100), ("1", 16000), ("10", 7)]
+        self.assertEqual(Genomics.regions(coordinates, gap=10000), [("1", 100, 5000), ("1", 16000, 16000), ("1", 50000, 50000), ("10", 7, 7), ("2", 100, 100)])
+        self.assertEqual(Genomics.regions(coordinates, gap=20000), [("1", 100, 16000), ("1", 50000, 50000), ("10", 7, 7), ("2", 100, 100)])
+        self.assertEqual(Genomics.regions([]), [])
+        self.assertEqual(Genomics.regions([("01", 100), ("1", 200), ("chr1", 300)]), [("1", 100, 300)])
+
+    def test_in_regions(self):
+        regions = [("1", 100, 200), ("1", 10, 20), ("2", 5, 5)]
+        chromosomes = ["1", "chr1", "1", "1", "1", "2", "2", "3"]
+        positions = [10, 20, 21, 150, 201, 5, 6, 10]
+        numpy.testing.assert_array_equal(Genomics.in_regions(chromosomes, positions, regions),
+            [True, True, False, True, False, True, False, False])
+
+        # UK Biobank style names, or prefixed ones, match plain region chromosomes and the other way around
+        numpy.testing.assert_array_equal(Genomics.in_regions(["01"], [100], [("1", 50, 150)]), [True])
+        numpy.testing.assert_array_equal(Genomics.in_regions(["01", "chr02", "10", "MT", "chrM"], [100, 100, 100, 7, 7], [("chr1", 50, 150), ("02", 50, 150), ("1", 50, 150), ("M", 1, 10)]),
+            [True, True, False, True, True])
+
+    def test_contig_name(self):
+        self.assertEqual([Genomics.contig_name(x) for x in ["1", "01", "chr01", "chr1", "CHR10", "10", "0", "chrX", "x", "M", "chrM", "MT", "GL000192.1"]],
+            ["1", "1", "1", "1", "10", "10", "0", "X", "X", "MT", "MT", "MT", "GL000192.1"])
+
+if __name__ == '__main__':
+    unittest.main()
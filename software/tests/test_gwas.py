@@ -1,3 +1,7 @@
+import gzip
+import io
+import os
+import shutil
 import numpy
 import numpy.testing
 import pandas
@@ -22,6 +26,8 @@ from metax.Constants import POSITION
 from . import SampleData
 from . import scz2_sample
 
+OP = ".kk_gwas"
+
 def assert_basic_gwas(unit_test, gwas):
     numpy.testing.assert_array_equal(gwas[SNP], scz2_sample.expected_snp)
     numpy.testing.assert_array_equal(gwas[EFFECT_ALLELE], scz2_sample.expected_effect)
@@ -178,6 +184,130 @@ class TestGWAS(unittest.TestCase):
         numpy.testing.assert_allclose(gwas[SE], pandas.Series([0.0173, 0.0198,  0.0159], dtype=numpy.float32), rtol=0.001)
 
 
+    def test_gwas_chunks(self):
+        gwas_format = {
+            "column_snp":"SNPID",
+            "column_non_effect_allele":"A2",
+            "column_effect_allele":"A1",
+            "column_or":"OR",
+            "column_se":"SE",
+            "column_chromosome":"HG19CHRC",
+            "column_position":"BP"
+        }
+        path = "tests/_td/GWAS/scz2/scz2.gwas.results.txt.gz"
+        expected = GWAS.load_gwas(path, gwas_format, force_special_handling=True)
+
+        chunks = list(GWAS.load_gwas_chunks(path, gwas_format, chunk_size=3))
+        self.assertEqual(len(chunks), int(numpy.ceil(expected.shape[0]/3.0)))
+        gwas = pandas.concat(chunks).reset_index(drop=True)
+        assert_gwas_zscore_fbse(self, gwas)
+        pandas.testing.assert_frame_equal(gwas, expected.reset_index(drop=True))
+
+        snps = {"rs940550", "rs6650104", "rs61770173"}
+        gwas = pandas.concat(GWAS.load_gwas_chunks(path, gwas_format, snps=snps, chunk_size=4)).reset_index(drop=True)
+        expected = GWAS.load_gwas(path, gwas_format, snps=snps)
+        pandas.testing.assert_frame_equal(gwas, expected.reset_index(drop=True))
+
+    def test_gwas_chunks_zero_pvalues(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+        gwas_format = {
+            "column_snp":"SNP",
+            "column_non_effect_allele":"A2",
+            "column_effect_allele":"A1",
+            "column_beta":"BETA",
+            "column_pvalue":"P"
+        }
+        path = os.path.join(OP, "zeros.txt")
+        # a chunk made of zero pvalues only, and a usable pvalue smaller than the fix after it
+        for pvalues in [["0.01", "0.02", "0"], ["0.01", "0.02", "0", "0", "1e-40", "0.5"], ["0", "0"]]:
+            with open(path, "w") as f:
+                f.write("SNP A1 A2 BETA P\n")
+                for i, pvalue in enumerate(pvalues):
+                    f.write("rs{} A G {} {}\n".format(i, -0.1 if i % 2 else 0.1, pvalue))
+
+            expected = GWAS.load_gwas(path, gwas_format, separator=" ", input_pvalue_fix=1e-30)
+            for chunk_size in [1, 2, 3]:
+                gwas = pandas.concat(GWAS.load_gwas_chunks(path, gwas_format, separator=" ", input_pvalue_fix=1e-30, chunk_size=chunk_size)).reset_index(drop=True)
+                pandas.testing.assert_frame_equal(gwas, expected.reset_index(drop=True))
+                self.assertTrue(numpy.all(numpy.isfinite(gwas[ZSCORE])))
+        shutil.rmtree(OP)
+
+    def test_gwas_cache(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        gwas_format = {
+            "column_snp":"SNPID",
+            "column_non_effect_allele":"A2",
+            "column_effect_allele":"A1",
+            "column_or":"OR",
+            "column_se":"SE",
+            "column_chromosome":"HG19CHRC",
+            "column_position":"BP"
+        }
+        path = "tests/_td/GWAS/scz2/scz2.gwas.results.txt.gz"
+        expected = GWAS.load_gwas(path, gwas_format)
+        gwas = GWAS.load_gwas(path, gwas_format, cache_folder=OP)
+        pandas.testing.assert_frame_equal(gwas, expected)
+        self.assertEqual(len(os.listdir(OP)), 1)
+
+        # from the cache
+        gwas = GWAS.load_gwas(path, gwas_format, cache_folder=OP)
+        assert_gwas_zscore_fbse(self, gwas)
+        pandas.testing.assert_frame_equal(gwas, expected)
+        self.assertEqual(len(os.listdir(OP)), 1)
+
+        # whitelisting happens on the cached entry, which is shared by any whitelist
+        snps = {"rs940550", "rs6650104", "rs61770173"}
+        expected = GWAS.load_gwas(path, gwas_format, snps=snps)
+        for i in range(0,2):
+            gwas = GWAS.load_gwas(path, gwas_format, snps=snps, cache_folder=OP)
+            pandas.testing.assert_frame_equal(gwas, expected)
+        self.assertEqual(len(os.listdir(OP)), 2)
+
+        # different format, different entry
+        gwas_format["column_pvalue"] = "P"
+        del gwas_format["column_se"]
+        expected = GWAS.load_gwas(path, gwas_format)
+        gwas = GWAS.load_gwas(path, gwas_format, cache_folder=OP)
+        pandas.testing.assert_frame_equal(gwas, expected)
+        self.assertEqual(len(os.listdir(OP)), 3)
+
+        # streams are not cached
+        with gzip.open(path, "rt") as f:
+            gwas = GWAS.load_gwas(io.StringIO(f.read()), gwas_format, cache_folder=OP)
+        pandas.testing.assert_frame_equal(gwas, expected)
+        self.assertEqual(len(os.listdir(OP)), 3)
+        shutil.rmtree(OP)
+
+    def test_gwas_cache_malformed(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+        gwas_format = {
+            "column_snp":"SNP",
+            "column_non_effect_allele":"A2",
+            "column_effect_allele":"A1",
+            "column_beta":"BETA",
+            "column_pvalue":"P"
+        }
+        path = os.path.join(OP, "malformed.txt")
+        with open(path, "w") as f:
+            f.write("SNP A1 A2 BETA P\nrs1 A G 0.1 0.01\nrs2 C T -0.2 oops\nrs3 A C 0.3 NA\n")
+        cache = os.path.join(OP, "cache")
+
+        # a malformed value is only an error for the snps that are kept, with or without cache
+        snps = {"rs1", "rs3"}
+        expected = GWAS.load_gwas(path, gwas_format, snps=snps, separator=" ")
+        for i in range(0,2):
+            gwas = GWAS.load_gwas(path, gwas_format, snps=snps, separator=" ", cache_folder=cache)
+            pandas.testing.assert_frame_equal(gwas, expected)
+        self.assertEqual(list(gwas[SNP]), ["rs1", "rs3"])
+
+        with self.assertRaises(ValueError):
+            GWAS.load_gwas(path, gwas_format, snps={"rs1", "rs2"}, separator=" ")
+        with self.assertRaises(ValueError):
+            GWAS.load_gwas(path, gwas_format, snps={"rs1", "rs2"}, separator=" ", cache_folder=cache)
+        shutil.rmtree(OP)
+
     def test_extract(self):
         gwas = GWASUtilities.gwas_from_data(SampleData.sample_gwas_data_3())
         g = GWAS.extract(gwas, ["rs3", "rs6", "rs7"])
@@ -0,0 +1,58 @@
+import numpy
+import numpy.testing
+import pandas
+
+import unittest
+
+from metax.Constants import SNP
+from metax.Constants import ZSCORE
+from metax.Constants import BETA
+from metax.Constants import EFFECT_ALLELE
+from metax.Constants import NON_EFFECT_ALLELE
+from metax.misc import GWASAndModels
+
+def _data():
+    return pandas.DataFrame({
+        SNP: ["rs1", "rs2", "rs3", "rs4", "rs5", "rs6", "rs7", "rs8"],
+        EFFECT_ALLELE: ["A", "C", "A", "T", "AT", "A", None, "A"],
+        NON_EFFECT_ALLELE: ["G", "T", "G", "C", "G", "T", "C", "G"],
+        ZSCORE: [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0],
+        BETA: [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8]})
+
+def _base():
+    return pandas.DataFrame({
+        "rsid": ["rs1", "rs2", "rs3", "rs4", "rs5", "rs6", "rs7", "rs8"],
+        EFFECT_ALLELE: ["A", "T", "T", "G", "TA", "T", None, "A"],
+        NON_EFFECT_ALLELE: ["G", "C", "C", "A", "C", "A", "C", "C"]})
+
+class TestGWASAndModels(unittest.TestCase):
+    def test_align_data_to_alleles(self):
+        a = GWASAndModels.align_data_to_alleles(_data(), _base(), SNP, "rsid")
+        self.assertEqual(list(a[SNP]), ["rs1", "rs2", "rs6"])
+        numpy.testing.assert_array_equal(a[ZSCORE], [1.0, -2.0, -6.0])
+        numpy.testing.assert_array_equal(a[BETA], [0.1, -0.2, -0.6])
+        self.assertEqual(list(a[EFFECT_ALLELE]), ["A", "T", "T"])
+        self.assertEqual(list(a[NON_EFFECT_ALLELE]), ["G", "C", "A"])
+
+    def test_align_data_to_alleles_strand(self):
+        a = GWASAndModels.align_data_to_alleles(_data(), _base(), SNP, "rsid", match_strand=True)
+        # rs3: complement; rs4: swapped complement; rs5: multi-letter complement
+        # rs6 is ambiguous, and matches on the same strand first
+        self.assertEqual(list(a[SNP]), ["rs1", "rs2", "rs3", "rs4", "rs5", "rs6"])
+        numpy.testing.assert_array_equal(a[ZSCORE], [1.0, -2.0, 3.0, -4.0, 5.0, -6.0])
+        self.assertEqual(list(a[EFFECT_ALLELE]), ["A", "T", "T", "G", "TA", "T"])
+        self.assertEqual(list(a[NON_EFFECT_ALLELE]), ["G", "C", "C", "A", "C", "A"])
+
+        for i, row in _data().iterrows():
+            b = _base().iloc[i]
+            if row[EFFECT_ALLELE] is None: continue
+            allele, strand = GWASAndModels.match_alleles(row[NON_EFFECT_ALLELE], row[EFFECT_ALLELE], b[NON_EFFECT_ALLELE], b[EFFECT_ALLELE])
+            if allele is not None:
+                self.assertEqual(a[a[SNP] == row[SNP]][ZSCORE].values[0], allele*row[ZSCORE])
+
+    def test_align_data_to_alleles_empty(self):
+        a = GWASAndModels.align_data_to_alleles(_data(), _base().assign(rsid="nope"), SNP, "rsid", match_strand=True)
+        self.assertEqual(a.shape[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+import os
+import shutil
 import numpy
 import numpy.testing
 import pandas
@@ -5,6 +7,8 @@ import pandas
 import unittest
 from metax.gwas import GWASSpecialHandling
 
+OP = ".kk_gwas_special_handling"
+
 class TestGWASSpecialHandling(unittest.TestCase):
 
     def test_sanitize_component(self):
@@ -37,4 +41,32 @@ class TestGWASSpecialHandling(unittest.TestCase):
 
         #NA gets translated into Nome
         self.assertIsNone(sanitize("NA"))
-        self.assertIsNone(sanitize("."))
\ No newline at end of file
+        self.assertIsNone(sanitize("."))
+
+    def test_gwas_data_source(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+        path = os.path.join(OP, "gwas.txt")
+        with open(path, "w") as f:
+            f.write("SNP A1 P P FLAG\n")
+            f.write("rs1 A 0.1 0.5 True\n")
+            f.write("rs2   C\t1e-3 0.5 False\n")
+            f.write("rs3 G 0.2\n") # too short, dropped
+            f.write("rs4\x0cT -2 0.5 True\n") # whitespace the C parser does not split on
+            f.write("rs5 A 0.3 0.5 True") # no line end
+
+        d = GWASSpecialHandling.gwas_data_source(path)
+        self.assertEqual(list(d["SNP"]), ["rs1", "rs2", "rs4", "rs5"])
+        self.assertEqual(list(d["A1"]), ["A", "C", "T", "A"])
+        numpy.testing.assert_array_equal(d["P"], [0.1, 1e-3, -2, 0.3])
+        # booleans are not numbers
+        self.assertEqual(list(d["FLAG"]), ["True", "False", "True", "True"])
+
+        d = GWASSpecialHandling.gwas_data_source(path, snps={"rs2", "rs3", "rs5"}, snp_column_name="SNP")
+        self.assertEqual(list(d["SNP"]), ["rs2", "rs5"])
+        numpy.testing.assert_array_equal(d["P"], [1e-3, 0.3])
+
+        chunks = list(GWASSpecialHandling.gwas_data_chunks(path, columns={"SNP", "P"}, chunk_size=2))
+        self.assertEqual([list(x["SNP"]) for x in chunks], [["rs1", "rs2"], ["rs4"], ["rs5"]])
+        self.assertEqual(set(chunks[0].keys()), {"SNP", "P"})
+        shutil.rmtree(OP)
@@ -0,0 +1,72 @@
+import numpy
+import numpy.testing
+
+import unittest
+
+from argparse import Namespace
+
+from metax.cross_model import JointAnalysis
+from metax.cross_model import Utilities as CrossModelUtilities
+
+class _Context(JointAnalysis.ContextMixin, JointAnalysis.Context):
+    def __init__(self, data, cutoff, epsilon=None):
+        self.data = data
+        self.cutoff = cutoff
+        self.epsilon = epsilon
+        self.trimmed_ensemble_id = False
+
+    def get_metaxcan_zscores(self, gene):
+        zscores, labels, matrix = self.data[gene]
+        return zscores, labels
+
+    def get_model_matrix(self, gene, tissues):
+        zscores, labels, matrix = self.data[gene]
+        return (labels, matrix) if matrix is not None else ([], None)
+
+    def get_gene_name(self, gene):
+        return gene.upper()
+
+def _data():
+    rng = numpy.random.default_rng(0)
+    data = {}
+    for i, t in enumerate([3, 5, 3, 1, 8, 5, 5, 2]):
+        x = rng.normal(size=(t, 4 if i % 2 else 30))
+        matrix = numpy.matrix(numpy.corrcoef(x) if t > 1 else [[1.0]])
+        labels = ["t{}".format(j) for j in range(t)]
+        data["g{}".format(i)] = (list(rng.normal(size=t)*3), labels, matrix)
+    data["no_results"] = (None, None, None)
+    data["no_product"] = ([1.0, 2.0], ["t0", "t1"], None)
+    return data
+
+def _cutoffs():
+    yield CrossModelUtilities._cutoff(Namespace(cutoff_eigen_ratio=None, cutoff_trace_ratio=None, cutoff_threshold=None, cutoff_condition_number=30))
+    yield CrossModelUtilities._cutoff(Namespace(cutoff_eigen_ratio=None, cutoff_trace_ratio=0.05, cutoff_threshold=None, cutoff_condition_number=None))
+    yield CrossModelUtilities._cutoff(Namespace(cutoff_eigen_ratio=0.0, cutoff_trace_ratio=None, cutoff_threshold=None, cutoff_condition_number=None))
+
+class TestJointAnalysis(unittest.TestCase):
+    def test_joint_analysis_batch(self):
+        data = _data()
+        genes = sorted(data.keys())
+        for cutoff in _cutoffs():
+            for epsilon in [None, 0.1]:
+                context = _Context(data, cutoff, epsilon)
+                results = JointAnalysis.joint_analysis_batch(context, genes)
+                self.assertEqual(len(results), len(genes))
+                for gene, result in zip(genes, results):
+                    expected = JointAnalysis.joint_analysis(context, gene)
+                    self.assertEqual(result[0], gene)
+                    for a, b in zip(result, expected):
+                        if isinstance(b, str) or b is None:
+                            self.assertEqual(a, b)
+                        else:
+                            numpy.testing.assert_allclose(a, b, rtol=1e-10)
+
+        context = _Context(data, next(_cutoffs()))
+        results = dict(zip(genes, JointAnalysis.joint_analysis_batch(context, genes)))
+        self.assertEqual(results["no_results"][-1], JointAnalysis.CalculationStatus.NO_METAXCAN_RESULTS)
+        self.assertEqual(results["no_product"][-1], JointAnalysis.CalculationStatus.NO_PRODUCT)
+        self.assertEqual(results["g3"][4], 1)
+        self.assertEqual(JointAnalysis.joint_analysis_batch(context, []), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import numpy
+import numpy.testing
+
+import unittest
+
+from metax.misc import Math
+
+def _matrices():
+    rng = numpy.random.default_rng(0)
+    for n, k in [(1, 5), (4, 20), (10, 3), (10, 40)]:
+        x = rng.normal(size=(n, k))
+        yield numpy.matrix(numpy.corrcoef(x) if n > 1 else [[1.0]])
+    # not positive semidefinite
+    yield numpy.matrix([[1.0, 0.8, 0.3], [0.8, 1.0, -0.7], [0.3, -0.7, 1.0]])
+
+class TestMath(unittest.TestCase):
+    def test_capinv_eigh(self):
+        for matrix in _matrices():
+            w, v = numpy.linalg.eigh(matrix)
+            v = numpy.asarray(v)
+            for cutoff in [1e-6, 0.3, 0.05, 100]:
+                for epsilon in [None, 0.1]:
+                    inv, n_indep, eigen = Math.capinv(matrix, cutoff, epsilon)
+                    d, _n_indep, _eigen = Math.capinv_eigh(w, cutoff, epsilon)
+                    numpy.testing.assert_allclose(_eigen, eigen, atol=1e-12)
+                    self.assertEqual(_n_indep, n_indep)
+                    numpy.testing.assert_allclose(numpy.dot(v*d, v.T), inv, atol=1e-10)
+
+        with self.assertRaises(RuntimeError):
+            Math.capinv_eigh([])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import numpy
+import pandas
+
+import unittest
+
+from metax.metaxcan import MetaXcanResultsManager
+
+OP = ".kk_metaxcan_results_manager"
+
+def _results():
+    rng = numpy.random.default_rng(0)
+    results = {}
+    for i, tissue in enumerate(["Liver", "Brain", "Adipose", "Empty"]):
+        genes = ["ENSG{}".format(x) for x in rng.choice(30, 20, replace=False)]
+        zscore = rng.normal(size=len(genes))
+        zscore[rng.choice(len(genes), 4, replace=False)] = numpy.nan
+        if tissue == "Empty":
+            zscore[:] = numpy.nan
+        zscore[0] = numpy.inf
+        results[tissue] = pandas.DataFrame({"gene": genes, "gene_name": genes, "zscore": zscore, "pvalue": 0.5})
+    return results
+
+def _expected(results):
+    # the nested dictionaries that results were once built into
+    r = {}
+    for tissue, d in results.items():
+        for gene, zscore in zip(d.gene, d.zscore):
+            if not numpy.isfinite(zscore): continue
+            r.setdefault(gene, {})[tissue] = zscore
+    return r
+
+class TestMetaXcanResultsManager(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+
+    def tearDown(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+
+    def test_build_manager(self):
+        results = _results()
+        for tissue, d in results.items():
+            d.to_csv(os.path.join(OP, "pheno__TW_{}_0.5.csv".format(tissue)), index=False)
+        m = MetaXcanResultsManager.build_manager(OP, file_name_pattern="(.*)__TW_(.*)_0.5.csv")
+
+        expected = _expected({tissue: pandas.read_csv(os.path.join(OP, "pheno__TW_{}_0.5.csv".format(tissue))) for tissue in results})
+        self.assertEqual(m.get_genes(), set(expected.keys()))
+        self.assertEqual(m.get_model_labels(), {"Liver", "Brain", "Adipose"})
+        for gene, e in expected.items():
+            values, labels = m.results_for_gene(gene)
+            self.assertEqual(labels, sorted(e.keys()))
+            self.assertEqual(values, [e[x] for x in labels])
+        self.assertEqual(m.results_for_gene("nope"), (None, None))
+
+    def test_duplicates(self):
+        d = pandas.DataFrame({"gene": ["A", "B", "A"], "zscore": [1.0, 2.0, 3.0], "tissue": "Liver"})
+        m = MetaXcanResultsManager.MetaXcanResultsManager({"Liver": d})
+        self.assertEqual(m.results_for_gene("A"), ([3.0], ["Liver"]))
+
+        m = MetaXcanResultsManager.MetaXcanResultsManager({})
+        self.assertEqual(m.get_genes(), set())
+        self.assertEqual(m.results_for_gene("A"), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import numpy
+import numpy.testing
+import pandas
+
+import unittest
+
+from metax import Exceptions
+from metax import PredictionModel
+from metax import ModelBundle
+
+OP = ".kk_model_bundle"
+
+def _build(paths, name="models.bundle", snp_key=None):
+    output = os.path.join(OP, name)
+    ModelBundle.build_model_bundle(paths, output, snp_key)
+    return output
+
+def _paths(folder):
+    return sorted(PredictionModel._model_paths(folder))
+
+class TestModelBundle(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+
+    def tearDown(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+
+    def test_load_model(self):
+        path = _build(["tests/_td/dbs/test_1.db"])
+        self.assertTrue(ModelBundle.is_model_bundle(path))
+        self.assertFalse(ModelBundle.is_model_bundle("tests/_td/dbs/test_1.db"))
+        self.assertFalse(ModelBundle.is_model_bundle("tests/_td/dbs"))
+
+        m = PredictionModel.load_model(path)
+        e = PredictionModel.load_model("tests/_td/dbs/test_1.db")
+        pandas.testing.assert_frame_equal(m.weights, e.weights)
+        pandas.testing.assert_frame_equal(m.extra, e.extra)
+        self.assertEqual(m.snps(), e.snps())
+
+        with self.assertRaises(Exceptions.InvalidArguments):
+            PredictionModel.load_model(path, "varID")
+
+        path = _build(_paths("tests/_td/dbs"), "all.bundle")
+        with self.assertRaises(Exceptions.InvalidArguments):
+            PredictionModel.load_model(path)
+        bundle = ModelBundle.ModelBundle(path)
+        self.assertEqual(bundle.sources, ["test_1.db", "test_2.db", "test_3.db"])
+        for p in _paths("tests/_td/dbs"):
+            m = bundle.model(os.path.split(p)[1])
+            e = PredictionModel.load_model(p)
+            pandas.testing.assert_frame_equal(m.weights, e.weights)
+            pandas.testing.assert_frame_equal(m.extra, e.extra)
+
+    def test_model_manager(self):
+        for folder in ["tests/_td/dbs_2", "tests/_td/dbs_3"]:
+            path = _build(_paths(folder), os.path.split(folder)[1] + ".bundle")
+            for Klass in [PredictionModel.ModelManager, PredictionModel._ModelManager]:
+                m = PredictionModel.load_model_manager(path, Klass=Klass)
+                e = PredictionModel.load_model_manager(folder, Klass=Klass)
+                self.assertEqual(m.get_genes(), e.get_genes())
+                self.assertEqual(m.get_rsids(), e.get_rsids())
+                self.assertEqual(m.get_model_labels(), e.get_model_labels())
+                for gene in e.get_genes():
+                    if Klass == PredictionModel.ModelManager:
+                        pandas.testing.assert_frame_equal(m.get_models(gene).sort_index(), e.get_models(gene).sort_index())
+                    else:
+                        self.assertEqual(m.get_models(gene), e.get_models(gene))
+
+        path = os.path.join(OP, "dbs_3.bundle")
+        m = PredictionModel.load_model_manager(path, trim_ensemble_version=True, Klass=PredictionModel._ModelManager)
+        self.assertEqual(m.get_genes(), {"ENSG00000107937", "ENSG00000107959", "ENSG00000234745"})
+
+        m = PredictionModel.load_model_manager(path, Klass=PredictionModel._ModelManager, name_filter=["Adipose.*db$"])
+        e = PredictionModel.load_model_manager("tests/_td/dbs_3", Klass=PredictionModel._ModelManager, name_filter=["Adipose.*db$"])
+        self.assertEqual(m.get_model_labels(), e.get_model_labels())
+
+        genes = PredictionModel.load_genes(path)
+        e = PredictionModel.load_genes("tests/_td/dbs_3")
+        self.assertEqual(set(map(tuple, genes.values)), set(map(tuple, e.values)))
+
+if __name__ == '__main__':
+    unittest.main()
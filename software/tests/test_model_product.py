@@ -0,0 +1,54 @@
+import os
+import shutil
+import numpy
+import numpy.testing
+import pandas
+
+import unittest
+
+from metax import PredictionModel
+from metax import BinaryMatrixManager
+from metax.misc import DataFrameStreamer
+from metax.genotype import GeneExpressionMatrixManager
+from metax.cross_model import ModelProduct
+
+OP = ".kk_model_product"
+COVARIANCE = "tests/_td/meta_covariance/snps_covariance.txt.gz"
+
+def _streamer(whitelist=None):
+    check = (lambda x: x[1] not in whitelist or x[2] not in whitelist) if whitelist is not None else None
+    return DataFrameStreamer.data_frame_streamer(COVARIANCE, "GENE", additional_skip_row_check=check)
+
+class TestModelProduct(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+
+    def tearDown(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+
+    def test_build_model_product(self):
+        model_manager = PredictionModel.load_model_manager("tests/_td/dbs_3", Klass=PredictionModel._ArrayModelManager)
+        snps = sorted(set(pandas.read_table(COVARIANCE).RSID1))
+        for whitelist in [None, set(snps[::2])]:
+            path = os.path.join(OP, "product.bin")
+            if os.path.exists(path): os.remove(path)
+            ModelProduct.build_model_product(_streamer(whitelist), model_manager, path)
+            m = BinaryMatrixManager.load_binary_matrix_manager(path)
+            genes = set()
+            for d in _streamer(whitelist):
+                gene = d.GENE.values[0]
+                genes.add(gene)
+                tissues = sorted(model_manager.get_model_labels(gene))
+                labels, matrix = GeneExpressionMatrixManager._GeneExpressionMatrixManager(d, model_manager).get(gene, tissues)
+                _labels, _matrix = m.get(gene, tissues)
+                self.assertEqual(_labels, labels)
+                numpy.testing.assert_allclose(_matrix, matrix, rtol=1e-12)
+
+                _labels, _matrix = m.get(gene, tissues[:3])
+                self.assertEqual(_labels, [x for x in labels if x in tissues[:3]])
+            self.assertEqual(m.model_labels(), genes)
+            m.close()
+
+if __name__ == '__main__':
+    unittest.main()
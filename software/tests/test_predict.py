@@ -0,0 +1,103 @@
+import argparse
+import gzip
+import os
+import shutil
+import h5py
+import numpy
+import pandas
+
+import unittest
+
+import Predict
+
+OP = ".kk_predict"
+
+# (chromosome, id, position, allele_0, allele_1); gene A has variants in both files, rs4 is swapped respect to the model
+VARIANTS = [("2", "rs1", 10, "C", "T"), ("2", "rs2", 20, "A", "G"), ("2", "rs4", 30, "C", "T"),
+            ("10", "rs3", 10, "G", "A"), ("10", "rs5", 20, "C", "T"), ("10", "rs6", 30, "T", "C"), ("10", "rs9", 40, "A", "C")]
+
+def _write_genotypes():
+    rng = numpy.random.RandomState(0)
+    files = {}
+    for chromosome, id, position, allele_0, allele_1 in VARIANTS:
+        dosage = rng.uniform(0, 2, 10)
+        line = "\t".join([chromosome, id, str(position), allele_0, allele_1, str(numpy.mean(dosage)/2)] + [str(x) for x in dosage]) + "\n"
+        files.setdefault(os.path.join(OP, "chr{}.txt".format(chromosome)), []).append(line)
+    for path, lines in files.items():
+        with open(path, "w") as f:
+            f.writelines(lines)
+    # deliberately out of chromosome order
+    return sorted(files)
+
+def _args(name, files, *extra):
+    parser = argparse.ArgumentParser()
+    Predict.add_arguments(parser)
+    return parser.parse_args(["--model_db_path", "tests/_td/dbs/test_1.db", "--text_genotypes"] + files +
+        ["--generate_sample_ids", "10",
+         "--prediction_output", os.path.join(OP, name + ".txt"),
+         "--prediction_summary_output", os.path.join(OP, name + "_summary.txt"),
+         "--capture", os.path.join(OP, name + "_capture.txt.gz")] + list(extra))
+
+def _outputs(name):
+    prediction = pandas.read_table(os.path.join(OP, name + ".txt"))
+    summary = pandas.read_table(os.path.join(OP, name + "_summary.txt"))
+    with gzip.open(os.path.join(OP, name + "_capture.txt.gz"), "rt") as f:
+        capture = f.read()
+    return prediction, summary, capture
+
+class TestPredict(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+
+    def tearDown(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+
+    def assert_same_outputs(self, name, expected_name):
+        prediction, summary, capture = _outputs(name)
+        e_prediction, e_summary, e_capture = _outputs(expected_name)
+        self.assertEqual(list(prediction.columns), list(e_prediction.columns))
+        pandas.testing.assert_frame_equal(prediction, e_prediction, check_exact=False, rtol=1e-12)
+        pandas.testing.assert_frame_equal(summary, e_summary)
+        self.assertEqual(capture, e_capture)
+
+    def test_parallel(self):
+        files = _write_genotypes()
+        self.assertEqual(files, [os.path.join(OP, "chr10.txt"), os.path.join(OP, "chr2.txt")])
+
+        Predict.run(_args("serial", files))
+        prediction, summary, capture = _outputs("serial")
+        # genes in the order they are first predicted, following the chromosome order of the files
+        self.assertEqual(list(prediction.columns), ["FID", "IID", "A", "D", "B", "C"])
+        self.assertEqual(list(summary.n_snps_used), [3, 2, 1, 1])
+
+        Predict.run(_args("parallel", files, "--parallelism", "2"))
+        self.assert_same_outputs("parallel", "serial")
+
+        Predict.run(_args("parallel_block", files, "--parallelism", "2", "--prediction_block_size", "2"))
+        self.assert_same_outputs("parallel_block", "serial")
+
+        for name, extra in [("serial_h5", []), ("parallel_h5", ["--parallelism", "2"])]:
+            args = _args(name, files, *extra)
+            args.prediction_output = [os.path.join(OP, name + ".h5"), "HDF5"]
+            Predict.run(args)
+        with h5py.File(os.path.join(OP, "serial_h5.h5"), "r") as expected, h5py.File(os.path.join(OP, "parallel_h5.h5"), "r") as h5:
+            for key in ["genes", "samples", "computed", "pred_expr"]:
+                numpy.testing.assert_array_equal(h5[key][:], expected[key][:])
+            genes = [x.decode() if type(x) == bytes else x for x in h5["genes"][:]]
+            numpy.testing.assert_allclose(h5["pred_expr"][:][[genes.index(x) for x in prediction.columns[2:]]].T, prediction.values[:,2:].astype(float), atol=1e-3)
+        pandas.testing.assert_frame_equal(pandas.read_table(os.path.join(OP, "parallel_h5_summary.txt")), summary)
+
+    def test_parallel_stop_at_variant(self):
+        files = _write_genotypes()
+        # the variant count spans files, so this runs serially
+        Predict.run(_args("serial", files, "--stop_at_variant", "3"))
+        Predict.run(_args("parallel", files, "--stop_at_variant", "3", "--parallelism", "2"))
+        self.assert_same_outputs("parallel", "serial")
+        prediction, summary, capture = _outputs("parallel")
+        # variants past the fourth one, all in the second file, are not read
+        self.assertEqual(list(prediction.columns), ["FID", "IID", "A", "D", "B"])
+        self.assertEqual(summary.n_snps_used.fillna(0).tolist(), [3, 1, 0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import h5py
+import numpy
+import numpy.testing
+import pandas
+
+import unittest
+
+from metax import PredictionModel
+from metax.expression import Expression
+from metax.predixcan import Prediction
+from metax.predixcan.Utilities import BasicPredictionRepository, HDF5PredictionRepository
+
+OP = ".kk_prediction"
+
+def _weights():
+    w = PredictionModel.load_model("tests/_td/dbs/test_1.db").weights
+    # a variant weighting several genes, listed in non sorted order
+    extra = pandas.DataFrame({"rsid":["rs7", "rs7", "rs7"], "gene":["E", "B", "D"], "weight":[1.5, -0.5, 0.25],
+                              "effect_allele":["A", "A", "A"], "non_effect_allele":["G", "G", "G"]})
+    return pandas.concat([w, extra]).reset_index(drop=True)
+
+def _dosages(variants, n_samples):
+    rng = numpy.random.RandomState(0)
+    return [(v, rng.uniform(0, 2, n_samples)) for v in variants]
+
+def _expected(weights, dosages):
+    model = {}
+    for i in weights.itertuples():
+        model.setdefault(i.rsid, {})[i.gene] = i.weight
+    results = BasicPredictionRepository(None, None, None)
+    for variant, dosage in dosages:
+        for gene, weight in model[variant].items():
+            results.update(gene, dosage, weight)
+    return results
+
+class TestPrediction(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+        os.makedirs(OP)
+
+    def tearDown(self):
+        if os.path.exists(OP): shutil.rmtree(OP)
+
+    def test_weight_matrix(self):
+        m = Prediction.WeightMatrix(_weights())
+        self.assertEqual(list(m.genes), ["A", "B", "C", "D", "E"])
+        self.assertEqual(m.column("rs1"), 0)
+        self.assertEqual(m.column("rs7"), 6)
+        self.assertEqual(m.column("rs8"), None)
+
+        genes, w, counts = m.block([m.column("rs7"), m.column("rs1"), m.column("rs4")])
+        self.assertEqual(list(genes), ["E", "B", "D", "A"])
+        numpy.testing.assert_array_equal(counts, [1, 2, 2, 1])
+        numpy.testing.assert_array_equal(w.toarray(),
+            [[1.5, 0, 0],
+             [-0.5, 0, 0.4],
+             [0.25, 0.6, 0],
+             [0, 0.2, 0]])
+
+    def test_prediction_engine(self):
+        weights = _weights()
+        variants = ["rs2", "rs1", "rs7", "rs6", "rs3", "rs1", "rs5", "rs4"]
+        dosages = _dosages(variants, 10)
+        expected = _expected(weights, dosages)
+
+        for block_size in [1, 3, 8, 100]:
+            results = BasicPredictionRepository(None, None, None)
+            engine = Prediction.PredictionEngine(Prediction.WeightMatrix(weights), results, 10, block_size)
+            for variant, dosage in dosages:
+                engine.update(variant, dosage)
+            engine.flush()
+            engine.flush()
+
+            self.assertEqual(list(results.genes), list(expected.genes))
+            self.assertEqual(results.stats, expected.stats)
+            for gene in expected.genes:
+                numpy.testing.assert_allclose(results.genes[gene], expected.genes[gene], rtol=1e-12)
+
+    def test_basic_repository(self):
+        weights = _weights()
+        variants = ["rs2", "rs1", "rs7", "rs6", "rs3", "rs1", "rs5", "rs4"]
+        dosages = _dosages(variants, 10)
+        expected = _expected(weights, dosages)
+        samples = pandas.DataFrame({"FID":["s{}".format(i) for i in range(10)], "IID":["s{}".format(i) for i in range(10)]})
+        extra = pandas.DataFrame({"gene":["A", "B", "C", "D", "E", "F"]})
+
+        results = BasicPredictionRepository(samples, extra, None)
+        for variant, dosage in dosages:
+            for gene, weight in weights[weights.rsid == variant][["gene", "weight"]].values:
+                results.update(gene, dosage, weight)
+        results.update_block(["E", "F"], [numpy.ones(10), numpy.ones(10)], [1, 2])
+
+        self.assertEqual(results.prediction.shape, (6, 10))
+        self.assertEqual(list(results.genes), list(expected.genes) + ["F"])
+        self.assertEqual(results.stats, {**expected.stats, "E":[2, ], "F":[2, ]})
+        for gene in expected.genes:
+            e = expected.genes[gene] + 1 if gene == "E" else expected.genes[gene]
+            numpy.testing.assert_allclose(results.genes[gene], e, rtol=1e-12)
+        numpy.testing.assert_array_equal(results.prediction[5], numpy.ones(10))
+
+        # expression is served straight from the prediction matrix
+        expression = Expression.ExpressionFromData(results.genes)
+        self.assertEqual(expression.get_genes(), list(results.genes))
+        self.assertTrue(numpy.shares_memory(expression.expression_for_gene("C"), results.prediction))
+
+        # genes missing from extra still get predicted, in rows of their own
+        results = BasicPredictionRepository(samples, extra[extra.gene != "C"], None)
+        for variant, dosage in dosages:
+            for gene, weight in weights[weights.rsid == variant][["gene", "weight"]].values:
+                results.update(gene, dosage, weight)
+        results.update_block(["C", "G"], [numpy.ones(10), numpy.ones(10)], [1, 1])
+        self.assertEqual(results.prediction.shape, (5, 10))
+        self.assertEqual(list(results.genes), list(expected.genes) + ["G"])
+        self.assertFalse(numpy.shares_memory(results.genes["C"], results.prediction))
+        numpy.testing.assert_allclose(results.genes["C"], expected.genes["C"] + 1, rtol=1e-12)
+        numpy.testing.assert_array_equal(results.genes["G"], numpy.ones(10))
+
+    def test_hdf5_repository(self):
+        weights = _weights()
+        variants = ["rs2", "rs1", "rs7", "rs6", "rs3", "rs1", "rs5", "rs4"]
+        dosages = _dosages(variants, 10)
+        expected = _expected(weights, dosages)
+        samples = pandas.DataFrame({"FID":["s{}".format(i) for i in range(10)], "IID":["s{}".format(i) for i in range(10)]})
+        extra = pandas.DataFrame({"gene":["A", "B", "C", "D", "E", "F"]})
+
+        # a buffer of a single chunk forces blocks to be written and read back
+        for chunk_genes, buffer_size in [(None, None), (2, 1), (4, 1), (100, 1)]:
+            path = os.path.join(OP, "p.h5")
+            with HDF5PredictionRepository(samples, extra, path, chunk_genes, buffer_size) as results:
+                for variant, dosage in dosages:
+                    for gene, weight in weights[weights.rsid == variant][["gene", "weight"]].values:
+                        results.update(gene, dosage, weight)
+                results.update_block(["E", "A"], [numpy.ones(10), numpy.ones(10)], [1, 2])
+            self.assertEqual(results.stats, {**expected.stats, "E":[2, ], "A":[expected.stats["A"][0] + 2, ]})
+
+            with h5py.File(path, "r") as h5:
+                self.assertEqual(h5["pred_expr"].chunks, (min(chunk_genes or 10, 6), 10))
+                numpy.testing.assert_array_equal(h5["computed"][:], [1, 1, 1, 1, 1, 0])
+                prediction = h5["pred_expr"][:]
+            for i, gene in enumerate(extra.gene):
+                e = expected.genes[gene] if gene in expected.genes else numpy.zeros(10)
+                if gene in ("A", "E"):
+                    e = e + 1
+                numpy.testing.assert_allclose(prediction[i], e, atol=1e-3)
+            os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
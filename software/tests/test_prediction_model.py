@@ -163,5 +163,27 @@ class TestPredictionModelDB(unittest.TestCase):
         _assert_optimized_manager(self, model_manager, weights, {"ENSG00000107937", "ENSG00000107959", "ENSG00000234745"})
 
 
+    def test_array_model_manager(self):
+        for folder, trim in [("tests/_td/dbs_2", False), ("tests/_td/dbs_3", False), ("tests/_td/dbs_3", True)]:
+            model_manager = PredictionModel.load_model_manager(folder, trim_ensemble_version=trim, Klass=PredictionModel._ArrayModelManager)
+            expected = PredictionModel.load_model_manager(folder, trim_ensemble_version=trim, Klass=PredictionModel._ModelManager)
+            self.assertEqual(model_manager.get_genes(), expected.get_genes())
+            self.assertEqual(model_manager.get_rsids(), expected.get_rsids())
+            self.assertEqual(model_manager.get_model_labels(), expected.get_model_labels())
+            for gene in expected.get_genes():
+                self.assertEqual(model_manager.get_models(gene), expected.get_models(gene))
+                self.assertEqual(model_manager.get_rsids(gene), expected.get_rsids(gene))
+                self.assertEqual(model_manager.get_model_labels(gene), expected.get_model_labels(gene))
+            self.assertIsNone(model_manager.get_rsids("nope"))
+            self.assertIsNone(model_manager.get_model_labels("nope"))
+
+            expected = PredictionModel.load_model_manager(folder, trim_ensemble_version=trim)
+            rsids = sorted(model_manager.get_rsids())
+            for snps in [rsids[:3], rsids[::7], ["nope"], []]:
+                self.assertEqual(model_manager.get_implicated_genes(snps), expected.get_implicated_genes(snps))
+
+        _assert_optimized_manager(self, PredictionModel.load_model_manager("tests/_td/dbs_2", Klass=PredictionModel._ArrayModelManager),
+                                  get_weights_in_models("tests/_td/dbs_2"), {'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K'})
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
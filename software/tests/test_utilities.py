@@ -1,6 +1,9 @@
 import unittest
 import sys
 import re
+import os
+import shutil
+import pandas
 
 if "DEBUG" in sys.argv:
     sys.path.insert(0, "..")
@@ -233,3 +236,22 @@ class TestUtilities(unittest.TestCase):
              (4, ["rs3:3:C:T", "10511", "G", "A", "Biallelic_SNP", "0", "0", "0", "0", "0", "0"]),
              (5, ["rs4:4:C:T", "10511", "G", "A", "Biallelic_SNP", "0", "0", "0", "0", "0", "0"])]
         )
+
+    def testSaveDataframeAtomically(self):
+        op = ".kk_atomic"
+        if os.path.exists(op): shutil.rmtree(op)
+        d = pandas.DataFrame({"a":[1, 2], "b":["x", None]})
+        for name in ["d.csv", "d.csv.gz"]:
+            path = os.path.join(op, "sub", name)
+            Utilities.save_dataframe_atomically(d, path, index=False, na_rep="NA")
+            pandas.testing.assert_frame_equal(pandas.read_csv(path, keep_default_na=False), d.fillna("NA"))
+        self.assertEqual(sorted(os.listdir(os.path.join(op, "sub"))), ["d.csv", "d.csv.gz"])
+
+        class Broken(object):
+            def to_csv(self, path, **kwargs):
+                with open(path, "w") as f: f.write("partial")
+                raise RuntimeError("broken")
+        with self.assertRaises(RuntimeError):
+            Utilities.save_dataframe_atomically(Broken(), os.path.join(op, "sub", "e.csv"))
+        self.assertEqual(sorted(os.listdir(os.path.join(op, "sub"))), ["d.csv", "d.csv.gz"])
+        shutil.rmtree(op)